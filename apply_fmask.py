@@ -15,24 +15,27 @@
 # =============================================================================================
 
 import os
+import sys
 
-from sat_image.image import LandsatImage
+from ssebop.masks import batch_fmask, FAILED
 
-from sat_image.fmask import Fmask
 
+def fmask(directory, workers=None, overwrite=False):
+    """ Write <image_id>_fmask.tif into every scene directory under directory.
 
-def fmask(directory):
-    dirs = [os.path.join(directory, x) for x in os.listdir(directory)]
-    for d in dirs:
-        l = LandsatImage(d)
-        f = Fmask(l)
-        pass
+    Scenes with a mask newer than their MTL file are skipped; see ssebop.masks.batch_fmask.
+    :return: number of scenes that failed
+    """
+    results = batch_fmask(directory, workers=workers, overwrite=overwrite)
+    return len([r for r in results if r[1] == FAILED])
 
 
 if __name__ == '__main__':
     home = os.path.expanduser('~')
     top_level = os.path.join(home, 'images', 'irrigation',
                              'MT', 'landsat', 'LC8_39_27')
-    fmask(top_level)
+    if len(sys.argv) > 1:
+        top_level = sys.argv[1]
+    sys.exit(1 if fmask(top_level) else 0)
 
 # ========================= EOF ====================================================================
@@ -0,0 +1,70 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+from numpy import count_nonzero, uint8, linspace
+from numpy.random import RandomState
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ssebop.c_factor import c_factor_exact, c_factor_sampled
+
+
+def scene(size, seed=1):
+    rng = RandomState(seed)
+    shape = (size, size)
+    ndvi = rng.uniform(0., 0.6, shape)
+    cold = rng.uniform(size=shape) < 0.3
+    ndvi[cold] = rng.uniform(0.71, 0.9, count_nonzero(cold))
+    ts = rng.normal(310., 6., shape)
+    ts[cold] = rng.normal(300., 2., count_nonzero(cold))
+    tmax = 290. + linspace(0., 3., size)[None, :].repeat(size, axis=0)
+    fmask = (rng.uniform(size=shape) < 0.2).astype(uint8)
+    return ts, ndvi, tmax, fmask
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare exact and sampled c-factor estimates')
+    parser.add_argument('--size', type=int, default=4000, help='Scene rows and columns')
+    parser.add_argument('--step', type=int, default=8)
+    args = parser.parse_args()
+
+    arrays = scene(args.size)
+    exact, t_exact = timed(c_factor_exact, *arrays)
+    print('exact       c = {:.5f}  {:7.3f} s'.format(exact.c, t_exact))
+    for method in ('strided', 'stratified'):
+        est, t = timed(c_factor_sampled, *arrays, method=method, step=args.step)
+        print('{:<11s} c = {:.5f}  {:7.3f} s  x{:.1f}  95% [{:.5f}, {:.5f}]  contains exact: {}'.format(
+            method, est.c, t, t_exact / t, est.low, est.high, est.low <= exact.c <= est.high))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
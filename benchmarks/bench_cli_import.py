@@ -0,0 +1,85 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# packages that must not be imported just to start the CLI
+HEAVY = ('numpy', 'rasterio', 'sat_image', 'met', 'dem', 'bounds',
+         'landsat', 'dask', 'xarray', 'ssebop.ssebop')
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([ROOT, env.get('PYTHONPATH', '')])
+    return env
+
+
+def help_latency(repeat=5):
+    """ Wall time of 'ssebop --help' in a fresh interpreter, in seconds. """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-m', 'ssebop_app.cli', '--help'],
+                              stdout=subprocess.DEVNULL, env=_env())
+        times.append(time.time() - start)
+    return sorted(times)
+
+
+def heavy_imports():
+    """ Heavy packages loaded by importing the CLI. """
+    code = ('import sys, ssebop_app.cli; '
+            'print(" ".join(m for m in sys.argv[1:] if m in sys.modules))')
+    out = subprocess.check_output([sys.executable, '-c', code] + list(HEAVY), env=_env())
+    return out.decode().split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track "ssebop --help" start-up latency')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--record', default=None, help='CSV file to append results to')
+    args = parser.parse_args()
+
+    times = help_latency(args.repeat)
+    median = times[len(times) // 2]
+    heavy = heavy_imports()
+
+    print('ssebop --help: median {:.3f} s, min {:.3f} s over {} runs'.format(median, times[0], len(times)))
+    print('heavy modules imported: {}'.format(', '.join(heavy) if heavy else 'none'))
+
+    if args.record:
+        new = not os.path.isfile(args.record)
+        with open(args.record, 'a') as f:
+            if new:
+                f.write('date,median_s,min_s,heavy\n')
+            f.write('{},{:.4f},{:.4f},{}\n'.format(datetime.now().isoformat(), median,
+                                                   times[0], ' '.join(heavy)))
+
+    return 1 if heavy else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
@@ -0,0 +1,156 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+from numpy import abs as np_abs, cos, deg2rad, errstate, inf, log, nan, nanmax, pi, sin, where
+from rasterio import open as rasopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ssebop.kernels import SENSOR_BANDS, ESUN, THERMAL_K, earth_sun_distance, surface_parameters
+from ssebop.mtl import parse_mtl
+from ssebop.screen import band_path
+
+IMAGE_TEST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'tests', 'data', 'image_test')
+SCENES = {'LC8': 'lc8_image', 'LT5': 'lt5_image', 'LE7': 'le7_image'}
+
+
+class PerCall(object):
+    """ The sat_image way: every product reads and converts its own bands, in float64. """
+
+    def __init__(self, image_dir, satellite):
+        self.image_dir = image_dir
+        self.satellite = satellite
+        self.meta = parse_mtl(image_dir)
+
+    def _dn(self, band):
+        with rasopen(band_path(self.image_dir, self.meta, band)) as src:
+            dn = src.read(1).astype(float)
+        dn[dn < 1] = nan
+        return dn
+
+    def radiance(self, band):
+        m = self.meta
+        if self.satellite == 'LC8':
+            return self._dn(band) * m['radiance_mult_band_{}'.format(band)] + \
+                   m['radiance_add_band_{}'.format(band)]
+        qmin, qmax = m['quantize_cal_min_band_{}'.format(band)], m['quantize_cal_max_band_{}'.format(band)]
+        lmin, lmax = m['radiance_minimum_band_{}'.format(band)], m['radiance_maximum_band_{}'.format(band)]
+        return ((lmax - lmin) / (qmax - qmin)) * (self._dn(band) - qmin) + lmin
+
+    def reflectance(self, band):
+        m = self.meta
+        elev = m['sun_elevation']
+        if self.satellite == 'LC8':
+            return (self._dn(band) * m['reflectance_mult_band_{}'.format(band)] +
+                    m['reflectance_add_band_{}'.format(band)]) / sin(deg2rad(elev))
+        d = earth_sun_distance(m['date_acquired'])
+        return pi * self.radiance(band) * d ** 2 / (ESUN[self.satellite][band] *
+                                                     cos(deg2rad(90. - elev)))
+
+    def ndvi(self):
+        _, red, nir, _, _ = SENSOR_BANDS[self.satellite][0]
+        red, nir = self.reflectance(red), self.reflectance(nir)
+        with errstate(divide='ignore', invalid='ignore'):
+            ndvi = (nir - red) / (nir + red)
+        ndvi[ndvi == inf] = nan
+        return ndvi
+
+    def albedo(self):
+        blue, red, nir, swir1, swir2 = [self.reflectance(b) for b in SENSOR_BANDS[self.satellite][0]]
+        return (0.356 * blue + 0.130 * red + 0.373 * nir + 0.085 * swir1 + 0.072 * swir2 -
+                0.0018) / 1.014
+
+    def emissivity(self):
+        ndvi = self.ndvi()
+        with errstate(invalid='ignore'):
+            lai = where(7. * ndvi ** 3 > 6., 6., 7. * ndvi ** 3)
+            epsilon = where((ndvi > 0) & (lai <= 3), 0.97 + 0.0033 * lai, nan)
+            epsilon = where((ndvi > 0) & (lai > 3), 0.98, epsilon)
+            epsilon = where(ndvi <= 0, 0.99, epsilon)
+        return epsilon
+
+    def land_surface_temp(self):
+        thermal = SENSOR_BANDS[self.satellite][1]
+        if self.satellite == 'LC8':
+            k1, k2 = self.meta['k1_constant_band_10'], self.meta['k2_constant_band_10']
+        else:
+            k1, k2 = THERMAL_K[self.satellite]
+        epsilon = self.emissivity()
+        with errstate(divide='ignore', invalid='ignore'):
+            rc = (self.radiance(thermal) - 0.91) / 0.866 - (1 - epsilon) * 1.32
+            return k2 / log(epsilon * k1 / rc + 1)
+
+
+def per_call(image_dir, satellite):
+    image = PerCall(image_dir, satellite)
+    return image.land_surface_temp(), image.ndvi(), image.albedo()
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-call and fused surface parameters')
+    parser.add_argument('--satellite', default='LC8', choices=sorted(SCENES))
+    parser.add_argument('--image-dir', help='Scene directory, default is the test scene')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    image_dir = args.image_dir or os.path.join(IMAGE_TEST, SCENES[args.satellite])
+    engines = ['numpy']
+    try:
+        import numba
+        engines.append('numba')
+        # compile outside the timings
+        surface_parameters(image_dir, args.satellite, engine='numba')
+    except ImportError:
+        print('numba is not installed, timing the numpy engine only')
+
+    reference, t_ref = None, []
+    for _ in range(args.repeat):
+        reference, t = timed(per_call, image_dir, args.satellite)
+        t_ref.append(t)
+    t_ref = min(t_ref)
+    print('per call      {:7.3f} s'.format(t_ref))
+
+    for engine in engines:
+        result, t = None, []
+        for _ in range(args.repeat):
+            result, dt = timed(surface_parameters, image_dir, args.satellite, engine=engine)
+            t.append(dt)
+        t = min(t)
+        diffs = ['{} {:.2e}'.format(name, nanmax(np_abs(ref - arr)))
+                 for name, ref, arr in zip(result._fields, reference, result)]
+        print('{:<13s} {:7.3f} s  x{:.1f}  max abs diff: {}'.format(
+            engine, t, t_ref / t, ', '.join(diffs)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
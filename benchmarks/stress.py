@@ -0,0 +1,162 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_scenes, runspec, SATELLITE
+
+# 'kernel' computes LST, NDVI and albedo; 'inputs' also reads the met, DEM and fmask
+# inputs as the model does; 'model' runs SSEBopModel and writes its products
+STAGES = ('kernel', 'inputs', 'model')
+
+
+def run_stage(stage, root, image_dir, options=None):
+    """ Run one scene through a stage in this process.
+
+    :return: (seconds, peak resident memory of this process in bytes)
+    """
+    start = time.time()
+    if stage == 'kernel':
+        from ssebop.kernels import surface_parameters
+        surface_parameters(image_dir, SATELLITE)
+    elif stage == 'inputs':
+        _read_inputs(image_dir)
+    elif stage == 'model':
+        from ssebop.ssebop import SSEBopModel
+        sseb = SSEBopModel(runspec(root, image_dir, **(options or {})))
+        sseb.configure_run()
+        sseb.run(overwrite=True)
+    else:
+        raise ValueError('Invalid stage: "{}", available = {}'.format(stage, STAGES))
+    return time.time() - start, _max_rss()
+
+
+def _read_inputs(image_dir):
+    from datetime import datetime
+    from rasterio import open as rasopen
+    from ssebop.collector import SSEBopData
+    from ssebop.kernels import surface_parameters
+    from ssebop.screen import band_path
+    from ssebop.mtl import parse_mtl
+
+    image_id = os.path.basename(image_dir)
+    with rasopen(band_path(image_dir, parse_mtl(image_dir), 10)) as src:
+        profile = src.profile
+    data = SSEBopData(image_id, image_dir, profile['transform'], profile, clip_geo=None,
+                      date=datetime.strptime(image_id[9:16], '%Y%j'))
+    surface_parameters(image_dir, SATELLITE)
+    for variable in ('tmax', 'tmin', 'dem', 'pet', 'fmask'):
+        data.data_check(variable)
+
+
+def _max_rss():
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def stress(sizes, count, stage='model', workers=1, root=None, options=None, seed=0):
+    """ Throughput and memory of a stage over synthetic scenes of each size.
+
+    Scenes of each size are written first and are not timed; each size then runs in
+    fresh worker processes, so a worker's peak memory is that of the size alone.
+
+    :param sizes: scene (rows, cols) to try, e.g. [(1000, 1000), (7800, 8800)]
+    :param count: scenes of each size
+    :param stage: one of STAGES
+    :param workers: scenes run at once, one process each
+    :param root: directory for the scenes, default a temporary one, removed after
+    :param options: RunSpec config values of the model stage, e.g. {'backend': 'dask'}
+    :return: list of OrderedDict, one per size
+    """
+    if stage not in STAGES:
+        raise ValueError('Invalid stage: "{}", available = {}'.format(stage, STAGES))
+    temporary = root is None
+    root = root or mkdtemp(prefix='ssebop_stress_')
+    results = []
+    try:
+        for rows, cols in sizes:
+            size_root = os.path.join(root, '{}x{}'.format(rows, cols))
+            scenes = write_scenes(size_root, count, shape=(rows, cols), seed=seed)
+            context = multiprocessing.get_context('spawn')
+            start = time.time()
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                runs = list(pool.map(run_stage, [stage] * count, [size_root] * count,
+                                     [d for _, d in scenes], [options] * count))
+            wall = time.time() - start
+
+            seconds = sorted(r[0] for r in runs)
+            result = OrderedDict()
+            result['rows'], result['cols'] = rows, cols
+            result['scenes'] = count
+            result['workers'] = workers
+            result['median_s'] = seconds[len(seconds) // 2]
+            result['mpix_per_s'] = rows * cols * count / wall / 1e6
+            result['scenes_per_hour'] = count / wall * 3600.
+            result['peak_rss_mb'] = max(r[1] for r in runs) / 2. ** 20
+            results.append(result)
+    finally:
+        if temporary:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def format_results(results):
+    lines = ['{:>12s}{:>8s}{:>8s}{:>10s}{:>10s}{:>12s}{:>12s}'.format(
+        'size', 'scenes', 'workers', 'median s', 'Mpx/s', 'scenes/h', 'peak MB')]
+    for r in results:
+        lines.append('{:>12s}{:>8d}{:>8d}{:>10.2f}{:>10.2f}{:>12.0f}{:>12.0f}'.format(
+            '{}x{}'.format(r['rows'], r['cols']), r['scenes'], r['workers'], r['median_s'],
+            r['mpix_per_s'], r['scenes_per_hour'], r['peak_rss_mb']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and memory of the model on synthetic scenes')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 2000, 4000, 8000],
+                        help='Square scene sizes in pixels')
+    parser.add_argument('--count', type=int, default=4, help='Scenes of each size')
+    parser.add_argument('--stage', default='model', choices=STAGES)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'dask'])
+    parser.add_argument('--root', default=None, help='Keep the scenes in this directory')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    results = stress([(s, s) for s in args.sizes], args.count, stage=args.stage,
+                     workers=args.workers, root=args.root, options={'backend': args.backend})
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
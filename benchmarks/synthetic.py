@@ -0,0 +1,296 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+from numpy import arange, clip, cos, exp, float32, minimum, pi, sin, uint8, uint16, where, zeros
+from numpy.random import RandomState
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ssebop.collector import variable_path
+from ssebop.file_index import index_for
+from ssebop.kernels import coefficients, RP, TAU, RSKY, SENSOR_BANDS
+from ssebop.masks import save_mask, CLOUD, SHADOW
+from ssebop.mtl import parse_mtl
+from ssebop_app.config import RunSpec
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'tests', 'data', 'image_test', 'lc8_image', 'LC80400282014193LGN00_MTL.txt')
+
+SATELLITE = 'LC8'
+
+# a full WRS-2 scene, and the path/row, UTM zone and upper left pixel center of the template
+FULL_SHAPE = (7800, 8800)
+PATH, ROW = 40, 28
+CRS_UTM = CRS.from_epsg(32612)
+UL = (219600., 5220000.)
+CELL = 30.
+
+# square fields of irrigated or dry land, in pixels, and the irrigated share
+FIELD = 32
+IRRIGATED = 0.25
+
+# bands written by default, those the model reads; all_bands adds 1, 3, 8, 9 and 11
+MODEL_BANDS = SENSOR_BANDS[SATELLITE][0] + (SENSOR_BANDS[SATELLITE][1],)
+ALL_BANDS = tuple(range(1, 12))
+
+BLOCK_ROWS = 512
+
+GTIFF = {'driver': 'GTiff', 'count': 1, 'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+         'compress': 'deflate'}
+
+
+def scene_ids(count, path=PATH, row=ROW, start=datetime(2014, 4, 7), step=16):
+    """ Landsat 8 scene ids and dates, one every step days from start. """
+    dates = [start + timedelta(days=step * i) for i in range(count)]
+    return [('LC8{:03d}{:03d}{}LGN00'.format(path, row, d.strftime('%Y%j')), d) for d in dates]
+
+
+def scene_profile(shape):
+    """ Scene grid with the template's upper left corner. """
+    return dict(GTIFF, crs=CRS_UTM, height=shape[0], width=shape[1],
+                transform=from_origin(UL[0] - CELL / 2., UL[1] + CELL / 2., CELL, CELL))
+
+
+def mtl_text(image_id, date, shape, path=PATH, row=ROW):
+    """ The template MTL, rewritten for a scene id, date and size. """
+    with open(TEMPLATE) as f:
+        text = f.read()
+
+    ul_x, ul_y = UL
+    lr_x, lr_y = ul_x + CELL * (shape[1] - 1), ul_y - CELL * (shape[0] - 1)
+    corners = {'UL': (ul_x, ul_y), 'UR': (lr_x, ul_y), 'LL': (ul_x, lr_y), 'LR': (lr_x, lr_y)}
+    lons, lats = transform_coords(CRS_UTM, CRS.from_epsg(4326), [c[0] for c in corners.values()],
+                                  [c[1] for c in corners.values()])
+
+    values = {'LANDSAT_SCENE_ID': '"{}"'.format(image_id),
+              'DATE_ACQUIRED': date.strftime('%Y-%m-%d'),
+              'WRS_PATH': path, 'WRS_ROW': row, 'TARGET_WRS_PATH': path, 'TARGET_WRS_ROW': row,
+              'REFLECTIVE_LINES': shape[0], 'REFLECTIVE_SAMPLES': shape[1],
+              'THERMAL_LINES': shape[0], 'THERMAL_SAMPLES': shape[1],
+              'PANCHROMATIC_LINES': shape[0] * 2 - 1, 'PANCHROMATIC_SAMPLES': shape[1] * 2 - 1,
+              'METADATA_FILE_NAME': '"{}_MTL.txt"'.format(image_id),
+              'FILE_NAME_BAND_QUALITY': '"{}_BQA.TIF"'.format(image_id)}
+    for band in ALL_BANDS:
+        values['FILE_NAME_BAND_{}'.format(band)] = '"{}_B{}.TIF"'.format(image_id, band)
+    for (name, (x, y)), lon, lat in zip(corners.items(), lons, lats):
+        values['CORNER_{}_LAT_PRODUCT'.format(name)] = '{:.5f}'.format(lat)
+        values['CORNER_{}_LON_PRODUCT'.format(name)] = '{:.5f}'.format(lon)
+        values['CORNER_{}_PROJECTION_X_PRODUCT'.format(name)] = '{:.3f}'.format(x)
+        values['CORNER_{}_PROJECTION_Y_PRODUCT'.format(name)] = '{:.3f}'.format(y)
+
+    for key, val in values.items():
+        text = re.sub(r'(?m)^(\s*{} = ).*$'.format(key), r'\g<1>{}'.format(val), text)
+    return text
+
+
+class SyntheticScene(object):
+    """ A Landsat 8 scene with its met, DEM and fmask inputs, made up and written offline.
+
+    Fields of FIELD pixels are irrigated, with NDVI near 0.85 and surfaces a few degrees
+    above the air, or dry, with NDVI near 0.25 and surfaces 15 K or so warmer; bands are
+    the DN that give these through the model's own conversions, so every scene has cold
+    pixels for the c-factor. Air temperature, reference ET and elevation are smooth
+    across the scene. Everything is written block by block, so full-size scenes are made
+    in bounded memory; the same seed makes the same scene.
+    """
+
+    def __init__(self, image_id, date, shape=FULL_SHAPE, seed=0, cloud=0.1):
+        self.image_id = image_id
+        self.date = date
+        self.shape = tuple(shape)
+        self.seed = seed
+        self.cloud = cloud
+        self.profile = scene_profile(self.shape)
+        rng = RandomState(seed)
+        fields = (self.shape[0] // FIELD + 1, self.shape[1] // FIELD + 1)
+        self.irrigated = rng.uniform(size=fields) < IRRIGATED
+        self.clouded = rng.uniform(size=fields) < cloud
+
+    def write(self, root, all_bands=False):
+        """ Write the scene under root/<path>/<row>/<year>/<image_id>, as the model finds it.
+
+        :param root: project root
+        :param all_bands: write every band and the quality band, else only those the
+        model reads
+        :return: the scene directory
+        """
+        path, row = int(self.image_id[3:6]), int(self.image_id[6:9])
+        image_dir = os.path.join(root, str(path), str(row), str(self.date.year), self.image_id)
+        if not os.path.isdir(image_dir):
+            os.makedirs(image_dir)
+
+        mtl = os.path.join(image_dir, '{}_MTL.txt'.format(self.image_id))
+        with open(mtl, 'w') as f:
+            f.write(mtl_text(self.image_id, self.date, self.shape, path, row))
+        coef = coefficients(parse_mtl(mtl), SATELLITE)
+
+        bands = ALL_BANDS if all_bands else MODEL_BANDS
+        band_meta = dict(self.profile, dtype='uint16', nodata=0)
+        float_meta = dict(self.profile, dtype='float32', nodata=None)
+        outputs = {b: os.path.join(image_dir, '{}_B{}.TIF'.format(self.image_id, b)) for b in bands}
+        if all_bands:
+            outputs['QUALITY'] = os.path.join(image_dir, '{}_BQA.TIF'.format(self.image_id))
+        inputs = ('tmax', 'tmin', 'pet', 'dem')
+        paths = {v: variable_path(image_dir, self.image_id, v) for v in inputs}
+        if os.path.isfile(paths['dem']):
+            # shared by the scenes of the year directory, as a fetched DEM is
+            paths.pop('dem')
+
+        flags = zeros(self.shape, dtype=uint8)
+        datasets = {}
+        try:
+            for key, p in outputs.items():
+                datasets[key] = rasopen(p, 'w', **band_meta)
+            for var, p in paths.items():
+                datasets[var] = rasopen(p, 'w', **float_meta)
+
+            for start in range(0, self.shape[0], BLOCK_ROWS):
+                stop = min(start + BLOCK_ROWS, self.shape[0])
+                window = Window(0, start, self.shape[1], stop - start)
+                block = self._block(start, stop, coef)
+                flags[start:stop] = block.pop('flags')
+                for key, dst in datasets.items():
+                    arr = block.get(key)
+                    if arr is None:
+                        # bands the model does not read
+                        arr = block[coef.bands[1]]
+                    dst.write(arr[None], window=window)
+        finally:
+            for dst in datasets.values():
+                dst.close()
+        # written around the file index, which may have listed the directory already
+        index = index_for()
+        for p in [mtl] + list(outputs.values()) + list(paths.values()):
+            index.record(p)
+
+        save_mask(flags, variable_path(image_dir, self.image_id, 'fmask'), self.profile)
+        return image_dir
+
+    def _block(self, start, stop, coef):
+        rows = arange(start, stop)[:, None]
+        cols = arange(self.shape[1])[None, :]
+        rng = RandomState((self.seed, start))
+        noise = rng.normal(size=(stop - start, self.shape[1])).astype(float32)
+
+        irrigated = self.irrigated[rows // FIELD, cols // FIELD]
+        ndvi = where(irrigated, 0.85, 0.25) + 0.03 * noise
+        ndvi = clip(ndvi, 0.05, 0.95).astype(float32)
+
+        # across the scene: 6 K of air temperature, 3 mm of reference ET, hills
+        u, v = cols / float(self.shape[1]), rows / float(self.shape[0])
+        tmax = (297. + 6. * u - 2. * v).astype(float32)
+        tmin = tmax - 15.
+        pet = (5. + 3. * u).astype(float32) + zeros((stop - start, 1), dtype=float32)
+        dem = (1200. + 300. * sin(2. * pi * u) * cos(pi * v)).astype(float32)
+
+        ts = tmax + where(irrigated, 3., 18.) + (0.85 - ndvi) * 10. + 0.5 * noise
+
+        red = 0.04 + (1. - ndvi) * 0.1
+        nir = red * (1. + ndvi) / (1. - ndvi)
+        reflectance = (0.8 * red, red, nir, 0.25 - 0.12 * ndvi, 0.6 * (0.25 - 0.12 * ndvi))
+
+        block = {}
+        for band, rho, gain, offset in zip(coef.bands, reflectance, coef.gains, coef.offsets):
+            block[band] = _dn((rho - offset) / gain)
+        thermal, gain, offset = coef.bands[-1], coef.gains[-1], coef.offsets[-1]
+        block[thermal] = _dn((_radiance(ts, ndvi, coef.k1, coef.k2) - offset) / gain)
+        block['QUALITY'] = zeros(ndvi.shape, dtype=uint16) + 2720
+
+        clouded = self.clouded[rows // FIELD, cols // FIELD]
+        # a cloud over part of its field, and its shadow beside it
+        block['flags'] = (where(clouded & (rows % FIELD < FIELD // 2), CLOUD, 0) |
+                          where(clouded & (rows % FIELD >= FIELD // 2), SHADOW, 0)).astype(uint8)
+        block.update({'tmax': tmax + zeros(ndvi.shape, dtype=float32),
+                      'tmin': tmin + zeros(ndvi.shape, dtype=float32),
+                      'pet': pet, 'dem': dem + zeros(ndvi.shape, dtype=float32)})
+        return block
+
+
+def _radiance(ts, ndvi, k1, k2):
+    """ Thermal radiance of a surface temperature, the inverse of the model's conversion. """
+    lai = minimum(7. * ndvi ** 3, 6.)
+    epsilon = where(lai > 3., 0.98, 0.97 + 0.0033 * lai)
+    rc = epsilon * k1 / (exp(k2 / ts) - 1.)
+    return (rc + (1. - epsilon) * RSKY) * TAU + RP
+
+
+def _dn(arr):
+    return clip(arr + 0.5, 1, 65535).astype(uint16)
+
+
+def write_scenes(root, count, shape=FULL_SHAPE, seed=0, cloud=0.1, all_bands=False, **kwargs):
+    """ Write count scenes of a path/row, see scene_ids for the keywords.
+
+    :return: list of (image_id, image_dir)
+    """
+    scenes = []
+    for i, (image_id, date) in enumerate(scene_ids(count, **kwargs)):
+        scene = SyntheticScene(image_id, date, shape=shape, seed=seed + i, cloud=cloud)
+        scenes.append((image_id, scene.write(root, all_bands=all_bands)))
+    return scenes
+
+
+def runspec(root, image_dir, **options):
+    """ RunSpec of a synthetic scene; its inputs are on disk, so the model runs offline.
+
+    :param options: config values, e.g. backend='dask' or surface_kernel=False
+    """
+    image_id = os.path.basename(image_dir)
+    spec = {'path': int(image_id[3:6]), 'row': int(image_id[6:9]), 'satellite': SATELLITE,
+            'root': root, 'image_id': image_id, 'image_dir': image_dir,
+            'parent_dir': os.path.dirname(image_dir), 'image_exists': True,
+            'verify_paths': False, 'agrimet_corrected': False, 'use_existing_images': True,
+            'dt_source': 'scene', 'backend': 'numpy', 'surface_kernel': True, 'screen': False,
+            'image_date': datetime.strptime(image_id[9:16], '%Y%j').strftime('%Y%m%d')}
+    spec.update(options)
+    return RunSpec.from_dict(spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Landsat 8 scenes and model inputs')
+    parser.add_argument('root', help='Project root the scenes are written under')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=FULL_SHAPE[0])
+    parser.add_argument('--cols', type=int, default=FULL_SHAPE[1])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cloud', type=float, default=0.1, help='Share of clouded fields')
+    parser.add_argument('--all-bands', action='store_true', help='Write all eleven bands and BQA')
+    args = parser.parse_args()
+
+    for image_id, image_dir in write_scenes(args.root, args.count, shape=(args.rows, args.cols),
+                                            seed=args.seed, cloud=args.cloud,
+                                            all_bands=args.all_bands):
+        print(image_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# ============= EOF =============================================
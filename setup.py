@@ -23,7 +23,7 @@ os.environ['TRAVIS_CI'] = 'True'
 
 try:
     from setuptools import setup
-    setup_kwargs = {'entry_points': {'console_scripts': ['ssebop=ssebop_app.cli:run']}}
+    setup_kwargs = {'entry_points': {'console_scripts': ['ssebop=ssebop_app.cli:cli']}}
 
 except ImportError:
     from distutils.core import setup
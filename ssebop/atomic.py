@@ -0,0 +1,61 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from contextlib import contextmanager
+from threading import get_ident
+from uuid import uuid4
+
+TEMP_PREFIX = '.tmp-'
+
+
+def temp_path(path):
+    """ Hidden sibling of path, on the same filesystem so the final rename is atomic.
+
+    Unique to each call, so threads and processes writing the same path at once, e.g.
+    a DEM shared by several scenes, never write to or clean up each other's file.
+    """
+    d, name = os.path.split(path)
+    return os.path.join(d, '{}{}-{}-{}-{}'.format(TEMP_PREFIX, os.getpid(), get_ident(),
+                                                  uuid4().hex[:8], name))
+
+
+@contextmanager
+def atomic_output(path):
+    """ Yield a temporary filename to write to; it replaces path only if the block succeeds.
+
+    A crash part way through a write leaves no file at path, so an existing file is
+    always a complete one.
+
+    :param path: final output filename
+    :return: temporary filename
+    """
+    tmp = temp_path(path)
+    try:
+        yield tmp
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if os.path.exists(tmp):
+        os.replace(tmp, path)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,140 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from collections import namedtuple
+
+from numpy import arange, count_nonzero, flatnonzero, isnan, minimum, nanmean, nanstd, sqrt
+from numpy.random import RandomState
+
+METHODS = ('exact', 'strided', 'stratified')
+
+NDVI_COLD = 0.7
+MIN_COUNT = 50
+
+# the sampled estimate falls back to the exact one with fewer cold pixels in the sample
+MIN_SAMPLE = 200
+STEP = 8
+Z_95 = 1.96
+
+SCAN_ROWS = 256
+
+CFactor = namedtuple('CFactor', ['c', 'low', 'high', 'count', 'method'])
+
+
+def reference_ta(ndvi, tmax, threshold=NDVI_COLD):
+    """ tmax at the first pixel, in row order, with ndvi above threshold, or None.
+
+    Rows are scanned in blocks so a cold pixel near the top of the scene is found
+    without comparing the whole ndvi array.
+    """
+    for start in range(0, ndvi.shape[0], SCAN_ROWS):
+        hits = flatnonzero(ndvi[start:start + SCAN_ROWS] > threshold)
+        if hits.size:
+            row, col = divmod(int(hits[0]), ndvi.shape[1])
+            return tmax[start + row, col]
+    return None
+
+
+def cold_pixels(ts, ndvi, clear, ta):
+    """ Clear, dense vegetation pixels within 30 K above the reference air temperature.
+
+    :param clear: boolean array, True is clear, e.g. QAMask.clear
+    """
+    t_diff = ts - ta
+    return ((ndvi >= NDVI_COLD) & (ndvi <= 1.0) & (ts > 270.) &
+            (t_diff > 0) & (t_diff < 30) & clear)
+
+
+def c_factor_exact(ts, ndvi, tmax, clear, min_count=MIN_COUNT):
+    """ c from every pixel: the scene mean of ts / ta less twice the standard deviation
+    of ts / ta over the cold pixels, ta being tmax at the first dense vegetation pixel.
+
+    :return: CFactor, or None if there are fewer than min_count cold pixels
+    """
+    ta = reference_ta(ndvi, tmax)
+    if ta is None:
+        return None
+    cold = cold_pixels(ts, ndvi, clear, ta)
+    count = count_nonzero(cold)
+    if count < max(min_count, 1):
+        return None
+    c = nanmean(ts) / ta - 2 * nanstd(ts[cold]) / ta
+    return CFactor(c, c, c, count, 'exact')
+
+
+def sample_index(shape, step=STEP, method='strided', seed=0):
+    """ Index of one pixel per step x step cell of an array.
+
+    strided takes the upper left pixel of each cell, an overview of the array;
+    stratified takes a random pixel from each cell.
+    """
+    if method == 'strided':
+        return slice(None, None, step), slice(None, None, step)
+    if method != 'stratified':
+        raise ValueError('Invalid sampling method: "{}", available = {}'.format(method, METHODS))
+    rng = RandomState(seed)
+    rows, cols = arange(0, shape[0], step), arange(0, shape[1], step)
+    size = (rows.size, cols.size)
+    r = minimum(rows[:, None] + rng.randint(0, step, size), shape[0] - 1)
+    c = minimum(cols[None, :] + rng.randint(0, step, size), shape[1] - 1)
+    return r, c
+
+
+def c_factor_sampled(ts, ndvi, tmax, clear, method='strided', step=STEP, min_sample=MIN_SAMPLE,
+                     min_count=MIN_COUNT, seed=0):
+    """ c estimated from a sample of one pixel in step ** 2, with a 95% confidence interval.
+
+    The interval combines the standard errors of the scene mean and of the cold pixel
+    standard deviation: c +/- 1.96 * sqrt(se_mean ** 2 + 4 * se_std ** 2). With fewer
+    than min_sample cold pixels in the sample, c is computed from every pixel.
+
+    :return: CFactor, or None if the image has too few cold pixels
+    """
+    ta = reference_ta(ndvi, tmax)
+    if ta is None:
+        return None
+
+    index = sample_index(ts.shape, step, method, seed)
+    ts_s, ndvi_s, clear_s = ts[index], ndvi[index], clear[index]
+
+    cold = cold_pixels(ts_s, ndvi_s, clear_s, ta)
+    n_cold = count_nonzero(cold)
+    if n_cold < max(min_sample, 2):
+        return c_factor_exact(ts, ndvi, tmax, clear, min_count=min_count)
+
+    n_all = count_nonzero(~isnan(ts_s))
+    mean, std_all = nanmean(ts_s) / ta, nanstd(ts_s) / ta
+    std = nanstd(ts_s[cold]) / ta
+    c = mean - 2 * std
+
+    se_mean = std_all / sqrt(n_all)
+    se_std = std / sqrt(2. * (n_cold - 1))
+    half = Z_95 * sqrt(se_mean ** 2 + 4 * se_std ** 2)
+    return CFactor(c, c - half, c + half, n_cold * step ** 2, method)
+
+
+def estimate_c_factor(ts, ndvi, tmax, clear, method='exact', step=STEP, min_count=MIN_COUNT):
+    """ c by one of METHODS; see c_factor_exact and c_factor_sampled. """
+    if method == 'exact':
+        return c_factor_exact(ts, ndvi, tmax, clear, min_count=min_count)
+    return c_factor_sampled(ts, ndvi, tmax, clear, method=method, step=step, min_count=min_count)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -15,95 +15,239 @@
 # =============================================================================================
 
 import os
-from rasterio import open as rasopen
+from collections import namedtuple
+from threading import Lock
 
-from met.thredds import TopoWX, GridMet
-from dem import AwsDem
-from sat_image.fmask import Fmask
-from sat_image import warped_vrt
 from bounds import RasterBounds
+from rasterio import open as rasopen
+
+from ssebop.file_index import index_for
+from ssebop_app.log import scene_logger
+from ssebop.roi import covering_window, crop
+from ssebop.warp_cache import path_row_cache, fill_value
+
+
+VARIABLES = ('tmax', 'tmin', 'dem', 'fmask', 'pet')
+
+# fetched for the requested area; the fmask is always made for the whole scene
+REGIONAL = ('tmax', 'tmin', 'dem', 'pet')
+
+# one variable request of a scene; immutable, so concurrent data_check calls share nothing
+VariableRequest = namedtuple('VariableRequest', ['variable', 'path', 'file_name',
+                                                 'temp_units', 'sat_image'])
+
+
+_SHARED_LOCKS = {}
+_SHARED_LOCKS_LOCK = Lock()
+
+
+def shared_lock(path):
+    """ Lock of an input shared by several scenes, e.g. the DEM of a year directory, so
+    scenes run in threads fetch it once rather than each downloading and writing it. """
+    with _SHARED_LOCKS_LOCK:
+        return _SHARED_LOCKS.setdefault(os.path.abspath(path), Lock())
+
+
+def pet_name(pet_source=None, ref_crop=None):
+    """ Name of the reference ET input in its file name: 'pet' for gridMET grass reference
+    ET, the default, else e.g. 'pet_refet_etr', so a cached raster of one source or crop
+    is not read for another. """
+    pet_source, ref_crop = pet_source or 'gridmet', ref_crop or 'eto'
+    if (pet_source, ref_crop) == ('gridmet', 'eto'):
+        return 'pet'
+    return 'pet_{}_{}'.format(pet_source, ref_crop)
+
+
+def variable_path(image_dir, image_id, variable, tag=None, pet_source=None, ref_crop=None):
+    """ Location of an input variable; the DEM is shared by all scenes of a year directory.
+
+    :param tag: ROI tag, REGIONAL variables fetched for an ROI are named after it
+    :param pet_source: source of 'pet', see pet_name, default gridMET
+    :param ref_crop: reference crop of 'pet', default grass
+    """
+    suffix = '_{}'.format(tag) if tag and variable in REGIONAL else ''
+    if variable == 'dem':
+        return os.path.join(os.path.dirname(image_dir), '{}{}.tif'.format(variable, suffix))
+    name = pet_name(pet_source, ref_crop) if variable == 'pet' else variable
+    return os.path.join(image_dir, '{}_{}{}.tif'.format(image_id, name, suffix))
 
 
 class SSEBopData:
+    """ Input variables of one scene, read from the image directory or fetched and saved.
+
+    The object holds only the scene's grid and dates, set once; each data_check builds
+    its own VariableRequest, so one SSEBopData may serve several threads at once.
+
+    With an ROI the grid is the ROI's window of the scene: whole-scene inputs already on
+    disk are read by window, and anything fetched covers the ROI only and is saved
+    under the ROI's tag, so it is not mistaken for a whole-scene input later.
+    """
+
     def __init__(self, image_id, image_dir, transform,
-            profile, clip_geo, date):
+            profile, clip_geo, date, storage=None, tag=None, pet_source='gridmet',
+            ref_crop='eto'):
 
+        self.storage = storage or index_for()
         self.image_id = image_id
         self.image_dir = image_dir
         self.transform = transform
         self.profile = profile
         self.clip_geo = clip_geo
         self.date = date
-        self.file_name = None
+        self.tag = tag
+        self.pet_source = pet_source
+        self.ref_crop = ref_crop
+        self.log = scene_logger(image_id, __name__)
+        self.path_row_dir = os.path.dirname(os.path.dirname(image_dir.rstrip(os.sep)))
+        # inputs of other grids are warped with plans shared by the path/row's scenes
+        self.warps = path_row_cache(self.path_row_dir, storage=self.storage)
         self.bounds = RasterBounds(affine_transform=self.transform,
                                    profile=self.profile, latlon=True)
 
-        self.variable = None
-        self.file_path = None
         self.shape = (1, profile['height'], profile['width'])
 
-    def data_check(self, variable, sat_image=None, temp_units='C'):
+    def request(self, variable, sat_image=None, temp_units='C'):
+        """ VariableRequest for variable of this scene.
 
-        self.variable = variable
-        valid_vars = ['tmax', 'tmin', 'dem', 'fmask', 'pet']
+        :raises KeyError: variable is not one of VARIABLES
+        """
+        if variable not in VARIABLES:
+            raise KeyError('Variable {} is invalid, choose from {}'.format(variable,
+                                                                           list(VARIABLES)))
+        path = self.variable_path(variable)
+        return VariableRequest(variable, path, os.path.basename(path), temp_units, sat_image)
 
-        if self.variable not in valid_vars:
-            raise KeyError('Variable {} is invalid, choose from {}'.format(self.variable,
-                                                                           valid_vars))
-
-        if self.variable == 'dem':
-            self.file_name = '{}.tif'.format(self.variable)
-            self.file_path = os.path.join(os.path.dirname(self.image_dir), self.file_name)
-        else:
-            self.file_name = '{}_{}.tif'.format(self.image_id, variable)
-            self.file_path = os.path.join(self.image_dir, self.file_name)
+    def data_check(self, variable, sat_image=None, temp_units='C'):
 
-        if self.file_name not in os.listdir(self.image_dir):
-            if variable == 'tmax':
-                var = self.fetch_temp('tmax', temp_units)
-            if variable == 'tmin':
-                var = self.fetch_temp('tmin', temp_units)
-            if variable == 'dem':
-                var = self.fetch_dem()
-            if variable == 'fmask':
-                var = self.fetch_fmask(sat_image)
-            if variable == 'pet':
-                var = self.fetch_gridmet('pet')
+        request = self.request(variable, sat_image=sat_image, temp_units=temp_units)
 
+        if request.variable == 'dem':
+            with shared_lock(request.path):
+                var = self.read_or_fetch(request)
         else:
+            var = self.read_or_fetch(request)
 
-            with rasopen(self.file_path, 'r') as src:
-                var = src.read()
+        var = self.check_shape(var, request.path)
+        return var
 
-        var = self.check_shape(var, self.file_path)
+    def read_or_fetch(self, request):
+        if self.storage.exists(request.path):
+            return self.read(request.path)
+        var = self.read_scene(request)
+        if var is None:
+            var = self.fetch(request)
         return var
 
+    def read(self, path):
+        """ Read a raster, only the window of this grid if the raster covers more. """
+        with self.storage.open(path) as src:
+            return src.read(window=covering_window(src, self.profile))
+
+    def read_scene(self, request):
+        """ The whole-scene input of an ROI request, read by window, or None. """
+        if not self.tag:
+            return None
+        path = variable_path(self.image_dir, self.image_id, request.variable,
+                             pet_source=self.pet_source, ref_crop=self.ref_crop)
+        if path == request.path or not self.storage.exists(path):
+            return None
+        with self.storage.open(path) as src:
+            window = covering_window(src, self.profile)
+            if window is None:
+                return None
+            return src.read(window=window)
+
+    def fetch(self, request):
+        """ Fetch and save the variable of a request, return the array. """
+        if request.variable in ('tmax', 'tmin'):
+            return self.fetch_temp(request)
+        if request.variable == 'dem':
+            return self.fetch_dem(request)
+        if request.variable == 'fmask':
+            return self.fetch_fmask(request)
+        if self.pet_source == 'refet':
+            return self.fetch_refet(request)
+        return self.fetch_gridmet(request)
+
+    def lazy_data_check(self, variable, sat_image=None, temp_units='C', chunk_size=None):
+        """ Return the variable as a chunked dask array.
+
+        Existing rasters on the scene grid are read window by window as the graph is computed,
+        anything else goes through data_check and is wrapped once in memory.
+        """
+        from ssebop.lazy import read_lazy, as_lazy, CHUNK_SIZE
+
+        chunk_size = chunk_size or CHUNK_SIZE
+        path = self.variable_path(variable)
+        if self.storage.exists(path):
+            var = read_lazy(self.storage.local_path(path), chunk_size)
+            if var.shape == self.shape:
+                return var
+
+        var = self.data_check(variable, sat_image=sat_image, temp_units=temp_units)
+        return as_lazy(var, chunk_size)
+
+    def variable_path(self, variable):
+        return variable_path(self.image_dir, self.image_id, variable, tag=self.tag,
+                             pet_source=self.pet_source, ref_crop=self.ref_crop)
+
     def check_shape(self, var, path):
-        if not var.shape == self.shape:
-            new = warped_vrt.warp_single_image(image_path=path, profile=self.profile, resampling='nearest')
-            return new
-        else:
+        """ var, or the raster at path warped to this grid by nearest neighbour. """
+        if var.shape == self.shape:
             return var
+        with self.storage.open(path) as src:
+            return self.warps.warp(src.read(), src, self.profile, fill=fill_value(src.nodata))
+
+    def fetch_gridmet(self, request):
+        from met.thredds import GridMet
+        from ssebop.refet_grid import REF_CROPS
 
-    def fetch_gridmet(self, variable='pet'):
-        gridmet = GridMet(variable, date=self.date,
+        gridmet = GridMet(REF_CROPS[self.ref_crop], date=self.date,
                           bbox=self.bounds,
                           target_profile=self.profile,
                           clip_feature=self.clip_geo)
 
-        var = gridmet.get_data_subset(out_filename=self.file_path)
+        with self.storage.writer(request.path) as tmp:
+            var = gridmet.get_data_subset(out_filename=tmp)
+        return var
+
+    def fetch_refet(self, request):
+        """ Reference ET from the path/row's met cube, downloading a year of it if needed. """
+        from ssebop.refet_grid import MetCube
+
+        cube = MetCube.for_path_row(self.path_row_dir, storage=self.storage)
+        with shared_lock(cube.directory):
+            if not cube.covers(self.date.year, self.profile, doy=self.date.timetuple().tm_yday):
+                self.log.info('Downloading the %s met cube', self.date.year)
+                b = self.bounds
+                cube.update(self.date.year, (b.west, b.south, b.east, b.north))
+
+        elevation = self.data_check('dem')
+        var = cube.reference_et(self.date, self.profile, elevation, ref_crop=self.ref_crop)
+
+        meta = dict(self.profile)
+        for key in ('blockxsize', 'blockysize', 'tiled', 'photometric', 'nbits'):
+            meta.pop(key, None)
+        meta.update({'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': None})
+        with self.storage.writer(request.path) as tmp:
+            with rasopen(tmp, 'w', **meta) as dst:
+                dst.write(var)
         return var
 
-    def fetch_temp(self, variable='tmax', temp_units='C'):
-        print('Downloading new {}.....'.format(variable))
+    def fetch_temp(self, request):
+        from met.thredds import TopoWX, GridMet
+
+        variable = request.variable
+        self.log.info('Downloading new %s', variable)
         try:
-            topowx = TopoWX(date=self.date, bbox=self.bounds,
-                            target_profile=self.profile,
-                            clip_feature=self.clip_geo, out_file=self.file_path)
+            with self.storage.writer(request.path) as tmp:
+                topowx = TopoWX(date=self.date, bbox=self.bounds,
+                                target_profile=self.profile,
+                                clip_feature=self.clip_geo, out_file=tmp)
 
-            var = topowx.get_data_subset(grid_conform=True, var=variable,
-                                         out_file=self.file_path,
-                                         temp_units_out=temp_units)
+                var = topowx.get_data_subset(grid_conform=True, var=variable,
+                                             out_file=tmp,
+                                             temp_units_out=request.temp_units)
         except ValueError:
             if variable == 'tmax':
                 variable = 'tmmx'
@@ -112,7 +256,7 @@ class SSEBopData:
             else:
                 raise AttributeError
 
-            print('TopoWX temp retrieval failed, attempting same w/ Gridmet.')
+            self.log.warning('TopoWX %s retrieval failed, attempting same w/ Gridmet.', variable)
 
             gridmet = GridMet(variable, date=self.date, bbox=self.bounds,
                               target_profile=self.profile, clip_feature=self.clip_geo)
@@ -120,18 +264,23 @@ class SSEBopData:
 
         return var
 
-    def fetch_dem(self):
+    def fetch_dem(self, request):
+        from dem import AwsDem
+
         dem = AwsDem(bounds=self.bounds, clip_object=self.clip_geo,
                      target_profile=self.profile, zoom=8)
-        var = dem.terrain(attribute='elevation', out_file=self.file_path,
-                          save_and_return=True)
+        with self.storage.writer(request.path) as tmp:
+            var = dem.terrain(attribute='elevation', out_file=tmp,
+                              save_and_return=True)
         return var
 
-    def fetch_fmask(self, sat_image):
-        f = Fmask(sat_image)
-        combo = f.cloud_mask(min_filter=(3, 3), max_filter=(40, 40), combined=True)
-        f.save_array(combo, self.file_path)
-        return combo
+    def fetch_fmask(self, request):
+        from ssebop.masks import compute_fmask, save_mask
+
+        combo = compute_fmask(request.sat_image)
+        scene = request.sat_image.rasterio_geometry
+        save_mask(combo, request.path, scene, writer=self.storage.writer)
+        return crop(combo, covering_window(scene, self.profile))
 
 
 if __name__ == '__main__':
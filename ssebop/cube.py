@@ -0,0 +1,211 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+
+from numpy import arange, argsort, array, float32, float64, nan, uint8
+
+from ssebop.roi import shift
+from ssebop.warp_cache import warp_cache
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory file locks on Windows, appends are serialized within the process only
+    fcntl = None
+
+CUBE_FILE = 'ssebop_season.nc'
+
+# variable: (dtype, fill value)
+CUBE_VARIABLES = {'etrf': (float32, nan),
+                  'et': (float32, nan),
+                  'lst': (float32, nan),
+                  'fmask': (uint8, 255)}
+
+# a season of scenes at a pixel block is one chunk, so a pixel time series is one read;
+# 32 covers April to October with two sensors. Each append recompresses the chunks of
+# its slice, so appends cost time in proportion to TIME_CHUNK, and a light zlib level
+# keeps them to a fraction of a scene's run
+TIME_CHUNK = 32
+SPACE_CHUNK = 64
+COMPRESSION_LEVEL = 1
+
+TIME_UNITS = 'days since 1970-01-01 00:00:00'
+
+_LOCK = Lock()
+
+
+class SeasonCube(object):
+    """ Chunked, compressed NetCDF cube (time, y, x) of a path/row season's outputs.
+
+    The grid is that of the first scene appended; later scenes of the path/row are
+    warped onto it if their footprint differs. The time dimension is unlimited and
+    every append holds an exclusive lock on a sidecar lock file, so scenes finishing in
+    parallel workers, threads or processes, append one at a time. Appending a scene
+    already in the cube overwrites its slice.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_year_dir(cls, year_dir, tag=None):
+        """ The cube of a year directory; an ROI's scenes, tag, have a cube of their own. """
+        if not tag:
+            return cls(os.path.join(year_dir, CUBE_FILE))
+        name, ext = os.path.splitext(CUBE_FILE)
+        return cls(os.path.join(year_dir, '{}_{}{}'.format(name, tag, ext)))
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    @contextmanager
+    def locked(self):
+        """ Exclusive access to the cube across threads and processes. """
+        directory = os.path.dirname(self.path)
+        if directory:
+            # other processes may create it at the same time
+            os.makedirs(directory, exist_ok=True)
+        with _LOCK, open(self.path + '.lock', 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def _create(self, profile):
+        from netCDF4 import Dataset
+
+        height, width = profile['height'], profile['width']
+        transform = profile['transform']
+        with Dataset(self.path, 'w', format='NETCDF4') as nc:
+            nc.title = 'SSEBop season cube'
+            nc.createDimension('time', None)
+            nc.createDimension('y', height)
+            nc.createDimension('x', width)
+
+            time = nc.createVariable('time', float64, ('time',))
+            time.units = TIME_UNITS
+            time.calendar = 'standard'
+            nc.createVariable('image_id', str, ('time',))
+
+            x = nc.createVariable('x', float64, ('x',))
+            x[:] = transform.c + (arange(width) + 0.5) * transform.a
+            y = nc.createVariable('y', float64, ('y',))
+            y[:] = transform.f + (arange(height) + 0.5) * transform.e
+
+            crs = nc.createVariable('crs', 'i4')
+            crs.crs_wkt = profile['crs'].to_wkt()
+            crs.spatial_ref = crs.crs_wkt
+            crs.GeoTransform = ' '.join(str(v) for v in transform.to_gdal())
+
+            chunks = (TIME_CHUNK, min(SPACE_CHUNK, height), min(SPACE_CHUNK, width))
+            for name, (dtype, fill) in CUBE_VARIABLES.items():
+                var = nc.createVariable(name, dtype, ('time', 'y', 'x'), zlib=True,
+                                        complevel=COMPRESSION_LEVEL, shuffle=True,
+                                        chunksizes=chunks, fill_value=fill)
+                var.grid_mapping = 'crs'
+
+    def profile(self):
+        """ rasterio-style profile of the cube grid. """
+        from affine import Affine
+        from netCDF4 import Dataset
+        from rasterio.crs import CRS
+
+        with Dataset(self.path, 'r') as nc:
+            crs = nc.variables['crs']
+            return {'crs': CRS.from_wkt(crs.crs_wkt),
+                    'transform': Affine.from_gdal(*[float(v) for v in crs.GeoTransform.split()]),
+                    'height': len(nc.dimensions['y']), 'width': len(nc.dimensions['x'])}
+
+    def append(self, image_id, date, arrays, profile):
+        """ Add one scene's outputs to the cube, creating the cube on the first scene.
+
+        :param image_id: Landsat scene id
+        :param date: acquisition date, datetime
+        :param arrays: dict of {variable: array} for CUBE_VARIABLES, 2D or (1, y, x)
+        :param profile: rasterio profile of the arrays
+        :return: index of the scene on the time dimension
+        """
+        from netCDF4 import Dataset, date2num
+
+        with self.locked():
+            if not self.exists():
+                self._create(profile)
+            target = self.profile()
+
+            with Dataset(self.path, 'a') as nc:
+                ids = list(nc.variables['image_id'][:])
+                index = ids.index(image_id) if image_id in ids else len(ids)
+                nc.variables['time'][index] = date2num(date, TIME_UNITS, 'standard')
+                nc.variables['image_id'][index] = image_id
+                for name, arr in arrays.items():
+                    dtype, fill = CUBE_VARIABLES[name]
+                    nc.variables[name][index, :, :] = self._on_grid(arr, profile, target,
+                                                                    dtype, fill)
+        return index
+
+    def _on_grid(self, arr, profile, target, dtype, fill):
+        """ arr as a 2D array on the target grid, warped if the scene grid differs. """
+        if arr.ndim == 3:
+            arr = arr.reshape(arr.shape[1], arr.shape[2])
+        same = (arr.shape == (target['height'], target['width']) and
+                profile['transform'] == target['transform'] and profile['crs'] == target['crs'])
+        if same:
+            return arr.astype(dtype)
+        # scenes of the path/row shifted along the track are on the same pixels
+        shifted = shift(arr.astype(dtype), profile, target, fill)
+        if shifted is not None:
+            return shifted
+        # a scene grid is not shared by other runs, so its plan is not saved
+        return warp_cache().warp(arr.astype(dtype), profile, target, fill)
+
+    def scenes(self):
+        """ (image_id, datetime) of each scene in the cube, in date order. """
+        from netCDF4 import Dataset, num2date
+
+        if not self.exists():
+            return []
+        with Dataset(self.path, 'r') as nc:
+            ids = list(nc.variables['image_id'][:])
+            dates = num2date(nc.variables['time'][:], TIME_UNITS, 'standard')
+        dates = [datetime(d.year, d.month, d.day, d.hour, d.minute) for d in dates]
+        return sorted(zip(ids, dates), key=lambda x: x[1])
+
+    def pixel_series(self, variable, row, col):
+        """ Season time series of one pixel, in date order.
+
+        :return: (list of datetime, array of values)
+        """
+        from netCDF4 import Dataset, num2date
+
+        with Dataset(self.path, 'r') as nc:
+            values = array(nc.variables[variable][:, row, col])
+            dates = num2date(nc.variables['time'][:], TIME_UNITS, 'standard')
+        order = argsort(array([d.toordinal() for d in dates]), kind='mergesort')
+        dates = [datetime(d.year, d.month, d.day) for d in array(dates)[order]]
+        return dates, values[order]
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,220 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+from __future__ import print_function
+
+import os
+import logging
+from copy import deepcopy
+from datetime import datetime
+
+from numpy import float32, float64, full, int64, isnan, nan, nanmean, zeros
+from rasterio import open as rasopen
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+
+from met.fao import get_net_radiation, air_density, air_specific_heat
+from met.fao import canopy_resistance
+
+from ssebop.file_index import index_for
+from ssebop.refet_grid import met_grid, grid_bounds
+from ssebop.warp_cache import path_row_cache, fill_value
+
+DT_CLIMATOLOGY_FILE = 'dt_climatology.tif'
+
+# FAO-56 reference grass albedo, used in place of the per-scene albedo
+CLIMATOLOGY_ALBEDO = 0.23
+
+DAYS = 366
+BLOCK_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+def daily_dt(tmin, tmax, doy, elevation, lat, albedo):
+    """ Daily temperature difference between the hot and cold reference, dT [K].
+
+    Senay et al. (2013), dT = Rn * rah / (rho * cp)
+
+    :param tmin: daily minimum air temperature [K]
+    :param tmax: daily maximum air temperature [K]
+    :param doy: day of year
+    :param elevation: elevation [m]
+    :param lat: latitude [radians]
+    :param albedo: surface albedo [-]
+    :return: dT array
+    """
+    net_rad = get_net_radiation(tmin=tmin, tmax=tmax, doy=doy,
+                                elevation=elevation, lat=lat,
+                                albedo=albedo)
+
+    rho = air_density(tmin=tmin, tmax=tmax, elevation=elevation)
+    cp = air_specific_heat()
+    rah = canopy_resistance()
+
+    dt = (net_rad * rah) / (rho * cp)
+    return dt
+
+
+class DtClimatology(object):
+    """ Day-of-year dT climatology for a path/row, one band per day of year.
+
+    The cube is written once per region as a tiled, band-interleaved GeoTIFF so that
+    serving dT for a scene reads a single band, warped onto the scene's grid with one
+    plan for every day; day 366 is filled from day 365 for history years that are
+    not leap years.
+    """
+
+    def __init__(self, path, storage=None):
+        self.path = path
+        self.storage = storage or index_for()
+
+    @classmethod
+    def for_path_row(cls, path_row_dir, storage=None):
+        return cls(os.path.join(path_row_dir, DT_CLIMATOLOGY_FILE), storage=storage)
+
+    def exists(self):
+        return self.storage.exists(self.path)
+
+    def build(self, data, lat, years, albedo=CLIMATOLOGY_ALBEDO):
+        """ Build the climatology from the gridMET temperature history.
+
+        Each year of tmin and tmax is one request on the native gridMET grid around the
+        scene, as the met cube's, and the day-of-year means are computed on that grid with
+        the scene's DEM averaged over each cell; get warps a day onto a scene's grid.
+
+        :param data: SSEBopData object for a scene on the path/row, supplies the
+        bounds and elevation
+        :param lat: center latitude of the region [radians]
+        :param years: iterable of history years
+        :param albedo: albedo used for the net radiation term [-]
+        :return: None
+        """
+        years = list(years)
+        if not years:
+            raise ValueError('A dT climatology needs at least one year of history')
+
+        b = data.bounds
+        grid = met_grid(b.west, b.south, b.east, b.north)
+        elevation = self._grid_elevation(data, grid)
+        shape = (DAYS, grid['height'], grid['width'])
+        total = zeros(shape, dtype=float64)
+        count = zeros(DAYS, dtype=int64)
+        for year in years:
+            tmin = self._fetch_year(grid, 'tmmn', year)
+            tmax = self._fetch_year(grid, 'tmmx', year)
+            for i in range(min(len(tmin), len(tmax))):
+                total[i] += daily_dt(tmin=tmin[i], tmax=tmax[i], doy=i + 1, elevation=elevation,
+                                     lat=lat, albedo=albedo)
+                count[i] += 1
+            logger.debug('dT climatology of %s from %s days', year, min(len(tmin), len(tmax)))
+
+        # day 366, and any day without history, takes the day before
+        for i in range(DAYS):
+            if count[i]:
+                total[i] /= count[i]
+            elif i:
+                total[i] = total[i - 1]
+            else:
+                raise ValueError('No gridMET history of January 1st in {}'.format(years))
+
+        profile = self._cube_profile(dict(grid, nodata=nan))
+        with self.storage.writer(self.path) as tmp, rasopen(tmp, 'w', **profile) as dst:
+            dst.write(total.astype(float32))
+
+        return None
+
+    def write(self, cube, profile):
+        """ Write a precomputed (366, height, width) dT cube.
+
+        :param cube: dT for each day of year [K]
+        :param profile: rasterio profile of the target grid
+        :return: None
+        """
+        if cube.shape[0] != DAYS:
+            raise ValueError('dT climatology must have {} days, got {}'.format(DAYS, cube.shape[0]))
+
+        profile = self._cube_profile(profile)
+        with self.storage.writer(self.path) as tmp:
+            with rasopen(tmp, 'w', **profile) as dst:
+                dst.write(cube.astype(float32))
+
+        return None
+
+    def get(self, doy, target_profile=None):
+        """ Serve dT for one day of year.
+
+        :param doy: day of year
+        :param target_profile: rasterio profile of the scene, the band is warped to
+        this grid if the climatology was built on a different one
+        :return: dT array of shape (1, height, width)
+        """
+        with self.storage.open(self.path) as src:
+            band = src.read([doy])
+            if target_profile is None or self._same_grid(src, target_profile):
+                return band
+            # one plan serves every day and every scene on the same grid
+            warps = path_row_cache(os.path.dirname(self.path), storage=self.storage)
+            return warps.warp(band, src, target_profile, fill=fill_value(src.nodata))
+
+    @staticmethod
+    def _fetch_year(grid, variable, year):
+        """ (days, height, width) year of a gridMET variable on grid, to today in the current year. """
+        from bounds import GeoBounds
+        from met.thredds import GridMet
+
+        west, south, east, north = grid_bounds(grid)
+        bbox = GeoBounds(west=west, south=south, east=east, north=north)
+        start, end = datetime(year, 1, 1), min(datetime(year, 12, 31), datetime.now())
+        gridmet = GridMet(variable, start=start, end=end, bbox=bbox, target_profile=grid)
+        return gridmet.get_data_subset().reshape(-1, grid['height'], grid['width'])
+
+    @staticmethod
+    def _grid_elevation(data, grid):
+        """ Mean of the scene's DEM over each cell of grid; cells the scene only partly
+        covers, which the average leaves empty, take the scene's mean elevation. """
+        elevation = full((grid['height'], grid['width']), nan, dtype=float32)
+        dem = data.data_check(variable='dem').astype(float32)
+        reproject(dem.reshape(dem.shape[-2:]), elevation,
+                  src_transform=data.profile['transform'], src_crs=data.profile['crs'],
+                  src_nodata=nan, dst_transform=grid['transform'], dst_crs=grid['crs'],
+                  dst_nodata=nan, resampling=Resampling.average)
+        elevation[isnan(elevation)] = nanmean(dem)
+        return elevation
+
+    @staticmethod
+    def _same_grid(src, profile):
+        return (src.height, src.width) == (profile['height'], profile['width']) and \
+               src.transform == profile['transform']
+
+    @staticmethod
+    def _cube_profile(profile):
+        profile = deepcopy(profile)
+        profile.update({'driver': 'GTiff',
+                        'count': DAYS,
+                        'dtype': 'float32',
+                        'tiled': True,
+                        'blockxsize': BLOCK_SIZE,
+                        'blockysize': BLOCK_SIZE,
+                        'interleave': 'band',
+                        'compress': 'deflate'})
+        return profile
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,178 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import RLock, Lock
+from weakref import WeakKeyDictionary
+
+from ssebop.storage import LocalStorage
+
+# listings older than this are read again, to see files written by other processes
+MAX_AGE = 60.
+
+FileStat = namedtuple('FileStat', ['is_dir', 'size', 'mtime'])
+
+
+class FileIndex(object):
+    """ Existence checks answered from one cached listing per directory.
+
+    A directory is listed, with a stat of each entry, the first time any path in it is
+    checked, and again once the listing is older than max_age. Writes made through
+    writer, makedirs and put_dir update the cached listings, so products written by this
+    process are seen at once. Everything else is delegated to the storage backend, so an
+    index can be used wherever a backend is.
+    """
+
+    def __init__(self, storage=None, max_age=MAX_AGE):
+        self.storage = storage or LocalStorage()
+        self.max_age = max_age
+        self.listings = 0
+        self._dirs = {}
+        self._lock = RLock()
+
+    def __getattr__(self, name):
+        # open, local_path, local_dir, cache_path, ... of the backend
+        return getattr(self.__dict__['storage'], name)
+
+    @staticmethod
+    def _split(path):
+        path = str(path).rstrip('/').rstrip(os.sep)
+        return os.path.dirname(path), os.path.basename(path)
+
+    def _scan(self, directory):
+        if isinstance(self.storage, LocalStorage):
+            entries = {}
+            try:
+                for entry in os.scandir(directory):
+                    try:
+                        st = entry.stat()
+                        entries[entry.name] = FileStat(entry.is_dir(), st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+            except OSError:
+                pass
+            return entries
+        if not self.storage.exists(directory):
+            return {}
+        # object stores list names only, files and 'directories' alike
+        return {name: FileStat(None, None, None) for name in self.storage.listdir(directory)}
+
+    def entries(self, directory):
+        """ {name: FileStat} of a directory, listed at most once per max_age. """
+        directory = str(directory).rstrip('/').rstrip(os.sep)
+        with self._lock:
+            cached = self._dirs.get(directory)
+            if cached is not None and time.time() - cached[0] < self.max_age:
+                return cached[1]
+            entries = self._scan(directory)
+            self._dirs[directory] = (time.time(), entries)
+            self.listings += 1
+            return entries
+
+    def stat(self, path):
+        directory, name = self._split(path)
+        return self.entries(directory).get(name)
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and st.is_dir is not True
+
+    def isdir(self, path):
+        st = self.stat(path)
+        return st is not None and st.is_dir is not False
+
+    def listdir(self, directory):
+        return sorted(self.entries(directory))
+
+    def invalidate(self, path=None):
+        """ Forget the listing of path and of its parent directory, or every listing. """
+        with self._lock:
+            if path is None:
+                self._dirs.clear()
+                return None
+            path = str(path).rstrip('/').rstrip(os.sep)
+            self._dirs.pop(path, None)
+            self._dirs.pop(os.path.dirname(path), None)
+
+    def record(self, path, is_dir=False):
+        """ Add a path written by this process to the cached listings of its parents. """
+        with self._lock:
+            directory, name = self._split(path)
+            cached = self._dirs.get(directory)
+            if cached is not None:
+                st = None
+                if isinstance(self.storage, LocalStorage):
+                    try:
+                        s = os.stat(path)
+                        st = FileStat(os.path.isdir(path), s.st_size, s.st_mtime)
+                    except OSError:
+                        st = None
+                else:
+                    st = FileStat(True if is_dir else None, None, None)
+                if st is None:
+                    cached[1].pop(name, None)
+                else:
+                    cached[1][name] = st
+            parent, parent_name = self._split(directory)
+            cached = self._dirs.get(parent)
+            if directory and cached is not None and parent_name not in cached[1]:
+                self.record(directory, is_dir=True)
+
+    @contextmanager
+    def writer(self, path):
+        with self.storage.writer(path) as tmp:
+            yield tmp
+        self.record(path)
+
+    def makedirs(self, path):
+        self.storage.makedirs(path)
+        self.record(path, is_dir=True)
+
+    def put_dir(self, path):
+        self.storage.put_dir(path)
+        self.invalidate(path)
+
+
+_LOCAL = FileIndex(LocalStorage())
+_REGISTRY = WeakKeyDictionary()
+_REGISTRY_LOCK = Lock()
+
+
+def index_for(storage=None):
+    """ The process-wide FileIndex of a storage backend, default the local filesystem.
+
+    Every LocalStorage shares one index; other backends get one index per instance.
+    """
+    if isinstance(storage, FileIndex):
+        return storage
+    if storage is None or isinstance(storage, LocalStorage):
+        return _LOCAL
+    with _REGISTRY_LOCK:
+        if storage not in _REGISTRY:
+            _REGISTRY[storage] = FileIndex(storage)
+        return _REGISTRY[storage]
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,247 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import datetime
+
+from numpy import cos, deg2rad, empty, errstate, float32, inf, log, minimum, nan, pi, sin, where
+from rasterio import open as rasopen
+from rasterio.windows import Window
+
+from ssebop.mtl import parse_mtl
+from ssebop.screen import band_path
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit, prange = None, range
+
+ENGINES = ('numpy', 'numba')
+
+# rows read and computed at a time; bounds the float32 temporaries of the numpy engine
+BLOCK_ROWS = 512
+
+# blue, red, nir, swir1, swir2 reflective bands, and the thermal band, of each sensor
+SENSOR_BANDS = {'LT5': ((1, 3, 4, 5, 7), 6),
+                'LE7': ((1, 3, 4, 5, 7), '6_vcid_1'),
+                'LC8': ((2, 4, 5, 6, 7), 10)}
+
+# TM and ETM+ exo-atmospheric irradiance, by band, https://landsat.usgs.gov/esun
+ESUN = {'LT5': {1: 1958.0, 2: 1827.0, 3: 1551.0, 4: 1036.0, 5: 214.9, 7: 80.65},
+        'LE7': {1: 1970.0, 2: 1842.0, 3: 1547.0, 4: 1044.0, 5: 255.700, 7: 82.06, 8: 1369.00}}
+
+# TM and ETM+ thermal conversion constants; Landsat 8 constants are in the MTL
+THERMAL_K = {'LT5': (607.76, 1260.56), 'LE7': (666.09, 1282.71)}
+
+# Smith (2010) broad-band albedo from blue, red, nir, swir1 and swir2 TOA reflectance
+ALBEDO_WEIGHTS = (0.356, 0.130, 0.373, 0.085, 0.072)
+ALBEDO_OFFSET, ALBEDO_NORM = 0.0018, 1.014
+
+# Allen (2007) path radiance, transmissivity and sky radiance of the thermal correction
+RP, TAU, RSKY = 0.91, 0.866, 1.32
+
+SurfaceParameters = namedtuple('SurfaceParameters', ['lst', 'ndvi', 'albedo'])
+
+# DN -> TOA reflectance (reflective) or radiance (thermal) as gain * dn + offset
+Coefficients = namedtuple('Coefficients', ['bands', 'gains', 'offsets', 'k1', 'k2'])
+
+
+def earth_sun_distance(date):
+    """ Earth-sun distance [AU], as sat_image computes it. """
+    if isinstance(date, str):
+        date = datetime.strptime(date, '%Y-%m-%d')
+    doy = int(date.strftime('%j'))
+    return 1 - 0.01672 * cos(0.9856 * (doy - 4) * pi / 180)
+
+
+def coefficients(meta, satellite):
+    """ Per-band linear DN conversions of a scene, from MTL metadata.
+
+    :param meta: dict of lower case MTL keys, e.g. from ssebop.mtl.parse_mtl, or the
+    attributes of a sat_image object, vars(image)
+    :param satellite: LT5, LE7 or LC8
+    :return: Coefficients, bands in the order blue, red, nir, swir1, swir2, thermal
+    """
+    try:
+        reflective, thermal = SENSOR_BANDS[satellite]
+    except KeyError:
+        raise KeyError('Invalid satellite key: "{}". available key = {}'.format(
+            satellite, ','.join(SENSOR_BANDS)))
+
+    gains, offsets = [], []
+    elev = meta['sun_elevation']
+    if satellite == 'LC8':
+        for band in reflective:
+            gains.append(meta['reflectance_mult_band_{}'.format(band)] / sin(deg2rad(elev)))
+            offsets.append(meta['reflectance_add_band_{}'.format(band)] / sin(deg2rad(elev)))
+        gains.append(meta['radiance_mult_band_{}'.format(thermal)])
+        offsets.append(meta['radiance_add_band_{}'.format(thermal)])
+        k1, k2 = meta['k1_constant_band_10'], meta['k2_constant_band_10']
+    else:
+        d = earth_sun_distance(meta['date_acquired'])
+        for band in reflective + (thermal,):
+            gain, offset = _rescaling(meta, band)
+            if band != thermal:
+                scale = pi * d ** 2 / (ESUN[satellite][band] * cos(deg2rad(90. - elev)))
+                gain, offset = gain * scale, offset * scale
+            gains.append(gain)
+            offsets.append(offset)
+        k1, k2 = THERMAL_K[satellite]
+
+    return Coefficients(reflective + (thermal,), tuple(gains), tuple(offsets), k1, k2)
+
+
+def _rescaling(meta, band):
+    """ TM/ETM+ radiance = gain * dn + offset, from the radiance and quantized DN ranges. """
+    qmin = meta['quantize_cal_min_band_{}'.format(band)]
+    qmax = meta['quantize_cal_max_band_{}'.format(band)]
+    lmin = meta['radiance_minimum_band_{}'.format(band)]
+    lmax = meta['radiance_maximum_band_{}'.format(band)]
+    gain = (lmax - lmin) / (qmax - qmin)
+    return gain, lmin - gain * qmin
+
+
+def surface_block(dns, coef):
+    """ LST, NDVI and albedo of one block of DN arrays, vectorized in float32.
+
+    :param dns: list of DN arrays of coef.bands; DN < 1 is no data
+    :param coef: Coefficients
+    :return: SurfaceParameters of float32 arrays
+    """
+    with errstate(divide='ignore', invalid='ignore'):
+        refl = []
+        for dn, gain, offset in zip(dns, coef.gains, coef.offsets):
+            dn = dn.astype(float32)
+            dn[dn < 1.] = nan
+            refl.append(dn * float32(gain) + float32(offset))
+        blue, red, nir, swir1, swir2, radiance = refl
+
+        ndvi = (nir - red) / (nir + red)
+        ndvi[ndvi == inf] = nan
+
+        w = [float32(x) for x in ALBEDO_WEIGHTS]
+        albedo = (w[0] * blue + w[1] * red + w[2] * nir + w[3] * swir1 + w[4] * swir2 -
+                  float32(ALBEDO_OFFSET)) / float32(ALBEDO_NORM)
+
+        # Tasumi et al. (2003) narrow-band emissivity from the LAI of Trezza and Allen (2014)
+        lai = minimum(float32(7.) * ndvi ** 3, float32(6.))
+        epsilon = where(lai > 3, float32(0.98), float32(nan))
+        epsilon = where(lai <= 3, float32(0.97) + float32(0.0033) * lai, epsilon)
+        epsilon = where(ndvi <= 0, float32(0.99), epsilon).astype(float32)
+
+        rc = (radiance - float32(RP)) / float32(TAU) - (1 - epsilon) * float32(RSKY)
+        lst = float32(coef.k2) / log(epsilon * float32(coef.k1) / rc + 1)
+
+    return SurfaceParameters(lst.astype(float32), ndvi, albedo)
+
+
+def _surface_loop(blue, red, nir, swir1, swir2, thermal, gains, offsets, k1, k2,
+                  lst, ndvi, albedo):
+    """ Per-pixel form of surface_block, compiled by numba; one pass, no temporaries. """
+    rows, cols = blue.shape
+    for i in prange(rows):
+        for j in range(cols):
+            b = blue[i, j] * gains[0] + offsets[0] if blue[i, j] >= 1 else nan
+            r = red[i, j] * gains[1] + offsets[1] if red[i, j] >= 1 else nan
+            n = nir[i, j] * gains[2] + offsets[2] if nir[i, j] >= 1 else nan
+            s1 = swir1[i, j] * gains[3] + offsets[3] if swir1[i, j] >= 1 else nan
+            s2 = swir2[i, j] * gains[4] + offsets[4] if swir2[i, j] >= 1 else nan
+            rad = thermal[i, j] * gains[5] + offsets[5] if thermal[i, j] >= 1 else nan
+
+            nd = (n - r) / (n + r) if n + r != 0 else nan
+            ndvi[i, j] = nd
+            albedo[i, j] = (0.356 * b + 0.130 * r + 0.373 * n + 0.085 * s1 + 0.072 * s2 -
+                            0.0018) / 1.014
+
+            lai = min(7. * nd ** 3, 6.)
+            if nd <= 0:
+                eps = 0.99
+            elif lai <= 3:
+                eps = 0.97 + 0.0033 * lai
+            elif lai > 3:
+                eps = 0.98
+            else:
+                eps = nan
+            rc = (rad - RP) / TAU - (1 - eps) * RSKY
+            lst[i, j] = k2 / log(eps * k1 / rc + 1)
+
+
+_JIT = {}
+
+
+def _numba_block(dns, coef, out, rows):
+    if 'loop' not in _JIT:
+        _JIT['loop'] = njit(parallel=True, cache=True)(_surface_loop)
+    _JIT['loop'](*(list(dns) + [coef.gains, coef.offsets, coef.k1, coef.k2,
+                                out.lst[rows], out.ndvi[rows], out.albedo[rows]]))
+
+
+def surface_parameters(image_dir, satellite, meta=None, engine=None, block_rows=BLOCK_ROWS,
+                       window=None):
+    """ LST [K], NDVI and albedo of a scene from one read of each band.
+
+    sat_image's land_surface_temp, ndvi and albedo each convert their bands from DN on
+    every call; LST alone reads red and nir three times. Here the six bands a sensor
+    needs are read once, block by block, and the three products are computed together
+    with the same formulas: TOA reflectance, Smith (2010) albedo, Tasumi (2003)
+    emissivity and the Allen (2007) thermal correction.
+
+    :param image_dir: scene directory
+    :param satellite: LT5, LE7 or LC8
+    :param meta: MTL dict, read from image_dir by default
+    :param engine: 'numpy' or 'numba', default numba if it is installed
+    :param block_rows: rows per block
+    :param window: rasterio Window of the scene to compute, e.g. of an ROI, default all
+    :return: SurfaceParameters of (height, width) float32 arrays, of the window if given
+    """
+    meta = meta or parse_mtl(image_dir)
+    engine = engine or ('numba' if njit else 'numpy')
+    if engine not in ENGINES:
+        raise ValueError('Invalid engine: "{}", available = {}'.format(engine, ENGINES))
+    if engine == 'numba' and not njit:
+        raise ImportError('The numba engine needs numba installed')
+
+    coef = coefficients(meta, satellite)
+    paths = [band_path(image_dir, meta, band) for band in coef.bands]
+    missing = [b for b, p in zip(coef.bands, paths) if p is None]
+    if missing:
+        raise IOError('Bands {} not found in {}'.format(missing, image_dir))
+
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasopen(p)) for p in paths]
+        if window is None:
+            window = Window(0, 0, sources[0].width, sources[0].height)
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        height, width = int(window.height), int(window.width)
+        out = SurfaceParameters(*[empty((height, width), dtype=float32) for _ in range(3)])
+        for start in range(0, height, block_rows):
+            n = min(block_rows, height - start)
+            block = Window(col_off, row_off + start, width, n)
+            dns = [src.read(1, window=block) for src in sources]
+            rows = slice(start, start + n)
+            if engine == 'numba':
+                _numba_block(dns, coef, out, rows)
+            else:
+                out.lst[rows], out.ndvi[rows], out.albedo[rows] = surface_block(dns, coef)
+    return out
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
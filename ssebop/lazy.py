@@ -0,0 +1,189 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from copy import deepcopy
+from collections import OrderedDict
+from contextlib import ExitStack
+from threading import Lock
+
+import dask
+import dask.array as da
+from numpy import nan, ones, errstate
+from rasterio import open as rasopen
+from rasterio.windows import Window
+
+from ssebop.atomic import atomic_output
+
+CHUNK_SIZE = 1024
+
+
+def chunks_for(shape, chunk_size=CHUNK_SIZE):
+    """ Chunk a (band, row, col) or (row, col) shape in square spatial blocks. """
+    if len(shape) == 3:
+        return 1, chunk_size, chunk_size
+    return chunk_size, chunk_size
+
+
+class RasterArray(object):
+    """ Array-like view of a raster that reads only the requested window.
+
+    Used with dask.array.from_array so each chunk of the graph is a windowed rasterio read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with rasopen(path, 'r') as src:
+            self.shape = (src.count, src.height, src.width)
+            self.dtype = src.dtypes[0]
+        self.ndim = 3
+
+    def __getitem__(self, key):
+        bands, rows, cols = key
+        indexes = list(range(self.shape[0]))[bands]
+        rows = rows.indices(self.shape[1])
+        cols = cols.indices(self.shape[2])
+        window = Window.from_slices(rows[:2], cols[:2])
+        with rasopen(self.path, 'r') as src:
+            return src.read([i + 1 for i in indexes], window=window)
+
+
+class RasterWriter(object):
+    """ Target for dask.array.store that writes each computed chunk to its window. """
+
+    def __init__(self, dst):
+        self.dst = dst
+        self.lock = Lock()
+
+    def __setitem__(self, key, value):
+        _, rows, cols = key
+        window = Window.from_slices((rows.start, rows.stop), (cols.start, cols.stop))
+        with self.lock:
+            self.dst.write(value, window=window)
+
+
+def read_lazy(path, chunk_size=CHUNK_SIZE):
+    """ Open a single raster as a chunked dask array of shape (band, row, col). """
+    arr = RasterArray(path)
+    return da.from_array(arr, chunks=chunks_for(arr.shape, chunk_size), name='read-{}'.format(path))
+
+
+def as_lazy(arr, chunk_size=CHUNK_SIZE):
+    """ Wrap an in-memory array, or pass through an existing dask array. """
+    if isinstance(arr, da.Array):
+        return arr
+    return da.from_array(arr, chunks=chunks_for(arr.shape, chunk_size))
+
+
+def lazy_daily_dt(tmin, tmax, doy, elevation, lat, albedo):
+    """ ssebop.dt_climatology.daily_dt as a graph, computed chunk by chunk.
+
+    :param tmin: daily minimum air temperature [K], dask array
+    :param tmax: daily maximum air temperature [K], dask array
+    :param doy: day of year
+    :param elevation: elevation [m], dask array
+    :param lat: latitude [radians]
+    :param albedo: surface albedo [-], dask array
+    :return: dask array of dT, the shape and chunks of tmin
+    """
+    from ssebop.dt_climatology import daily_dt
+
+    tmax, elevation, albedo = [a.reshape(tmin.shape).rechunk(tmin.chunks)
+                               for a in (tmax, elevation, albedo)]
+
+    def block(tmin, tmax, elevation, albedo):
+        return daily_dt(tmin=tmin, tmax=tmax, doy=doy, elevation=elevation, lat=lat, albedo=albedo)
+
+    with errstate(all='ignore'):
+        dtype = block(*[ones((1,) * a.ndim, a.dtype) for a in (tmin, tmax, elevation, albedo)]).dtype
+    return da.map_blocks(block, tmin, tmax, elevation, albedo, dtype=dtype)
+
+
+def et_graph(ts, c, ta, dt, pet, clear):
+    """ Build the lazy SSEBop graph; the same operations, in the same order, as SSEBopModel.run.
+
+    :param ts: land surface temperature [K]
+    :param c: temperature correction factor [-]
+    :param ta: maximum air temperature [K]
+    :param dt: temperature difference [K]
+    :param pet: reference ET [mm]
+    :param clear: boolean array, True is clear, e.g. QAMask.clear
+    :return: dict of dask arrays keyed by output variable name
+    """
+    tc = c * ta
+    th = tc + dt
+    etrf = (th - ts) / dt
+    et = pet * etrf
+    et_mskd = da.where(clear, et, nan)
+
+    return {'ssebop_et_mskd': et_mskd,
+            'pet': pet,
+            'lst': ts,
+            'ssebop_et': et,
+            'ssebop_etrf': etrf}
+
+
+def store_rasters(outputs, profile, chunk_size=CHUNK_SIZE, num_workers=None, writer=atomic_output):
+    """ Compute several lazy outputs in one pass, writing chunks directly into tiled GeoTIFFs.
+
+    :param outputs: dict of {output filename: dask array}
+    :param profile: rasterio profile of the scene
+    :param chunk_size: tile size of the outputs, matching the graph chunks
+    :param num_workers: threads used to compute the graph, default is one per core
+    :param writer: context manager yielding a temporary filename stored at the output
+    filename on success, e.g. a storage backend's writer
+    :return: None
+    """
+    sources, targets = [], []
+    with ExitStack() as stack:
+        for filename, arr in outputs.items():
+            if arr.ndim == 2:
+                arr = arr.reshape((1,) + arr.shape)
+            arr = arr.rechunk(chunks_for(arr.shape, chunk_size))
+
+            meta = deepcopy(profile)
+            meta.update({'driver': 'GTiff', 'count': 1,
+                         'dtype': str(arr.dtype),
+                         'tiled': True,
+                         'blockxsize': chunk_size,
+                         'blockysize': chunk_size})
+            tmp = stack.enter_context(writer(filename))
+            dst = stack.enter_context(rasopen(tmp, 'w', **meta))
+            sources.append(arr)
+            targets.append(RasterWriter(dst))
+
+        with dask.config.set(scheduler='threads', num_workers=num_workers):
+            da.store(sources, targets, lock=False)
+
+    return None
+
+
+def compute_arrays(outputs, num_workers=None):
+    """ Compute several lazy outputs in one pass into memory, in place of store_rasters.
+
+    :param outputs: dict of {name: dask array}
+    :param num_workers: threads used to compute the graph, default is one per core
+    :return: OrderedDict of {name: numpy array}
+    """
+    with dask.config.set(scheduler='threads', num_workers=num_workers):
+        arrays = dask.compute(*outputs.values())
+    return OrderedDict(zip(outputs.keys(), arrays))
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,255 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from numpy import asarray, nan, uint8, where
+
+from rasterio import open as rasopen
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as copy_raster
+
+from ssebop.collector import variable_path
+from ssebop.file_index import index_for
+from ssebop.mtl import find_mtl
+from ssebop_app.log import pool_logging
+
+# QA flags, combined bitwise in one uint8 per pixel; 0 is clear. OUTSIDE marks pixels
+# of an ROI's window outside its polygons
+CLEAR, CLOUD, SHADOW, SNOW, WATER, OUTSIDE = 0, 1, 2, 4, 8, 16
+NOT_CLEAR = CLOUD | SHADOW | SNOW | OUTSIDE
+
+MASK_NODATA = 255
+BLOCK_SIZE = 512
+OVERVIEWS = (2, 4, 8, 16)
+
+# Cloud-optimized layout: tiled, DEFLATE, overviews ahead of the full resolution data
+MASK_OPTIONS = {'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'nodata': MASK_NODATA,
+                'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE,
+                'compress': 'deflate', 'interleave': 'band'}
+
+WRITTEN, CURRENT, FAILED = 'written', 'current', 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class QAMask(object):
+    """ Per-pixel QA flags of a scene, CLOUD | SHADOW | SNOW | WATER | OUTSIDE bits in a uint8.
+
+    A combined Fmask array, 0 clear and 1 cloud or shadow, is a QAMask with only the
+    CLOUD bit used. The (height, width) flags are a view of the array passed in, and the
+    boolean clear selection is computed once and shared by every caller.
+    """
+
+    def __init__(self, flags):
+        flags = asarray(flags)
+        if flags.ndim == 3:
+            flags = flags.reshape(flags.shape[1], flags.shape[2])
+        self.flags = flags if flags.dtype == uint8 else flags.astype(uint8)
+        self._clear = None
+
+    @property
+    def shape(self):
+        return self.flags.shape
+
+    @property
+    def binary(self):
+        """ True if only the CLOUD bit is used, so the mask fits one bit per pixel. """
+        return int(self.flags.max()) <= CLOUD if self.flags.size else True
+
+    @property
+    def clear(self):
+        """ Boolean array, True where no flag in NOT_CLEAR is set; water is clear. """
+        if self._clear is None:
+            self._clear = (self.flags & NOT_CLEAR) == 0
+        return self._clear
+
+    def flagged(self, flags):
+        """ Boolean array, True where any of flags is set. """
+        return (self.flags & flags) != 0
+
+    def where_clear(self, arr, fill=nan):
+        """ arr where the pixel is clear, else fill. """
+        return where(self.clear, arr, fill)
+
+    def clear_fraction(self):
+        return float(self.clear.mean()) if self.flags.size else 0.
+
+
+def satellite_of(image_id):
+    """ LT5, LE7 or LC8 from a pre-collection (LC8...) or collection (LC08_...) scene id. """
+    if image_id[2:4] in ('05', '07', '08'):
+        return image_id[:2] + image_id[3]
+    return image_id[:3]
+
+
+def landsat_image(image_dir, satellite=None):
+    """ sat_image object of a scene directory. """
+    from sat_image.image import Landsat5, Landsat7, Landsat8
+
+    mapping = {'LT5': Landsat5, 'LE7': Landsat7, 'LC8': Landsat8}
+    satellite = satellite or satellite_of(os.path.basename(image_dir.rstrip(os.sep)))
+    try:
+        cls = mapping[satellite]
+    except KeyError:
+        raise KeyError('Invalid satellite key: "{}". available key = {}'.format(
+            satellite, ','.join(mapping.keys())))
+    return cls(image_dir)
+
+
+def compute_fmask(sat_image):
+    """ Combined cloud and shadow mask of a scene, 0 is clear. """
+    from sat_image.fmask import Fmask
+
+    f = Fmask(sat_image)
+    return f.cloud_mask(min_filter=(3, 3), max_filter=(40, 40), combined=True)
+
+
+def save_mask(mask, path, profile, writer=None):
+    """ Write a mask as a tiled, DEFLATE-compressed uint8 GeoTIFF with internal overviews.
+
+    A binary mask, e.g. a combined Fmask, is stored at one bit per pixel.
+
+    :param mask: QAMask, or 2D or (1, height, width) array of QA flags
+    :param path: output filename, e.g. the scene's fmask variable path
+    :param profile: rasterio profile of the scene grid
+    :param writer: context manager yielding a temporary filename stored at path on
+    success, default is the local file index
+    :return: None
+    """
+    writer = writer or index_for().writer
+    if not isinstance(mask, QAMask):
+        mask = QAMask(mask)
+
+    meta = dict(profile)
+    for key in ('blockxsize', 'blockysize', 'photometric', 'nbits'):
+        meta.pop(key, None)
+    meta.update(MASK_OPTIONS)
+    options = {}
+    if mask.binary:
+        # a nodata value of 255 does not fit in one bit
+        meta['nodata'] = None
+        options['nbits'] = meta['nbits'] = 1
+
+    with writer(path) as tmp:
+        # overviews are built in a scratch file and copied in ahead of the data
+        scratch = tmp + '.scratch.tif'
+        try:
+            with rasopen(scratch, 'w', **meta) as dst:
+                dst.write(mask.flags, 1)
+                dst.build_overviews(list(OVERVIEWS), Resampling.nearest)
+            copy_raster(scratch, tmp, driver='GTiff', tiled=True, blockxsize=BLOCK_SIZE,
+                        blockysize=BLOCK_SIZE, compress='deflate', copy_src_overviews=True,
+                        **options)
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+    return None
+
+
+def mask_path(image_dir):
+    image_dir = image_dir.rstrip(os.sep)
+    return variable_path(image_dir, os.path.basename(image_dir), 'fmask')
+
+
+def mask_is_current(image_dir):
+    """ True if the scene's mask exists and is newer than its MTL file. """
+    index = index_for()
+    mask = index.stat(mask_path(image_dir))
+    if mask is None:
+        return False
+    mtl = find_mtl(image_dir)
+    if mtl is None:
+        return True
+    return mask.mtime >= index.stat(mtl).mtime
+
+
+def find_scenes(root):
+    """ Scene directories, those holding an MTL file, under root. """
+    scenes = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if any(name.upper().endswith('_MTL.TXT') for name in filenames):
+            scenes.append(dirpath)
+    return scenes
+
+
+def make_mask(image_dir):
+    """ Compute and write the fmask of one scene; run in a worker process.
+
+    :return: (image_dir, state, seconds, error message or None)
+    """
+    start = time.time()
+    try:
+        image = landsat_image(image_dir)
+        save_mask(compute_fmask(image), mask_path(image_dir), image.rasterio_geometry)
+    except Exception as e:
+        return image_dir, FAILED, time.time() - start, '{}: {}'.format(type(e).__name__, e)
+    return image_dir, WRITTEN, time.time() - start, None
+
+
+def batch_fmask(root, workers=None, overwrite=False, scenes=None):
+    """ Write the fmask of every scene under root that lacks an up-to-date one.
+
+    Masks go to <image_dir>/<image_id>_fmask.tif, where SSEBopData.data_check finds
+    them, so masks can be made ahead of the model, e.g. on spare nodes.
+
+    :param root: directory searched for scene directories
+    :param workers: processes, default is one per core; 1 runs in this process
+    :param overwrite: remake masks that are up to date
+    :param scenes: scene directories, default is every scene under root
+    :return: list of (image_dir, state, seconds, error) in scene order
+    """
+    scenes = find_scenes(root) if scenes is None else list(scenes)
+    results = {}
+    todo = []
+    for image_dir in scenes:
+        if not overwrite and mask_is_current(image_dir):
+            results[image_dir] = (image_dir, CURRENT, 0., None)
+        else:
+            todo.append(image_dir)
+
+    if workers == 1:
+        done = map(make_mask, todo)
+        for result in done:
+            results[result[0]] = result
+    elif todo:
+        with ProcessPoolExecutor(max_workers=workers, **pool_logging()) as pool:
+            for result in pool.map(make_mask, todo):
+                results[result[0]] = result
+
+    index = index_for()
+    for image_dir in todo:
+        # written by other processes, not through this process's index
+        index.invalidate(mask_path(image_dir))
+
+    for image_dir in todo:
+        _, state, seconds, error = results[image_dir]
+        if state == FAILED:
+            logger.error('Fmask failed for %s: %s', image_dir, error)
+        else:
+            logger.info('Fmask written for %s in %.1f s', image_dir, seconds)
+
+    return [results[d] for d in scenes]
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,260 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import fnmatch
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from numpy import full, nan, isnan, zeros, float32, where
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, bounds as window_bounds
+
+from ssebop.atomic import atomic_output
+
+RULES = ('latest', 'max-clear', 'mean')
+
+BLOCK_SIZE = 512
+
+# decimation of the overview read used to rank scenes by clear fraction
+OVERVIEW_FACTOR = 16
+
+
+def find_outputs(root, product='ssebop_et_mskd'):
+    """ Per-scene rasters of one product under root, e.g. every *_ssebop_et_mskd.tif. """
+    pattern = '*_{}.tif'.format(product)
+    found = []
+    for dirpath, _, names in os.walk(root):
+        found.extend(os.path.join(dirpath, n) for n in fnmatch.filter(names, pattern))
+    return sorted(found)
+
+
+def scene_date(path):
+    """ Acquisition date from a Landsat scene id file name, or None. """
+    try:
+        return datetime.strptime(os.path.basename(path)[9:16], '%Y%j')
+    except ValueError:
+        return None
+
+
+class MosaicSource(object):
+    """ Grid and footprint of one input raster, read without loading its pixels. """
+
+    def __init__(self, path):
+        self.path = path
+        with rasopen(path) as src:
+            self.crs = src.crs
+            self.transform = src.transform
+            self.width, self.height = src.width, src.height
+            self.bounds = tuple(src.bounds)
+            self.nodata = src.nodata
+        self.date = scene_date(path)
+
+    def bounds_in(self, crs):
+        return transform_bounds(self.crs, crs, *self.bounds)
+
+    def clear_fraction(self):
+        """ Fraction of valid pixels, from a decimated read. """
+        with rasopen(self.path) as src:
+            shape = (max(1, src.height // OVERVIEW_FACTOR), max(1, src.width // OVERVIEW_FACTOR))
+            arr = src.read(1, out_shape=shape, masked=True).astype(float32).filled(nan)
+        return float((~isnan(arr)).sum()) / arr.size
+
+
+def target_profile(sources, crs=None, res=None, block_size=BLOCK_SIZE):
+    """ Tiled float32 grid covering the union of the sources.
+
+    :param sources: list of MosaicSource
+    :param crs: output CRS, default is that of the first source
+    :param res: output pixel size, default is that of the first source
+    :return: rasterio profile
+    """
+    crs = CRS.from_user_input(crs) if crs else sources[0].crs
+    res = res or sources[0].transform.a
+    bounds = [s.bounds_in(crs) for s in sources]
+    west, north = min(b[0] for b in bounds), max(b[3] for b in bounds)
+    east, south = max(b[2] for b in bounds), min(b[1] for b in bounds)
+    return {'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': nan, 'crs': crs,
+            'transform': from_origin(west, north, res, res),
+            'width': int(round((east - west) / res)), 'height': int(round((north - south) / res)),
+            'tiled': True, 'blockxsize': block_size, 'blockysize': block_size,
+            'compress': 'deflate'}
+
+
+def windows(profile):
+    """ Output windows of one block each, row by row. """
+    bx, by = profile['blockxsize'], profile['blockysize']
+    for row in range(0, profile['height'], by):
+        for col in range(0, profile['width'], bx):
+            yield Window(col, row, min(bx, profile['width'] - col), min(by, profile['height'] - row))
+
+
+def _intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class Mosaic(object):
+    """ Merge per-scene outputs into one raster, one output block at a time.
+
+    Only the block being written and the matching windows of the scenes that overlap it
+    are in memory, so memory is bounded by the block size and the number of overlapping
+    scenes, not the number of scenes in the mosaic.
+
+    Overlap rules:
+        latest: the most recent valid pixel
+        max-clear: the valid pixel of the scene with the largest clear fraction
+        mean: the mean of the valid pixels
+    """
+
+    def __init__(self, inputs, rule='latest', crs=None, res=None, block_size=BLOCK_SIZE,
+                 resampling=Resampling.nearest):
+        if rule not in RULES:
+            raise ValueError('Invalid mosaic rule: "{}", available rules = {}'.format(rule, RULES))
+        if not inputs:
+            raise ValueError('No rasters to mosaic')
+        self.rule = rule
+        self.resampling = resampling
+        self.sources = self._ordered([MosaicSource(p) for p in inputs])
+        self.profile = target_profile(self.sources, crs=crs, res=res, block_size=block_size)
+        self._bounds = [s.bounds_in(self.profile['crs']) for s in self.sources]
+
+    def _ordered(self, sources):
+        """ Sources by priority, highest first. """
+        if self.rule == 'latest':
+            return sorted(sources, key=lambda s: s.date or datetime.min, reverse=True)
+        if self.rule == 'max-clear':
+            return sorted(sources, key=lambda s: s.clear_fraction(), reverse=True)
+        return sources
+
+    def aligned(self):
+        """ True if every source lies on the output grid, so no resampling is needed. """
+        t = self.profile['transform']
+        for s in self.sources:
+            if s.crs != self.profile['crs'] or s.transform.a != t.a or s.transform.e != t.e:
+                return False
+            for offset in ((s.transform.c - t.c) / t.a, (s.transform.f - t.f) / t.e):
+                if abs(offset - round(offset)) > 1e-6:
+                    return False
+        return True
+
+    def read_window(self, source, window):
+        """ A source warped onto one output window, nan where it has no data. """
+        transform = self.profile['transform']
+        with rasopen(source.path) as src:
+            src_nodata = src.nodata if src.nodata is not None else nan
+            with WarpedVRT(src, crs=self.profile['crs'], transform=transform,
+                           width=self.profile['width'], height=self.profile['height'],
+                           resampling=self.resampling, src_nodata=src_nodata, nodata=nan,
+                           dtype='float32') as vrt:
+                return vrt.read(1, window=window)
+
+    def merge_window(self, window):
+        """ Merged float32 array of one output window. """
+        shape = (int(window.height), int(window.width))
+        w_bounds = window_bounds(window, self.profile['transform'])
+        overlapping = [s for s, b in zip(self.sources, self._bounds) if _intersects(b, w_bounds)]
+
+        if self.rule == 'mean':
+            total, count = zeros(shape, dtype=float32), zeros(shape, dtype=float32)
+            for source in overlapping:
+                arr = self.read_window(source, window)
+                valid = ~isnan(arr)
+                total[valid] += arr[valid]
+                count[valid] += 1
+            return where(count > 0, total / where(count > 0, count, 1), nan).astype(float32)
+
+        out = full(shape, nan, dtype=float32)
+        for source in overlapping:
+            empty = isnan(out)
+            if not empty.any():
+                break
+            arr = self.read_window(source, window)
+            out[empty] = arr[empty]
+        return out
+
+    def write(self, out_path):
+        """ Write the mosaic; a .vrt out_path of aligned sources is written as a VRT instead.
+
+        :return: out_path
+        """
+        if out_path.lower().endswith('.vrt'):
+            return self.write_vrt(out_path)
+
+        with atomic_output(out_path) as tmp:
+            with rasopen(tmp, 'w', **self.profile) as dst:
+                for window in windows(self.profile):
+                    dst.write(self.merge_window(window), 1, window=window)
+        return out_path
+
+    def write_vrt(self, out_path):
+        """ Fast path: reference the sources from a VRT without copying pixels.
+
+        GDAL draws later sources over earlier ones and skips their nodata, so the sources
+        are listed lowest priority first. Needs aligned sources and a priority rule.
+        """
+        if self.rule == 'mean':
+            raise ValueError('The mean rule cannot be written as a VRT')
+        if not self.aligned():
+            raise ValueError('Sources are not on a common grid, write a GeoTIFF instead')
+
+        t = self.profile['transform']
+        lines = ['<VRTDataset rasterXSize="{}" rasterYSize="{}">'.format(self.profile['width'],
+                                                                         self.profile['height']),
+                 '  <SRS>{}</SRS>'.format(escape(self.profile['crs'].to_wkt())),
+                 '  <GeoTransform>{}, {}, 0.0, {}, 0.0, {}</GeoTransform>'.format(t.c, t.a, t.f, t.e),
+                 '  <VRTRasterBand dataType="Float32" band="1">',
+                 '    <NoDataValue>nan</NoDataValue>']
+        for s in reversed(self.sources):
+            col = int(round((s.transform.c - t.c) / t.a))
+            row = int(round((s.transform.f - t.f) / t.e))
+            nodata = 'nan' if s.nodata is None else repr(s.nodata)
+            lines += ['    <ComplexSource>',
+                      '      <SourceFilename relativeToVRT="0">{}</SourceFilename>'.format(
+                          escape(os.path.abspath(s.path))),
+                      '      <SourceBand>1</SourceBand>',
+                      '      <SrcRect xOff="0" yOff="0" xSize="{0}" ySize="{1}"/>'.format(s.width, s.height),
+                      '      <DstRect xOff="{}" yOff="{}" xSize="{}" ySize="{}"/>'.format(
+                          col, row, s.width, s.height),
+                      '      <NODATA>{}</NODATA>'.format(nodata),
+                      '    </ComplexSource>']
+        lines += ['  </VRTRasterBand>', '</VRTDataset>']
+
+        with atomic_output(out_path) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+        return out_path
+
+
+def mosaic(inputs, out_path, rule='latest', crs=None, res=None, block_size=BLOCK_SIZE):
+    """ Mosaic per-scene rasters into out_path, see Mosaic.
+
+    :param inputs: list of raster filenames
+    :param out_path: output GeoTIFF, or .vrt for the no-copy fast path
+    :param rule: one of 'latest', 'max-clear', 'mean'
+    :return: out_path
+    """
+    return Mosaic(inputs, rule=rule, crs=crs, res=res, block_size=block_size).write(out_path)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
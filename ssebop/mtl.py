@@ -0,0 +1,93 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+
+from ssebop.file_index import index_for
+
+
+def find_mtl(image_dir):
+    """ Path of the *_MTL.txt file in a scene directory, or None. """
+    index = index_for()
+    if not index.isdir(image_dir):
+        return None
+    for name in index.listdir(image_dir):
+        if name.upper().endswith('_MTL.TXT'):
+            return os.path.join(image_dir, name)
+    return None
+
+
+def parse_mtl(path):
+    """ Read a Landsat MTL file into a flat dict of lower case keys, as sat_image sets them
+    on its image objects; groups are dropped and numbers converted.
+
+    :param path: MTL file, or a scene directory containing one
+    :return: dict
+    """
+    if index_for().isdir(path):
+        path = find_mtl(path)
+        if path is None:
+            raise IOError('No MTL file found')
+
+    meta = {}
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if ' = ' not in line:
+                continue
+            key, val = line.split(' = ', 1)
+            if key in ('GROUP', 'END_GROUP'):
+                continue
+            meta[key.lower()] = _convert(val)
+    return meta
+
+
+def write_mtl(path, groups):
+    """ Write an MTL file.
+
+    :param path: output filename
+    :param groups: list of (group name, list of (KEY, value)) tuples
+    :return: None
+    """
+    with open(path, 'w') as f:
+        f.write('GROUP = L1_METADATA_FILE\n')
+        for group, items in groups:
+            f.write('  GROUP = {}\n'.format(group))
+            for key, val in items:
+                if isinstance(val, str):
+                    val = '"{}"'.format(val)
+                f.write('    {} = {}\n'.format(key, val))
+            f.write('  END_GROUP = {}\n'.format(group))
+        f.write('END_GROUP = L1_METADATA_FILE\nEND\n')
+    return None
+
+
+def _convert(val):
+    val = val.strip()
+    if val.startswith('"') and val.endswith('"'):
+        return val[1:-1]
+    for cast in (int, float):
+        try:
+            return cast(val)
+        except ValueError:
+            pass
+    return val
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
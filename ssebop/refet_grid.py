@@ -0,0 +1,313 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from calendar import isleap
+from collections import OrderedDict
+from datetime import datetime
+from math import ceil, floor
+
+from numpy import arange, empty, float32, full, nan
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import array_bounds, from_origin
+from rasterio.warp import transform_bounds
+
+from ssebop.file_index import index_for
+from ssebop.warp_cache import path_row_cache
+
+MET_CUBE_DIR = 'met_cube'
+
+# cube variable: gridMET variable, [units]
+MET_VARIABLES = OrderedDict([('tmin', 'tmmn'),  # [K]
+                             ('tmax', 'tmmx'),  # [K]
+                             ('wind', 'vs'),  # 10 m wind speed [m s-1]
+                             ('humidity', 'sph'),  # specific humidity [kg kg-1]
+                             ('radiation', 'srad')])  # incoming shortwave [W m-2]
+
+# height of the gridMET wind speed [m]
+WIND_HEIGHT = 10.
+
+# gridMET grid, cells of 1/24 degree from the upper left corner of CONUS
+GRIDMET_CELL = 1. / 24.
+GRIDMET_ORIGIN = (-124.78749996666667, 49.42083333333334)
+
+# gridMET cells added around the requested area
+MARGIN = 2
+
+# 'pet' from gridMET or computed here from the met cube
+PET_SOURCES = ('gridmet', 'refet')
+
+# grass (ETo) or alfalfa (ETr) reference crop, and the gridMET variable of each
+REF_CROPS = OrderedDict([('eto', 'pet'), ('etr', 'etr')])
+
+BLOCK_ROWS = 1024
+
+# tag of a cube file, the days of the year it has; the bands after are NaN
+DAYS_TAG = 'DAYS'
+
+
+def met_grid(west, south, east, north):
+    """ Profile of the gridMET cells covering a lon/lat box, with MARGIN cells around it. """
+    x0, y0 = GRIDMET_ORIGIN
+    col0 = int(floor((west - x0) / GRIDMET_CELL)) - MARGIN
+    col1 = int(ceil((east - x0) / GRIDMET_CELL)) + MARGIN
+    row0 = int(floor((y0 - north) / GRIDMET_CELL)) - MARGIN
+    row1 = int(ceil((y0 - south) / GRIDMET_CELL)) + MARGIN
+    transform = from_origin(x0 + col0 * GRIDMET_CELL, y0 - row0 * GRIDMET_CELL,
+                            GRIDMET_CELL, GRIDMET_CELL)
+    return {'crs': CRS.from_epsg(4326), 'transform': transform,
+            'height': row1 - row0, 'width': col1 - col0}
+
+
+def grid_bounds(grid):
+    """ (west, south, east, north) of a lon/lat grid. """
+    t = grid['transform']
+    return t.c, t.f + grid['height'] * t.e, t.c + grid['width'] * t.a, t.f
+
+
+def air_pressure(elevation):
+    """ ASCE standardized air pressure [kPa] from elevation [m] (Eq. 3). """
+    return 101.3 * ((293. - 0.0065 * elevation) / 293.) ** 5.26
+
+
+def actual_vapor_pressure(q, elevation):
+    """ Actual vapor pressure [kPa] from specific humidity [kg kg-1] and elevation [m]. """
+    pair = air_pressure(elevation)
+    return q * pair / (0.622 + 0.378 * q)
+
+
+def reference_et(tmin, tmax, q, rs, uz, elevation, lat, doy, ref_crop='eto'):
+    """ ASCE standardized daily reference ET [mm], of arrays of any broadcastable shape.
+
+    Inputs are in the units of the gridMET variables, so a stack of days of the met
+    cube is computed at once.
+
+    :param tmin: daily minimum air temperature [K]
+    :param tmax: daily maximum air temperature [K]
+    :param q: specific humidity [kg kg-1]
+    :param rs: incoming shortwave radiation [W m-2]
+    :param uz: wind speed at WIND_HEIGHT [m s-1]
+    :param elevation: elevation [m]
+    :param lat: latitude [degrees]
+    :param doy: day of year
+    :param ref_crop: 'eto' for the grass or 'etr' for the alfalfa reference
+    :return: float32 array
+    """
+    import refet
+
+    if ref_crop not in REF_CROPS:
+        raise ValueError('Invalid ref_crop: "{}", available = {}'.format(ref_crop, list(REF_CROPS)))
+
+    daily = refet.Daily(tmin=tmin, tmax=tmax, ea=actual_vapor_pressure(q, elevation), rs=rs,
+                        uz=uz, zw=WIND_HEIGHT, elev=elevation, lat=lat, doy=doy,
+                        method='asce', input_units={'tmin': 'K', 'tmax': 'K', 'rs': 'W m-2'})
+    return daily.etsz(ref_crop).astype(float32)
+
+
+class MetCube(object):
+    """ Daily gridMET met of a path/row, one GeoTIFF per variable and year, a band a day.
+
+    The cube is on the native gridMET grid around the path/row, so a year of all five
+    variables is a few downloads of a few megabytes; reference ET of any scene and date
+    is then computed from local data, see reference_et.
+    """
+
+    def __init__(self, directory, storage=None):
+        self.directory = directory
+        self.storage = storage or index_for()
+
+    @classmethod
+    def for_path_row(cls, path_row_dir, storage=None):
+        return cls(os.path.join(path_row_dir, MET_CUBE_DIR), storage=storage)
+
+    @property
+    def warps(self):
+        # the path/row's plans, one cube grid to scene grid plan serves every date
+        return path_row_cache(os.path.dirname(self.directory), storage=self.storage)
+
+    def path(self, variable, year):
+        return os.path.join(self.directory, '{}_{}.tif'.format(variable, year))
+
+    def exists(self, year):
+        return all(self.storage.exists(self.path(v, year)) for v in MET_VARIABLES)
+
+    def grid(self, year):
+        """ Grid of a year's cube, or None if it is not built. """
+        if not self.exists(year):
+            return None
+        with self.storage.open(self.path('tmin', year)) as src:
+            return {'crs': src.crs, 'transform': src.transform,
+                    'height': src.height, 'width': src.width}
+
+    def build(self, year, bounds):
+        """ Download a year of each variable from gridMET.
+
+        :param year: year
+        :param bounds: (west, south, east, north) in degrees
+        :return: None
+        """
+        from bounds import GeoBounds
+        from met.thredds import GridMet
+
+        grid = met_grid(*bounds)
+        west, south, east, north = grid_bounds(grid)
+        bbox = GeoBounds(west=west, south=south, east=east, north=north)
+        # the current year up to today; gridMET may return a few days less
+        start, end = datetime(year, 1, 1), min(datetime(year, 12, 31), datetime.now())
+        for variable, gridmet_name in MET_VARIABLES.items():
+            gridmet = GridMet(gridmet_name, start=start, end=end, bbox=bbox, target_profile=grid)
+            self.write(variable, year, gridmet.get_data_subset(), grid)
+
+        return None
+
+    def write(self, variable, year, cube, grid):
+        """ Write a (days, height, width) year of a variable.
+
+        A year in progress, e.g. the current one, has fewer days; the bands after its last
+        day are NaN, and the number of days written is kept in the file's DAYS_TAG.
+
+        :param variable: one of MET_VARIABLES
+        :param year: year, the cube has 366 days in leap years, else 365
+        :param cube: daily values in the units of the gridMET variable, from January 1st
+        :param grid: lon/lat grid of the cube, e.g. from met_grid
+        :return: None
+        """
+        if variable not in MET_VARIABLES:
+            raise KeyError('Variable {} is invalid, choose from {}'.format(variable,
+                                                                           list(MET_VARIABLES)))
+        days = 366 if isleap(year) else 365
+        cube = cube.reshape(-1, grid['height'], grid['width'])
+        if not 0 < cube.shape[0] <= days:
+            raise ValueError('{} of {} must have 1 to {} days, got {}'.format(variable, year, days,
+                                                                            cube.shape[0]))
+        written = cube.shape[0]
+        if written < days:
+            padded = full((days, grid['height'], grid['width']), nan, dtype=float32)
+            padded[:written] = cube
+            cube = padded
+
+        profile = {'driver': 'GTiff', 'count': days, 'dtype': 'float32', 'nodata': nan,
+                   'crs': grid['crs'], 'transform': grid['transform'],
+                   'height': grid['height'], 'width': grid['width'],
+                   'interleave': 'band', 'compress': 'deflate'}
+        if not self.storage.isdir(self.directory):
+            self.storage.makedirs(self.directory)
+        with self.storage.writer(self.path(variable, year)) as tmp:
+            with rasopen(tmp, 'w', **profile) as dst:
+                dst.write(cube.astype(float32))
+                dst.update_tags(**{DAYS_TAG: written})
+
+        return None
+
+    def days(self, year):
+        """ Days of the year in every variable of its cube, 0 if it is not built. """
+        if not self.exists(year):
+            return 0
+        days = []
+        for variable in MET_VARIABLES:
+            with self.storage.open(self.path(variable, year)) as src:
+                days.append(int(src.tags().get(DAYS_TAG, src.count)))
+        return min(days)
+
+    def day(self, date):
+        """ Met of one date on the cube grid, a (1, height, width) array per variable. """
+        doy = date.timetuple().tm_yday
+        met = OrderedDict()
+        for variable in MET_VARIABLES:
+            with self.storage.open(self.path(variable, date.year)) as src:
+                met[variable] = src.read([doy])
+        return met
+
+    def covers(self, year, profile, doy=None):
+        """ True if the year's cube is built and its area holds the whole of profile's grid.
+
+        The grid's bounds are compared, so no plan is computed for a scene the cube does
+        not cover.
+
+        :param doy: day of year the cube must also have, e.g. past the last day of a
+        cube built during the year
+        """
+        grid = self.grid(year)
+        if grid is None:
+            return False
+        if doy is not None and doy > self.days(year):
+            return False
+        bounds = array_bounds(profile['height'], profile['width'], profile['transform'])
+        west, south, east, north = transform_bounds(profile['crs'], grid['crs'], *bounds)
+        g_west, g_south, g_east, g_north = grid_bounds(grid)
+        return g_west <= west and g_south <= south and east <= g_east and north <= g_north
+
+    def update(self, year, bounds):
+        """ Build the year's cube, or rebuild it over its area and bounds, e.g. after an
+        ROI run left a cube too small for the whole scene, or for days of the current
+        year since it was built.
+
+        :param year: year
+        :param bounds: (west, south, east, north) in degrees
+        :return: None
+        """
+        grid = self.grid(year)
+        if grid is not None:
+            old = grid_bounds(grid)
+            bounds = (min(bounds[0], old[0]), min(bounds[1], old[1]),
+                      max(bounds[2], old[2]), max(bounds[3], old[3]))
+        self.build(year, bounds)
+        return None
+
+    def reference_et(self, date, profile, elevation, ref_crop='eto', block_rows=BLOCK_ROWS):
+        """ Reference ET of a date on a scene grid.
+
+        Met cells are gathered onto the grid with one warp plan, shared by all variables
+        and the latitude, then computed row block by row block with the grid's elevation.
+
+        :param date: datetime
+        :param profile: rasterio profile of the scene grid
+        :param elevation: (1, height, width) elevation on the scene grid [m]
+        :param ref_crop: 'eto' or 'etr'
+        :param block_rows: rows computed at once
+        :return: (1, height, width) float32 array [mm]
+        """
+        doy = date.timetuple().tm_yday
+        if not self.covers(date.year, profile, doy=doy):
+            raise ValueError('No met cube of {} covering the scene on day {} in {}'.format(
+                date.year, doy, self.directory))
+
+        grid = self.grid(date.year)
+        plan = self.warps.plan(grid, profile)
+        met = self.day(date)
+        t = grid['transform']
+        lat = (t.f + (arange(grid['height']) + 0.5) * t.e)[:, None].repeat(grid['width'], axis=1)
+
+        height, width = profile['height'], profile['width']
+        elevation = elevation.reshape(height, width)
+        out = empty((1, height, width), dtype=float32)
+        for start in range(0, height, block_rows):
+            stop = min(start + block_rows, height)
+            block = plan.rows(start, stop)
+            m = {k: block.apply(v[0], fill=nan) for k, v in met.items()}
+            out[0, start:stop] = reference_et(tmin=m['tmin'], tmax=m['tmax'], q=m['humidity'],
+                                              rs=m['radiation'], uz=m['wind'],
+                                              elevation=elevation[start:stop],
+                                              lat=block.apply(lat, fill=nan), doy=doy,
+                                              ref_crop=ref_crop)
+        return out
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
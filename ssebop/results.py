@@ -0,0 +1,198 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from collections import OrderedDict
+
+from numpy import arange, asarray
+from rasterio import open as rasopen
+
+from ssebop_app.log import scene_logger
+from ssebop.c_factor import estimate_c_factor, MIN_COUNT, STEP
+from ssebop.file_index import index_for
+from ssebop.masks import QAMask
+
+# SSEBopModel.products, in the order the model writes them
+PRODUCTS = ('ssebop_et_mskd', 'pet', 'lst', 'ssebop_et', 'ssebop_etrf')
+
+
+def product_path(directory, image_id, product, tag=None):
+    """ A scene's product file, <image_id>_<product>.tif, or <image_id>_<product>_<tag>.tif
+    for a run on the ROI of tag, so an ROI run does not overwrite the scene's products.
+    """
+    suffix = '_{}'.format(tag) if tag else ''
+    return os.path.join(directory, '{}_{}{}.tif'.format(image_id, product, suffix))
+
+
+class SceneResult(object):
+    """ The products of a scene run, as (height, width) arrays, with the grid they are on.
+
+    Products kept in memory by the run are returned as they are; those the run only
+    wrote, e.g. with the dask backend, are read from their files on first access.
+    """
+
+    def __init__(self, image_id, date, profile, arrays=None, paths=None, c=None, opener=None):
+        """
+        :param image_id: the scene's image id
+        :param date: the scene's date
+        :param profile: rasterio profile of the products' grid
+        :param arrays: dict of {product: array}
+        :param paths: dict of {product: file} of products not in arrays
+        :param c: the scene's temperature correction factor, if it was computed
+        :param opener: opens paths for reading, e.g. a storage backend's open
+        """
+        self.image_id = image_id
+        self.date = date
+        self.profile = dict(profile)
+        self.c = c
+        self.paths = dict(paths or {})
+        self._arrays = OrderedDict((name, _plane(arr)) for name, arr in (arrays or {}).items())
+        self._open = opener or rasopen
+
+    def __repr__(self):
+        return '<SceneResult {} {} {}>'.format(self.image_id, self.shape, ', '.join(self.keys()))
+
+    def __contains__(self, name):
+        return name in self._arrays or name in self.paths
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            if name not in self.paths:
+                raise KeyError(name)
+            with self._open(self.paths[name]) as src:
+                self._arrays[name] = src.read(1)
+        return self._arrays[name]
+
+    def keys(self):
+        return list(self._arrays) + [p for p in self.paths if p not in self._arrays]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    @property
+    def transform(self):
+        return self.profile['transform']
+
+    @property
+    def crs(self):
+        return self.profile['crs']
+
+    @property
+    def shape(self):
+        return self.profile['height'], self.profile['width']
+
+    def coords(self):
+        """ x and y of the pixel centres, in the units of the crs. """
+        t = self.transform
+        x = t.c + (arange(self.profile['width']) + 0.5) * t.a
+        y = t.f + (arange(self.profile['height']) + 0.5) * t.e
+        return x, y
+
+    def to_xarray(self):
+        """ An xarray.Dataset of the products on x, y coordinates; requires xarray. """
+        import xarray
+
+        x, y = self.coords()
+        crs = self.crs
+        attrs = {'image_id': self.image_id, 'transform': tuple(self.transform)[:6],
+                 'crs': crs.to_wkt() if hasattr(crs, 'to_wkt') else str(crs)}
+        if self.c is not None:
+            attrs['c_factor'] = self.c
+        data = OrderedDict((name, (('y', 'x'), arr)) for name, arr in self.items())
+        return xarray.Dataset(data, coords={'y': y, 'x': x, 'time': self.date}, attrs=attrs)
+
+    def save(self, directory, storage=None):
+        """ Write each product to <directory>/<image_id>_<product>.tif, as SSEBopModel does.
+
+        :param directory: output directory
+        :param storage: ssebop.storage backend, default the local file system
+        :return: dict of {product: file}
+        """
+        storage = index_for(storage)
+        storage.makedirs(directory)
+        paths = OrderedDict()
+        for name, arr in self.items():
+            path = product_path(directory, self.image_id, name)
+            meta = dict(self.profile, driver='GTiff', count=1, dtype=str(arr.dtype))
+            with storage.writer(path) as tmp:
+                with rasopen(tmp, 'w', **meta) as dst:
+                    dst.write(arr, 1)
+            paths[name] = path
+        return paths
+
+
+class SceneArrays(object):
+    """ The inputs of a scene already in memory, e.g. from a notebook or another model.
+
+    run applies the c-factor and ET of SSEBopModel.run to them, with no sat_image,
+    download or file; surface temperature, NDVI and dT are given, not computed.
+    """
+
+    def __init__(self, image_id, date, profile, ts, ndvi, tmax, dt, pet, fmask, image_dir=None):
+        """
+        :param image_id: the scene's image id
+        :param date: the scene's date
+        :param profile: rasterio profile of the arrays' grid
+        :param ts: land surface temperature [K]
+        :param ndvi: NDVI [-]
+        :param tmax: maximum air temperature [K]
+        :param dt: temperature difference [K], e.g. from ssebop.dt_climatology.daily_dt
+        :param pet: reference ET [mm]
+        :param fmask: QA flags of ssebop.masks, 0 is clear
+        :param image_dir: where the products are saved, if they are
+        """
+        self.image_id = image_id
+        self.date = date
+        self.profile = profile
+        self.ts, self.ndvi, self.tmax, self.dt, self.pet = [_plane(a) for a in (ts, ndvi, tmax, dt, pet)]
+        self.fmask = _plane(fmask)
+        self.image_dir = image_dir
+        shapes = set(a.shape for a in (self.ts, self.ndvi, self.tmax, self.dt, self.pet, self.fmask))
+        if shapes != {(profile['height'], profile['width'])}:
+            raise ValueError('Inputs of {} are not all on the profile grid: {}'.format(image_id, shapes))
+
+    def run(self, c_factor_method='exact', c_factor_step=None, override_count=False):
+        """ The scene's products, the same operations, in the same order, as SSEBopModel.run.
+
+        :return: SceneResult, or None if the scene has too few clear cold pixels
+        """
+        qa = QAMask(self.fmask)
+        estimate = estimate_c_factor(self.ts, self.ndvi, self.tmax, qa.clear, method=c_factor_method,
+                                     step=c_factor_step or STEP,
+                                     min_count=0 if override_count else MIN_COUNT)
+        if estimate is None:
+            scene_logger(self.image_id, __name__).warning(
+                'Count of clear pixels is insufficient to perform analysis.')
+            return None
+
+        tc = estimate.c * self.tmax
+        th = tc + self.dt
+        etrf = (th - self.ts) / self.dt
+        et = self.pet * etrf
+        arrays = OrderedDict(zip(PRODUCTS, (qa.where_clear(et), self.pet, self.ts, et, etrf)))
+        return SceneResult(self.image_id, self.date, self.profile, arrays=arrays, c=estimate.c)
+
+
+def _plane(arr):
+    """ A (height, width) view of a band, e.g. of a (1, height, width) read. """
+    arr = asarray(arr)
+    return arr.reshape(arr.shape[-2:]) if arr.ndim == 3 else arr
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,242 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import json
+from collections.abc import Mapping
+from hashlib import sha1
+from math import ceil, floor
+
+from numpy import full
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_geom
+from rasterio.windows import Window, from_bounds, transform as window_transform
+
+# c-factor from the ROI's pixels only, or from the whole scene as without an ROI
+C_FACTOR_EXTENTS = ('roi', 'scene')
+
+GEOGRAPHIC = 'EPSG:4326'
+
+
+class RoiError(ValueError):
+    pass
+
+
+def roi_tag(value):
+    """ Tag of the ROI of a config 'roi' value, or None without an ROI. """
+    roi = Roi.from_config(value)
+    return roi.tag if roi else None
+
+
+class Roi(object):
+    """ Region of interest, one or more polygons in geographic coordinates.
+
+    A scene is processed on the window of its grid that covers the ROI, so the met and
+    DEM requests and the outputs cover the ROI rather than the whole tile; pixels of
+    the window outside the polygons are flagged in the scene's QA mask.
+    """
+
+    def __init__(self, geometries):
+        self.geometries = list(geometries)
+        if not self.geometries:
+            raise RoiError('ROI has no geometry')
+
+    @classmethod
+    def from_bbox(cls, west, south, east, north):
+        if not (west < east and south < north):
+            raise RoiError('ROI bbox must be west, south, east, north, '
+                           'got {}'.format((west, south, east, north)))
+        ring = [(west, south), (east, south), (east, north), (west, north), (west, south)]
+        return cls([{'type': 'Polygon', 'coordinates': [ring]}])
+
+    @classmethod
+    def from_geojson(cls, path):
+        """ Polygons of a GeoJSON geometry, Feature or FeatureCollection file, in lon/lat. """
+        with open(path) as f:
+            obj = json.load(f)
+        if obj.get('type') == 'FeatureCollection':
+            geometries = [feat['geometry'] for feat in obj['features']]
+        elif obj.get('type') == 'Feature':
+            geometries = [obj['geometry']]
+        else:
+            geometries = [obj]
+        return cls(geometries)
+
+    @classmethod
+    def from_config(cls, value):
+        """ ROI of the config 'roi' key: [west, south, east, north] or a GeoJSON file.
+
+        :return: Roi, or None if value is empty
+        """
+        if not value:
+            return None
+        if isinstance(value, str):
+            if not os.path.isfile(value):
+                raise RoiError('ROI file {} does not exist'.format(value))
+            return cls.from_geojson(value)
+        if len(value) != 4:
+            raise RoiError('ROI bbox must be [west, south, east, north], got {}'.format(value))
+        return cls.from_bbox(*[float(v) for v in value])
+
+    @property
+    def tag(self):
+        """ Short, stable name of the ROI, used to keep its inputs apart from the scene's. """
+        text = json.dumps(self.geometries, sort_keys=True)
+        return 'roi{}'.format(sha1(text.encode('utf-8')).hexdigest()[:8])
+
+    def projected(self, crs):
+        return [transform_geom(GEOGRAPHIC, crs, g) for g in self.geometries]
+
+    def window(self, profile):
+        """ Smallest window of the profile's grid covering the ROI.
+
+        :param profile: rasterio profile of the scene
+        :return: rasterio Window
+        :raises RoiError: the ROI does not overlap the scene
+        """
+        xs, ys = [], []
+        for geom in self.projected(profile['crs']):
+            for x, y in _coordinates(geom):
+                xs.append(x)
+                ys.append(y)
+        win = from_bounds(min(xs), min(ys), max(xs), max(ys), transform=profile['transform'])
+        col_off, row_off = floor(win.col_off), floor(win.row_off)
+        col_end, row_end = ceil(win.col_off + win.width), ceil(win.row_off + win.height)
+        col_off, row_off = max(col_off, 0), max(row_off, 0)
+        col_end, row_end = min(col_end, profile['width']), min(row_end, profile['height'])
+        if col_end <= col_off or row_end <= row_off:
+            raise RoiError('ROI does not overlap the scene')
+        return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+    def outside(self, profile):
+        """ Boolean array on the profile's grid, True outside the ROI polygons. """
+        return geometry_mask(self.projected(profile['crs']),
+                             out_shape=(profile['height'], profile['width']),
+                             transform=profile['transform'])
+
+    def clip_geometry(self, profile):
+        """ ROI polygons in the scene CRS, the clip feature of met and DEM requests. """
+        return self.projected(profile['crs'])
+
+
+def window_profile(profile, window):
+    """ Copy of a scene profile for a window of its grid. """
+    profile = dict(profile)
+    profile.update({'height': int(window.height), 'width': int(window.width),
+                    'transform': window_transform(window, profile['transform'])})
+    for key in ('blockxsize', 'blockysize'):
+        # tiles may not fit the window; written rasters get the driver default
+        if key in profile and profile[key] > profile['width' if key == 'blockxsize' else 'height']:
+            profile.pop(key)
+    return profile
+
+
+def crop(arr, window):
+    """ The window of a (height, width) or (bands, height, width) scene array. """
+    if window is None:
+        return arr
+    (r0, r1), (c0, c1) = window.toranges()
+    return arr[..., int(r0):int(r1), int(c0):int(c1)]
+
+
+def covering_window(source, target):
+    """ Window of source holding exactly the target grid, if source covers it.
+
+    :param source: profile or open dataset of a raster, e.g. a full scene input
+    :param target: profile of the processing grid, e.g. an ROI of the scene
+    :return: Window, or None if the grids are the same or the source does not cover the
+    target on the same aligned pixels
+    """
+    if _grid(source) == _grid(target):
+        return None
+    offset = pixel_offset(source, target)
+    if offset is None:
+        return None
+    row, col = offset
+    src_h, src_w = _grid(source)[2:]
+    dst_h, dst_w = _grid(target)[2:]
+    if col < 0 or row < 0 or col + dst_w > src_w or row + dst_h > src_h:
+        return None
+    return Window(col, row, dst_w, dst_h)
+
+
+def pixel_offset(source, target):
+    """ (row, col) of the target grid's first pixel on the source grid, if the two share
+    CRS, resolution and pixel edges, e.g. scenes of a path/row shifted along the track.
+
+    :return: tuple of int, may be negative or past the source, or None
+    """
+    (src_crs, src_t, _, _), (dst_crs, dst_t, _, _) = _grid(source), _grid(target)
+    scale = (src_t.a, src_t.b, src_t.d, src_t.e)
+    if src_crs != dst_crs or scale != (dst_t.a, dst_t.b, dst_t.d, dst_t.e):
+        return None
+    col = (dst_t.c - src_t.c) / src_t.a
+    row = (dst_t.f - src_t.f) / src_t.e
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+    return int(round(row)), int(round(col))
+
+
+def shift(arr, source, target, fill):
+    """ A (height, width) array on the source grid on an aligned target grid, its pixels
+    copied by offset and fill where the source has none.
+
+    :return: array, or None if the grids are not aligned, see pixel_offset
+    """
+    offset = pixel_offset(source, target)
+    if offset is None:
+        return None
+    row, col = offset
+    src_h, src_w = arr.shape
+    dst_h, dst_w = _grid(target)[2:]
+    out = full((dst_h, dst_w), fill, dtype=arr.dtype)
+    # overlap of the two grids, in target rows and columns
+    r0, r1 = max(0, -row), min(dst_h, src_h - row)
+    c0, c1 = max(0, -col), min(dst_w, src_w - col)
+    if r0 < r1 and c0 < c1:
+        out[r0:r1, c0:c1] = arr[r0 + row:r1 + row, c0 + col:c1 + col]
+    return out
+
+
+def _grid(obj):
+    if isinstance(obj, Mapping):
+        return obj['crs'], obj['transform'], obj['height'], obj['width']
+    return obj.crs, obj.transform, obj.height, obj.width
+
+
+def _coordinates(geom):
+    if geom['type'] == 'GeometryCollection':
+        for g in geom['geometries']:
+            for xy in _coordinates(g):
+                yield xy
+        return
+
+    def walk(coords):
+        if coords and isinstance(coords[0], (int, float)):
+            yield coords[0], coords[1]
+        else:
+            for c in coords:
+                for xy in walk(c):
+                    yield xy
+
+    for xy in walk(geom['coordinates']):
+        yield xy
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
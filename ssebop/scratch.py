@@ -0,0 +1,129 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import shutil
+from tempfile import gettempdir
+
+from numpy import load, broadcast, ndim
+from numpy.lib.format import open_memmap
+
+SCRATCH_PREFIX = 'ssebop_scratch_'
+
+# rows of each block of blockwise
+BLOCK_ROWS = 512
+
+
+class ScratchStore(object):
+    """ Per-scene directory of uncompressed .npy intermediates opened as numpy.memmap.
+
+    Intermediates put in the store are paged from disk instead of held in RAM, and the
+    store pickles as its directory only, so pool workers open the same files and share
+    the parent's pages without a copy.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    @classmethod
+    def for_scene(cls, image_id, scratch_root=None):
+        """ Scratch store for one scene under scratch_root, default is the system temp dir. """
+        scratch_root = scratch_root or gettempdir()
+        return cls(os.path.join(scratch_root, '{}{}'.format(SCRATCH_PREFIX, image_id)))
+
+    def _path(self, name):
+        return os.path.join(self.root, '{}.npy'.format(name))
+
+    def put(self, name, arr):
+        """ Write arr to the store.
+
+        :param name: intermediate name, e.g. 'lst'
+        :param arr: numpy array
+        :return: read-only memmap of the stored array, use it in place of arr
+        """
+        out = self.empty(name, arr.shape, arr.dtype)
+        out[...] = arr
+        out.flush()
+        del out
+        return self.get(name)
+
+    def blockwise(self, name, func, inputs, block_rows=BLOCK_ROWS):
+        """ func(*inputs), computed one block of rows at a time into the store.
+
+        Only a block of each input and of func's temporaries is in memory at once, so
+        inputs that are memmaps of the store stay on disk. func must be elementwise.
+
+        :param name: intermediate name of the result
+        :param func: function of arrays of the same rows, e.g. lambda a, b: a * b
+        :param inputs: arrays of (height, width) or (bands, height, width), or scalars
+        :return: read-only memmap of the result, the broadcast shape of inputs
+        """
+        arrays = [a for a in inputs if ndim(a) >= 2]
+        shape = broadcast(*arrays).shape if len(arrays) > 1 else arrays[0].shape
+        out = None
+        for start in range(0, shape[-2], block_rows):
+            rows = slice(start, start + block_rows)
+            block = func(*[a[..., rows, :] if ndim(a) >= 2 else a for a in inputs])
+            if out is None:
+                # the dtype func gives, as on the whole arrays
+                out = self.empty(name, shape, block.dtype)
+            out[..., rows, :] = block
+        out.flush()
+        del out
+        return self.get(name)
+
+    def empty(self, name, shape, dtype):
+        """ Allocate a writable memmap to fill in place, e.g. from a worker process. """
+        return open_memmap(self._path(name), mode='w+', dtype=dtype, shape=shape)
+
+    def get(self, name, mode='r'):
+        """ Open a stored intermediate without reading it into memory. """
+        if name not in self:
+            raise KeyError('{} is not in scratch store {}'.format(name, self.root))
+        return load(self._path(name), mmap_mode=mode)
+
+    def __contains__(self, name):
+        return os.path.isfile(self._path(name))
+
+    def names(self):
+        return sorted(x[:-4] for x in os.listdir(self.root) if x.endswith('.npy'))
+
+    def nbytes(self):
+        return sum(os.path.getsize(self._path(name)) for name in self.names())
+
+    def cleanup(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+    def __getstate__(self):
+        return {'root': self.root}
+
+    def __setstate__(self, state):
+        self.root = state['root']
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,173 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import time
+from collections import OrderedDict
+
+from numpy import errstate, float32, ones
+
+from rasterio import open as rasopen
+
+from ssebop.collector import variable_path
+from ssebop.file_index import index_for
+from ssebop.masks import QAMask
+from ssebop.mtl import find_mtl, parse_mtl
+
+# red and near infrared band numbers
+RED_NIR = {'LT5': (3, 4), 'LE7': (3, 4), 'LC8': (4, 5)}
+
+MAX_CLOUD_COVER = 90.
+MIN_VALID_FRACTION = 0.05
+# c_factor needs this many clear pixels with ndvi > 0.7
+MIN_COLD_PIXELS = 50
+NDVI_THRESHOLD = 0.7
+
+# bands are read at 1 / DECIMATION of their size in each dimension
+DECIMATION = 8
+
+
+class ScreenResult(object):
+    """ Outcome of screening one scene; true if the scene should be run. """
+
+    def __init__(self, image_id, passed, reason=None, checks=None, seconds=0.):
+        self.image_id = image_id
+        self.passed = passed
+        self.reason = reason
+        self.checks = checks or OrderedDict()
+        self.seconds = seconds
+
+    def __bool__(self):
+        return self.passed
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        if self.passed:
+            return 'ScreenResult({}: passed in {:.2f} s)'.format(self.image_id, self.seconds)
+        return 'ScreenResult({}: rejected in {:.2f} s, {})'.format(self.image_id, self.seconds,
+                                                                  self.reason)
+
+
+def band_path(image_dir, meta, band):
+    """ File of a band number or 'QUALITY', from the MTL name or the scene directory. """
+    index = index_for()
+    name = meta.get('file_name_band_{}'.format(band).lower())
+    if name and index.isfile(os.path.join(image_dir, name)):
+        return os.path.join(image_dir, name)
+    suffixes = ('BQA.TIF',) if band == 'QUALITY' else ('_B{}.TIF'.format(band).upper(),
+                                                      'B{}.TIF'.format(band).upper())
+    for name in index.listdir(image_dir):
+        if name.upper().endswith(suffixes):
+            return os.path.join(image_dir, name)
+    return None
+
+
+def read_decimated(path, factor=DECIMATION):
+    with rasopen(path) as src:
+        shape = (max(1, src.height // factor), max(1, src.width // factor))
+        return src.read(1, out_shape=shape)
+
+
+def bqa_cloud(bqa, collection=True):
+    """ Cloud pixels of a Landsat quality band.
+
+    Collection 1 sets bit 4 on cloud; pre-collection Landsat 8 sets cloud confidence
+    in bits 14-15, taken as cloud when high.
+    """
+    if collection:
+        return (bqa >> 4) & 1 == 1
+    return (bqa >> 14) & 3 == 3
+
+
+def screen_scene(image_dir, satellite, image_id=None, max_cloud_cover=MAX_CLOUD_COVER,
+                 min_valid=MIN_VALID_FRACTION, min_cold_pixels=MIN_COLD_PIXELS,
+                 factor=DECIMATION):
+    """ Cheap checks that a scene can yield a c-factor, before full resolution work or
+    met downloads. Checks run cheapest first and stop at the first failure:
+
+        cloud_cover: the MTL scene cloud cover
+        valid: fraction of the scene footprint with data, from a decimated red band
+        cold_pixels: estimated clear pixels with NDVI > 0.7, from decimated red/NIR
+            reflectance and the decimated fmask, or the BQA cloud bits if no fmask exists
+
+    The pixel estimate scales the decimated count by factor ** 2, so a scene close to
+    the c_factor threshold may be rejected; use a smaller factor to screen more closely.
+
+    :return: ScreenResult
+    """
+    start = time.time()
+    image_id = image_id or os.path.basename(image_dir.rstrip(os.sep))
+    checks = OrderedDict()
+
+    def result(passed, reason=None):
+        return ScreenResult(image_id, passed, reason, checks, time.time() - start)
+
+    mtl = find_mtl(image_dir)
+    if mtl is None or satellite not in RED_NIR:
+        return result(True)
+    meta = parse_mtl(mtl)
+
+    checks['cloud_cover'] = meta.get('cloud_cover')
+    if checks['cloud_cover'] is not None and checks['cloud_cover'] > max_cloud_cover:
+        return result(False, 'cloud cover {}% > {}%'.format(checks['cloud_cover'], max_cloud_cover))
+
+    red_band, nir_band = RED_NIR[satellite]
+    red_path, nir_path = band_path(image_dir, meta, red_band), band_path(image_dir, meta, nir_band)
+    if red_path is None or nir_path is None:
+        return result(True)
+    red_dn = read_decimated(red_path, factor)
+    nir_dn = read_decimated(nir_path, factor)
+
+    valid = (red_dn > 0) & (nir_dn > 0)
+    checks['valid'] = float(valid.mean())
+    if checks['valid'] < min_valid:
+        return result(False, 'valid footprint fraction {:.3f} < {}'.format(checks['valid'], min_valid))
+
+    clear = ones(red_dn.shape, dtype=bool)
+    fmask_path = variable_path(image_dir, image_id, 'fmask')
+    bqa_path = band_path(image_dir, meta, 'QUALITY')
+    if index_for().isfile(fmask_path):
+        fmask = read_decimated(fmask_path, factor)
+        if fmask.shape == clear.shape:
+            clear = QAMask(fmask).clear
+    elif bqa_path:
+        bqa = read_decimated(bqa_path, factor)
+        if bqa.shape == clear.shape:
+            clear = ~bqa_cloud(bqa, collection='collection_number' in meta)
+
+    mult, add = 'reflectance_mult_band_{}', 'reflectance_add_band_{}'
+    if mult.format(red_band) not in meta:
+        return result(True)
+    # the sun elevation term divides both bands and cancels in the ratio
+    red = meta[mult.format(red_band)] * red_dn.astype(float32) + meta[add.format(red_band)]
+    nir = meta[mult.format(nir_band)] * nir_dn.astype(float32) + meta[add.format(nir_band)]
+    with errstate(divide='ignore', invalid='ignore'):
+        ndvi = (nir - red) / (nir + red)
+
+    cold = valid & clear & (ndvi > NDVI_THRESHOLD) & (ndvi <= 1.)
+    checks['cold_pixels'] = int(cold.sum()) * factor ** 2
+    if checks['cold_pixels'] < min_cold_pixels:
+        return result(False, 'about {} clear pixels with ndvi > {}, c_factor needs {}'.format(
+            checks['cold_pixels'], NDVI_THRESHOLD, min_cold_pixels))
+
+    return result(True)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -17,31 +17,39 @@
 from __future__ import print_function
 
 import os
-import sys
+import logging
+from collections import OrderedDict
 
-abspath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(abspath)
-from numpy import where, nan, count_nonzero, isnan
-from numpy import nanmean, nanstd, deg2rad
+from numpy import deg2rad, array, where, nan
 
 from datetime import datetime
 
 from rasterio import open as rasopen
 from rasterio.crs import CRS
 
-from ssebop_app.paths import paths, PathsNotSetExecption
-from bounds import RasterBounds
-from sat_image.image import Landsat5, Landsat7, Landsat8
-from ssebop.collector import SSEBopData
-from met.fao import get_net_radiation, air_density, air_specific_heat
-from met.fao import canopy_resistance
-from met.agrimet import Agrimet
+from ssebop_app.log import scene_logger
+from ssebop_app.paths import Paths, PathsNotSetExecption
+from ssebop.c_factor import estimate_c_factor, MIN_COUNT, STEP
+from ssebop.collector import SSEBopData, pet_name
+from ssebop.cube import SeasonCube
+from ssebop.masks import QAMask, OUTSIDE
+from ssebop.dt_climatology import DtClimatology, daily_dt
+from ssebop.scratch import ScratchStore
+from ssebop.storage import storage_for
+from ssebop.file_index import index_for
+from ssebop.screen import screen_scene
+from ssebop.kernels import surface_parameters
+from ssebop.refet_grid import PET_SOURCES, REF_CROPS
+from ssebop.results import SceneResult, PRODUCTS, product_path
+from ssebop.roi import Roi, RoiError, C_FACTOR_EXTENTS, crop, window_profile
 
 
 class SSEBopModel(object):
     _satellite = None
     _is_configured = False
 
+    products = PRODUCTS
+
     def __init__(self, runspec=None, **kwargs):
 
         self.image = None
@@ -53,6 +61,32 @@ class SSEBopModel(object):
         self.agrimet_corrected = None
         self.completed = False
         self.override_count = False
+        self.dt_source = 'scene'
+        self.backend = 'numpy'
+        self.chunk_size = None
+        self.scratch_dir = None
+        self.scratch = None
+        self.screen = False
+        self.screen_result = None
+        self.c_factor_method = 'exact'
+        self.c_factor_step = None
+        self.c_estimate = None
+        # CFactor of an overlapping scene of the same date, used in place of this scene's
+        self.shared_c = None
+        self.storage = index_for()
+        self.local_image_dir = None
+        self.paths = None
+        self.cube = False
+        self.qa = None
+        self.surface_kernel = False
+        self._surface = None
+        self._surface_window = None
+        self.roi = None
+        self.window = None
+        self.c_factor_extent = 'roi'
+        self.scene_dc = None
+        self.pet_source = 'gridmet'
+        self.ref_crop = 'eto'
 
         if runspec:
             self.image_dir = runspec.image_dir
@@ -64,176 +98,403 @@ class SSEBopModel(object):
             self.row = runspec.row
             self.image_id = runspec.image_id
             self.agrimet_corrected = runspec.agrimet_corrected
-
-            if not paths.is_set():
+            if runspec.dt_source:
+                self.dt_source = runspec.dt_source
+            if runspec.backend:
+                self.backend = runspec.backend
+            self.chunk_size = runspec.chunk_size
+            self.scratch_dir = runspec.scratch_dir
+            self.screen = bool(getattr(runspec, 'screen', False))
+            if getattr(runspec, 'c_factor_method', None):
+                self.c_factor_method = runspec.c_factor_method
+            self.c_factor_step = getattr(runspec, 'c_factor_step', None)
+            self.cube = bool(getattr(runspec, 'cube', False))
+            self.surface_kernel = bool(getattr(runspec, 'surface_kernel', False))
+            self.roi = Roi.from_config(getattr(runspec, 'roi', None))
+            if getattr(runspec, 'c_factor_extent', None):
+                self.c_factor_extent = runspec.c_factor_extent
+            if getattr(runspec, 'pet_source', None):
+                self.pet_source = runspec.pet_source
+            if getattr(runspec, 'ref_crop', None):
+                self.ref_crop = runspec.ref_crop
+            self.storage = index_for(storage_for(runspec.root,
+                                                 endpoint_url=getattr(runspec, 'storage_endpoint', None),
+                                                 cache_dir=getattr(runspec, 'cache_dir', None)))
+
+            if not runspec.root:
                 raise PathsNotSetExecption
 
+            # per-run paths, so scenes of different roots can run side by side
+            self.paths = Paths.for_root(runspec.root)
             if runspec.verify_paths:
-                paths.verify()
+                self.paths.verify()
         else:
             for name, val in kwargs.items():
                 setattr(self, name, val)
 
         self._info('Constructing/Initializing SSEBop...')
 
+    @property
+    def log(self):
+        """ This module's logger, with the scene's image_id on each record. """
+        return scene_logger(getattr(self, 'image_id', None), __name__)
+
     def configure_run(self):
 
         self._info('Configuring SSEBop run, checking data...')
 
-        print('----------- CONFIGURATION --------------')
-        for attr in ('image_date', 'satellite',
-                     'path', 'row', 'image_id', 'image_exists'):
-            print('{:<20s}{}'.format(attr, getattr(self, '{}'.format(attr))))
-        print('----------- ------------- --------------')
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('configuration: %s', ', '.join(
+                '{}={}'.format(attr, getattr(self, attr)) for attr in
+                ('image_date', 'satellite', 'path', 'row', 'image_id', 'image_exists')))
 
         if not self.image_exists:
             raise NotImplementedError
 
         self.check_products()
 
+        from sat_image.image import Landsat5, Landsat7, Landsat8
+
         mapping = {'LT5': Landsat5, 'LE7': Landsat7, 'LC8': Landsat8}
         if not self.image:
             try:
                 cls = mapping[self.satellite]
-                self.image = cls(self.image_dir)
+                # sat_image reads the bands from a local directory
+                self.local_image_dir = self.storage.local_dir(self.image_dir)
+                self.image = cls(self.local_image_dir)
             except KeyError:
-                print('Invalid satellite key: "{}". available key = {}'.format
-                      (self.satellite,
-                       ','.join(mapping.keys())))
+                self.log.error('Invalid satellite key: "%s". available key = %s',
+                               self.satellite, ','.join(mapping.keys()))
 
         self._is_configured = True
 
+        if self.c_factor_extent not in C_FACTOR_EXTENTS:
+            raise RoiError('Invalid c_factor_extent: "{}", available = {}'.format(
+                self.c_factor_extent, C_FACTOR_EXTENTS))
+        if self.pet_source not in PET_SOURCES:
+            raise ValueError('Invalid pet_source: "{}", available = {}'.format(self.pet_source,
+                                                                             PET_SOURCES))
+        if self.ref_crop not in REF_CROPS:
+            raise ValueError('Invalid ref_crop: "{}", available = {}'.format(self.ref_crop,
+                                                                           list(REF_CROPS)))
+
+        scene = self.image.rasterio_geometry
+        if self.roi:
+            self.window = self.roi.window(scene)
+            self.log.info('Processing the ROI, %s of %s rows and %s of %s columns',
+                          self.window.height, scene['height'], self.window.width, scene['width'])
+            clip_geo, tag = self.roi.clip_geometry(scene), self.roi.tag
+        else:
+            clip_geo, tag = self.image.get_tile_geometry(), None
+
+        profile = self.profile
         self.dc = SSEBopData(image_id=self.image_id,
                                    image_dir=self.image_dir,
-                                   transform=self.image.rasterio_geometry['transform'],
-                                   profile=self.image.rasterio_geometry,
-                                   clip_geo=self.image.get_tile_geometry(),
-                                   date=self.image_date)
-
-    def run(self, overwrite=False):
+                                   transform=profile['transform'],
+                                   profile=profile,
+                                   clip_geo=clip_geo,
+                                   date=self.image_date,
+                                   storage=self.storage,
+                                   tag=tag,
+                                   pet_source=self.pet_source,
+                                   ref_crop=self.ref_crop)
+
+        if self.scene_c_factor():
+            self.scene_dc = SSEBopData(image_id=self.image_id,
+                                       image_dir=self.image_dir,
+                                       transform=scene['transform'],
+                                       profile=scene,
+                                       clip_geo=self.image.get_tile_geometry(),
+                                       date=self.image_date,
+                                       storage=self.storage)
+
+    @property
+    def profile(self):
+        """ rasterio profile of the processed grid, the ROI window or the whole scene. """
+        if self.window is None:
+            return self.image.rasterio_geometry
+        return window_profile(self.image.rasterio_geometry, self.window)
+
+    def scene_c_factor(self):
+        """ True if the c-factor of an ROI run comes from the whole scene. """
+        return self.window is not None and self.c_factor_extent == 'scene'
+
+    def run(self, overwrite=False, backend=None, write=True):
         """ Run the SSEBop algorithm for an image. Check for outputs from previous run.
-        :return: 
+        :param overwrite: run even if products exist, :type bool
+        :param backend: 'numpy' computes in memory, 'dask' builds a chunked graph computed in
+        parallel and written tile by tile; defaults to the runspec backend, :type str
+        :param write: write the products and append the season cube; without, the products
+        are only returned, and existing products are recomputed, :type bool
+        :return: SceneResult, or None if the image is screened out or has too few cold pixels;
+        the result of a completed run reads the existing products
         """
 
-        if self.completed and not overwrite:
-            return None
+        if self.completed and not overwrite and write:
+            return self._result(written=True)
 
-        dt = self.difference_temp()
-        ts = self.image.land_surface_temp()
+        backend = backend or self.backend
+
+        if self.screen:
+            self.screen_result = screen_scene(self.local_image_dir or self.image_dir, self.satellite,
+                                              image_id=self.image_id)
+            if not self.screen_result:
+                self.log.info('Skipping: %s, screened in %.2f s',
+                              self.screen_result.reason, self.screen_result.seconds)
+                return None
+
+        if self.scratch_dir:
+            self.scratch = ScratchStore.for_scene(self.image_id, self.scratch_dir)
+        try:
+            return self._run(backend, write)
+        finally:
+            if self.scratch:
+                self.scratch.cleanup()
+                self.scratch = None
+
+    def _run(self, backend, write):
+        # c is checked before dT so an unusable image does not fetch tmin and the DEM
+        ts = self._keep('lst', self.surface('lst'))
         c = self.c_factor(ts)
         if not c:
-            print('moving to next day due to invalid image for t_corr')
+            self.log.warning('moving to next day due to invalid image for t_corr')
             return None
-        ta = self.dc.data_check(variable='tmax', temp_units='K')
-        tc = c * ta
-        th = tc + dt
-        etrf = (th - ts) / dt
-        pet = self.dc.data_check(variable='pet')
-        et = pet * etrf
-        fmask = self.dc.data_check(variable='fmask', sat_image=self.image)
-        et_mskd = where(fmask == 0, et, nan)
-
-        self.save_array(et_mskd, variable_name='ssebop_et_mskd',
-                        output_path=self.image_dir)
-        self.save_array(pet, variable_name='pet', output_path=self.image_dir)
-        self.save_array(ts, variable_name='lst', output_path=self.image_dir)
-        self.save_array(et, variable_name='ssebop_et', output_path=self.image_dir)
-        self.save_array(etrf, variable_name='ssebop_etrf',
-                        output_path=self.image_dir)
+        if backend == 'dask':
+            return self._run_lazy(ts, c, write)
+        elif backend != 'numpy':
+            raise NotImplementedError('Backend {} is not supported'.format(backend))
+        dt = self.difference_temp()
+        ta = self._input('tmax', temp_units='K')
+        etrf = self._compute('etrf', lambda ta, dt, ts: (c * ta + dt - ts) / dt, ta, dt, ts)
+        pet = self._input('pet')
+        et = self._compute('et', lambda pet, etrf: pet * etrf, pet, etrf)
+        qa = self.qa_mask()
+        et_mskd = self._compute('et_mskd', lambda et, clear: where(clear, et, nan), et, qa.clear)
+        arrays = OrderedDict(zip(self.products, (et_mskd, pet, ts, et, etrf)))
+
+        if write:
+            for name, arr in arrays.items():
+                self.save_array(arr, variable_name=name, output_path=self.image_dir)
+            if self.cube:
+                self.append_cube({'etrf': etrf, 'et': et, 'lst': ts, 'fmask': qa.flags})
 
         if self.agrimet_corrected:
+            from met.agrimet import Agrimet
+
             lat, lon = self.image.scene_coords_deg[0], \
                        self.image.scene_coords_deg[1]
             agrimet = Agrimet(lat=lat, lon=lon)
             # TODO move fetch formed data into instantiation
             # function in both (?) gridmet and agrimet to find bias and correct
-        return None
+        return self._result(arrays, c, written=write)
+
+    def _keep(self, name, arr):
+        """ Move an intermediate to the scene's scratch store, if one is configured. """
+        if self.scratch is None:
+            return arr
+        return self.scratch.put(name, arr)
+
+    def _input(self, variable, **kwargs):
+        """ An input of the scene grid, read once per run into the scratch store if there is one. """
+        if self.scratch is not None and variable in self.scratch:
+            return self.scratch.get(variable)
+        return self._keep(variable, self.dc.data_check(variable=variable, **kwargs))
+
+    def _compute(self, name, func, *inputs):
+        """ func(*inputs); with a scratch store, computed block by block into it, so no
+        full-scene temporary of func is held in memory. func must be elementwise. """
+        if self.scratch is None:
+            return func(*inputs)
+        return self.scratch.blockwise(name, func, inputs)
+
+    def _run_lazy(self, ts, c, write):
+        """ dT, etrf and ET as one chunked graph over window reads of the inputs. ts is
+        eager: the c-factor, computed first, needs every pixel of it. """
+        from ssebop.lazy import et_graph, store_rasters, compute_arrays, as_lazy, CHUNK_SIZE
+
+        chunk_size = self.chunk_size or CHUNK_SIZE
+        dt = self.difference_temp(chunk_size=chunk_size)
+        ta = self.dc.lazy_data_check(variable='tmax', temp_units='K', chunk_size=chunk_size)
+        pet = self.dc.lazy_data_check(variable='pet', chunk_size=chunk_size)
+        # the mask c_factor already read
+        qa = self.qa_mask()
+
+        outputs = et_graph(ts=as_lazy(ts, chunk_size), c=c, ta=ta,
+                           dt=dt, pet=pet,
+                           clear=as_lazy(qa.clear, chunk_size))
+        if not write:
+            return self._result(compute_arrays(outputs), c)
+
+        outputs = {self._output_filename(name, self.image_dir): arr for name, arr in outputs.items()}
+        store_rasters(outputs, self.profile, chunk_size=chunk_size,
+                      writer=self.storage.writer)
+
+        if self.cube:
+            self.append_cube({'etrf': self._read_output('ssebop_etrf'),
+                              'et': self._read_output('ssebop_et'),
+                              'lst': self._read_output('lst'),
+                              'fmask': qa.flags})
+        return self._result(c=c, written=True)
+
+    def _result(self, arrays=None, c=None, written=False):
+        """ SceneResult of the run. Written products in the scratch store are left to their
+        files, read on access; arrays the scratch store would delete on cleanup are copied. """
+        paths = {p: self._output_filename(p) for p in self.products} if written else None
+        if arrays is not None and self.scratch is not None:
+            arrays = None if written else OrderedDict((k, array(v)) for k, v in arrays.items())
+        return SceneResult(self.image_id, self.image.date_acquired, self.profile, arrays=arrays,
+                           paths=paths, c=c, opener=self.storage.open)
+
+    def _read_output(self, variable_name):
+        with self.storage.open(self._output_filename(variable_name)) as src:
+            return src.read(1)
+
+    def append_cube(self, arrays):
+        """ Append this scene's outputs to the season cube of its year directory.
+
+        The cube of an object store root is kept in the local mirror of the year directory.
+        :param arrays: dict of {variable: array} of ssebop.cube.CUBE_VARIABLES
+        :return: SeasonCube
+        """
+        cube = SeasonCube.for_year_dir(self.storage.cache_path(self.parent_dir),
+                                    tag=self.roi.tag if self.roi else None)
+        cube.append(self.image_id, self.image_date, arrays, self.profile)
+        return cube
 
     def c_factor(self, ts):
+        """ Temperature correction factor from cold, dense vegetation pixels.
 
-        ndvi = self.image.ndvi()
-        tmax = self.dc.data_check(variable='tmax', temp_units='K')
+        c_factor_method 'exact' uses every pixel; 'strided' and 'stratified' sample one
+        pixel in c_factor_step ** 2 and report a confidence interval, see ssebop.c_factor.
+        With shared_c, c is that of an overlapping scene and is not estimated again.
+        :param ts: land surface temperature, K
+        :return: c, or None if the image has too few clear cold pixels
+        """
+        if self.shared_c is not None:
+            self.c_estimate = self.shared_c
+            self.log.info('c = %.4f, shared by an overlapping scene of the same date',
+                          self.shared_c.c)
+            return self.shared_c.c
+
+        if self.scene_c_factor():
+            ts = self.surface('lst', extent='scene')
+            ndvi = self.surface('ndvi', extent='scene')
+            tmax = self.scene_dc.data_check(variable='tmax', temp_units='K')
+            fmask = self.scene_dc.data_check(variable='fmask', sat_image=self.image)
+            clear = QAMask(fmask).clear
+        else:
+            ndvi = self.surface('ndvi')
+            tmax = self.dc.data_check(variable='tmax', temp_units='K')
+            clear = self.qa_mask().clear
         if len(tmax.shape) > 2:
             tmax = tmax.reshape(tmax.shape[1], tmax.shape[2])
 
-        loc = where(ndvi > 0.7)
-        temps = []
-        for j, k in zip(loc[0], loc[1]):
-            temps.append(tmax[j, k])
-        ind = loc[0][0], loc[1][0]
+        min_count = 0 if self.override_count else MIN_COUNT
+        estimate = estimate_c_factor(ts, ndvi, tmax, clear, method=self.c_factor_method,
+                                     step=self.c_factor_step or STEP, min_count=min_count)
+        self.c_estimate = estimate
 
-        ta = tmax[ind]
-        t_corr_orig = ts / ta
-        t_corr_mean = nanmean(t_corr_orig)
-        t_diff = ts - ta
-        ta = None
-
-        t_corr = where((ndvi >= 0.7) & (ndvi <= 1.0), t_corr_orig, nan)
-        ndvi = None
-        t_corr_orig = None
-
-        t_corr = where(ts > 270., t_corr, nan)
-        ts = None
-
-        t_corr = where((t_diff > 0) & (t_diff < 30), t_corr, nan)
-        t_diff = None
-
-        fmask = self.dc.data_check(variable='fmask', sat_image=self.image)
-
-        t_corr = where(fmask == 0, t_corr, nan)
-
-        test_count = count_nonzero(~isnan(t_corr))
-
-        if test_count < 50 and not self.override_count:
-            print('Count of clear pixels {} in {} is insufficient'
-                  ' to perform analysis.'.format(test_count, self.image_id))
+        if estimate is None:
+            self.log.warning('Count of clear pixels is insufficient to perform analysis.')
             return None
 
-        print('You have {} pixels for your temperature '
-              'correction scheme.'.format(test_count))
+        self.log.info('You have %s pixels for your temperature correction scheme.',
+                      estimate.count)
+        if estimate.method != 'exact':
+            self.log.info('c = %.4f, 95%% interval %.4f to %.4f (%s sample)',
+                          estimate.c, estimate.low, estimate.high, estimate.method)
 
-        t_corr_std = nanstd(t_corr)
-        c = t_corr_mean - (2 * t_corr_std)
+        return estimate.c
 
-        return c
+    def surface(self, name, extent='roi'):
+        """ The scene's 'lst', 'ndvi' or 'albedo', on the ROI window or the whole scene.
 
-    def difference_temp(self):
+        With surface_kernel the three come from one pass over the bands, see
+        ssebop.kernels, and are kept for the run; only the ROI's rows and columns are
+        read unless the c-factor needs the whole scene. Otherwise each is a sat_image
+        call, cropped to the ROI.
+        """
+        if not self.surface_kernel:
+            arr = {'lst': self.image.land_surface_temp,
+                   'ndvi': self.image.ndvi,
+                   'albedo': self.image.albedo}[name]()
+            window = None
+        else:
+            if self._surface is None:
+                self._surface_window = None if self.scene_c_factor() else self.window
+                self._surface = surface_parameters(self.local_image_dir or self.image_dir,
+                                                   self.satellite, window=self._surface_window)
+            arr, window = getattr(self._surface, name), self._surface_window
+        if extent == 'roi' and window is None:
+            return crop(arr, self.window)
+        return arr
+
+    def qa_mask(self):
+        """ The scene's QAMask, read or computed once and shared by c_factor and run. """
+        if self.qa is None:
+            flags = self.dc.data_check(variable='fmask', sat_image=self.image)
+            if self.roi:
+                flags = QAMask(flags).flags | (self.roi.outside(self.profile) * OUTSIDE)
+            self.qa = QAMask(self._keep('fmask', flags))
+        return self.qa
+
+    def difference_temp(self, chunk_size=None):
+        """ dT of the scene, from the climatology or the day's met.
+
+        :param chunk_size: return a dask graph of this chunk size, reading tmin, tmax and
+        the DEM window by window, instead of an array
+        """
         doy = int(datetime.strftime(self.image.date_acquired, '%j'))
-        dem = self.dc.data_check(variable='dem')
-        tmin = self.dc.data_check(variable='tmin', temp_units='K')
-        tmax = self.dc.data_check(variable='tmax', temp_units='K')
-        center_lat = (self.image.corner_ll_lat_product + self.image.corner_ul_lat_product) / 2.
-        lat_radians = deg2rad(center_lat)
-        albedo = self.image.albedo()
-        net_rad = get_net_radiation(tmin=tmin, tmax=tmax, doy=doy,
-                                    elevation=dem, lat=lat_radians,
-                                    albedo=albedo)
 
-        rho = air_density(tmin=tmin, tmax=tmax, elevation=dem)
-        cp = air_specific_heat()
-        rah = canopy_resistance()
+        if self.dt_source == 'climatology':
+            clim = DtClimatology.for_path_row(os.path.dirname(self.parent_dir), storage=self.storage)
+            if clim.exists():
+                dt = clim.get(doy, target_profile=self.profile)
+                if chunk_size:
+                    from ssebop.lazy import as_lazy
+                    return as_lazy(dt, chunk_size)
+                return self._keep('dt', dt)
+            self.log.info('No dT climatology at %s, computing dT for this scene', clim.path)
+
+        if chunk_size:
+            from ssebop.lazy import as_lazy, lazy_daily_dt
+            return lazy_daily_dt(tmin=self.dc.lazy_data_check('tmin', temp_units='K', chunk_size=chunk_size),
+                                 tmax=self.dc.lazy_data_check('tmax', temp_units='K', chunk_size=chunk_size),
+                                 doy=doy,
+                                 elevation=self.dc.lazy_data_check('dem', chunk_size=chunk_size),
+                                 lat=self.center_lat_radians(),
+                                 albedo=as_lazy(self.surface('albedo'), chunk_size))
+
+        dem = self._input('dem')
+        tmin = self._input('tmin', temp_units='K')
+        tmax = self._input('tmax', temp_units='K')
+        albedo = self._keep('albedo', self.surface('albedo'))
+        lat = self.center_lat_radians()
+        return self._compute('dt', lambda tmin, tmax, dem, albedo: daily_dt(
+            tmin=tmin, tmax=tmax, doy=doy, elevation=dem, lat=lat, albedo=albedo), tmin, tmax, dem, albedo)
+
+    def build_dt_climatology(self, years):
+        """ Build the day-of-year dT climatology for this scene's path/row.
+
+        :param years: iterable of history years
+        :return: DtClimatology
+        """
+        clim = DtClimatology.for_path_row(os.path.dirname(self.parent_dir), storage=self.storage)
+        clim.build(self.dc, lat=self.center_lat_radians(), years=years)
+        return clim
 
-        dt = (net_rad * rah) / (rho * cp)
-        return dt
+    def center_lat_radians(self):
+        center_lat = (self.image.corner_ll_lat_product + self.image.corner_ul_lat_product) / 2.
+        return deg2rad(center_lat)
 
-    @staticmethod
-    def _info(msg):
-        print('---------------------------------------')
-        print(msg)
-        print('---------------------------------------')
+    def _info(self, msg):
+        self.log.debug(msg)
 
     def save_array(self, arr, variable_name, crs=None, output_path=None):
 
-        geometry = self.image.rasterio_geometry
-
-        if not output_path:
-            output_filename = os.path.join(self.image_dir,
-                                           '{}_{}.tif'.format(self.image_id,
-                                                              variable_name))
-        else:
-            output_filename = os.path.join(output_path,
-                                           '{}_{}.tif'.format(self.image_id,
-                                                              variable_name))
+        # a copy, the image geometry is shared by every product and may be read concurrently
+        geometry = dict(self.profile)
+        output_filename = self._output_filename(variable_name, output_path)
 
         try:
             arr = arr.reshape(1, arr.shape[1], arr.shape[2])
@@ -244,18 +505,27 @@ class SSEBopModel(object):
 
         if crs:
             geometry['crs'] = CRS({'init': crs})
-        with rasopen(output_filename, 'w', **geometry) as dst:
-            dst.write(arr)
+        with self.storage.writer(output_filename) as tmp:
+            with rasopen(tmp, 'w', **geometry) as dst:
+                dst.write(arr)
 
         return None
 
+    def _output_filename(self, variable_name, output_path=None):
+        if variable_name == 'pet':
+            # the pet product is the pet input, of the run's source and crop
+            variable_name = pet_name(self.pet_source, self.ref_crop)
+        return product_path(output_path or self.image_dir, self.image_id, variable_name,
+                            tag=self.roi.tag if self.roi else None)
+
     def check_products(self):
-        products = ['ssebop_et_mskd', 'pet', 'lst', 'ssebop_et', 'ssebop_etrf']
-        for p in products:
-            raster = os.path.join(self.image_dir, '{}_{}.tif'.format(self.image_id, p))
-            if os.path.isfile(raster):
-                print('This analysis has been done for at least {}'.format(p))
-                self.completed = True
-                return None
+        """ Mark the run complete only if every product exists, so an interrupted
+        run is not mistaken for a finished one."""
+        missing = [p for p in self.products
+                   if not self.storage.exists(self._output_filename(p))]
+        if not missing:
+            self.log.info('This analysis has been done')
+            self.completed = True
+        return None
 
 # ========================= EOF ====================================================================
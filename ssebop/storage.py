@@ -0,0 +1,249 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import shutil
+from contextlib import contextmanager
+from tempfile import mkstemp, gettempdir
+
+from ssebop.atomic import atomic_output, TEMP_PREFIX
+
+S3_SCHEME = 's3://'
+
+MULTIPART_THRESHOLD = 16 * 1024 ** 2
+MULTIPART_CHUNKSIZE = 16 * 1024 ** 2
+MAX_CONCURRENCY = 8
+
+
+def storage_for(root, endpoint_url=None, cache_dir=None):
+    """ Storage backend of a project root: S3Storage for s3://bucket/prefix, else LocalStorage.
+
+    :param root: project root of the root/path/row/year/scene layout
+    :param endpoint_url: S3-compatible endpoint, e.g. a MinIO server, default is AWS
+    :param cache_dir: local read-through cache of an object store
+    """
+    if root and str(root).startswith(S3_SCHEME):
+        return S3Storage(endpoint_url=endpoint_url, cache_dir=cache_dir)
+    return LocalStorage()
+
+
+class LocalStorage(object):
+    """ Files on a local or mounted filesystem. Paths are plain filenames. """
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def makedirs(self, path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def open(self, path):
+        from rasterio import open as rasopen
+        return rasopen(path)
+
+    def local_path(self, path):
+        return path
+
+    def local_dir(self, path):
+        return path
+
+    def cache_path(self, path):
+        return path
+
+    def writer(self, path):
+        """ Context manager yielding a temporary filename that replaces path on success. """
+        return atomic_output(path)
+
+    def put_dir(self, path):
+        return None
+
+
+class S3Storage(object):
+    """ Objects in an S3-compatible store, addressed as s3://bucket/key paths.
+
+    Rasters are read either through GDAL's /vsis3/ driver, which fetches only the byte
+    ranges a windowed read needs, or, with a cache_dir, from a local copy downloaded on
+    first use. Writes go to a local temporary file that is uploaded on success, in
+    parallel multipart chunks for large files.
+
+    boto3 is imported when the backend is created, so it is only needed for s3:// roots.
+    """
+
+    def __init__(self, endpoint_url=None, cache_dir=None, client=None,
+                 multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE,
+                 max_concurrency=MAX_CONCURRENCY):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.endpoint_url = endpoint_url
+        self.cache_dir = cache_dir
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url)
+        self.transfer = TransferConfig(multipart_threshold=multipart_threshold,
+                                       multipart_chunksize=multipart_chunksize,
+                                       max_concurrency=max_concurrency, use_threads=True)
+
+    @staticmethod
+    def split(path):
+        """ (bucket, key) of an s3:// path. """
+        if not path.startswith(S3_SCHEME):
+            raise ValueError('Not an S3 path: {}'.format(path))
+        bucket, _, key = path[len(S3_SCHEME):].partition('/')
+        return bucket, key.strip('/')
+
+    def gdal_path(self, path):
+        bucket, key = self.split(path)
+        return '/vsis3/{}/{}'.format(bucket, key)
+
+    def gdal_env(self):
+        """ GDAL options pointing /vsis3/ at the configured endpoint. """
+        options = {'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR'}
+        if self.endpoint_url:
+            scheme, _, host = self.endpoint_url.partition('://')
+            options.update({'AWS_S3_ENDPOINT': host.rstrip('/'),
+                            'AWS_HTTPS': 'YES' if scheme == 'https' else 'NO',
+                            'AWS_VIRTUAL_HOSTING': 'FALSE'})
+        return options
+
+    def exists(self, path):
+        bucket, key = self.split(path)
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError:
+            pass
+        # a 'directory' exists if any object is under it
+        resp = self.client.list_objects_v2(Bucket=bucket, Prefix=key + '/', MaxKeys=1)
+        return resp.get('KeyCount', 0) > 0
+
+    def _keys(self, path, delimiter=None):
+        bucket, key = self.split(path)
+        prefix = key + '/' if key else ''
+        kwargs = {'Bucket': bucket, 'Prefix': prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+        for page in self.client.get_paginator('list_objects_v2').paginate(**kwargs):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(prefix):]
+            for sub in page.get('CommonPrefixes', []):
+                yield sub['Prefix'][len(prefix):].rstrip('/')
+
+    def listdir(self, path):
+        return sorted(self._keys(path, delimiter='/'))
+
+    def makedirs(self, path):
+        # keys are created with the objects under them
+        return None
+
+    def cache_path(self, path):
+        """ Local mirror location of path, whether or not it has been downloaded. """
+        bucket, key = self.split(path)
+        root = self.cache_dir or os.path.join(gettempdir(), 'ssebop_s3_cache')
+        return os.path.join(root, bucket, *key.split('/'))
+
+    def local_path(self, path):
+        """ Local copy of an object, downloaded once into the cache; writer replaces it. """
+        local = self.cache_path(path)
+        if not os.path.isfile(local):
+            bucket, key = self.split(path)
+            if not os.path.isdir(os.path.dirname(local)):
+                os.makedirs(os.path.dirname(local))
+            with atomic_output(local) as tmp:
+                self.client.download_file(bucket, key, tmp, Config=self.transfer)
+        return local
+
+    def local_dir(self, path):
+        """ Local copy of every object under path, e.g. a scene directory for sat_image. """
+        for name in self._keys(path):
+            self.local_path('{}/{}'.format(path.rstrip('/'), name))
+        local = self.cache_path(path)
+        if not os.path.isdir(local):
+            os.makedirs(local)
+        return local
+
+    def open(self, path):
+        """ Open a raster for reading, from the cache if one is set, else by ranged reads. """
+        from rasterio import open as rasopen, Env
+
+        if self.cache_dir:
+            return rasopen(self.local_path(path))
+        return _EnvDataset(Env(**self.gdal_env()), self.gdal_path(path))
+
+    @contextmanager
+    def writer(self, path):
+        """ Yield a temporary filename, uploaded to path if the block succeeds. """
+        bucket, key = self.split(path)
+        fd, tmp = mkstemp(prefix=TEMP_PREFIX, suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            yield tmp
+            self.client.upload_file(tmp, bucket, key, Config=self.transfer)
+            # the mirror always holds what was last written, so local_path never returns
+            # a copy of the object from before an overwrite
+            local = self.cache_path(path)
+            if not os.path.isdir(os.path.dirname(local)):
+                os.makedirs(os.path.dirname(local))
+            shutil.move(tmp, local)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def put_dir(self, path):
+        """ Upload files written into local_dir(path) by another tool, e.g. a downloader. """
+        local = self.cache_path(path)
+        bucket, key = self.split(path)
+        for dirpath, _, names in os.walk(local):
+            for name in names:
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, name), local).replace(os.sep, '/')
+                self.client.upload_file(os.path.join(dirpath, name), bucket,
+                                        '{}/{}'.format(key, rel), Config=self.transfer)
+        return None
+
+
+class _EnvDataset(object):
+    """ A rasterio dataset opened, and closed, inside a GDAL environment. """
+
+    def __init__(self, env, path):
+        self.env = env
+        self.path = path
+        self.dataset = None
+
+    def __enter__(self):
+        from rasterio import open as rasopen
+
+        self.env.__enter__()
+        try:
+            self.dataset = rasopen(self.path)
+        except Exception:
+            self.env.__exit__(None, None, None)
+            raise
+        return self.dataset
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.dataset.close()
+        self.env.__exit__(exc_type, exc_val, exc_tb)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,335 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+from numpy import (arange, asarray, empty, floor, int32, int64, interp, load, savez_compressed,
+                   searchsorted)
+from rasterio.warp import transform as transform_coords
+
+from ssebop.atomic import atomic_output
+
+WARP_CACHE_DIR = 'warp_plans'
+
+# bytes of plans held in memory by the process, for every path/row; a plan is 4 bytes a
+# target pixel, 5 if some target pixels have no source pixel, so a full Landsat scene
+# plan is about 300 MB
+MAX_PLAN_BYTES = 2 ** 30
+
+# bytes of saved plans in a directory, least recently used removed first; saved plans
+# are compressed, a few MB for a scene from a shared grid such as gridMET or the DEM
+MAX_PLAN_DIR_BYTES = 2 ** 29
+
+# target pixels between exactly transformed nodes when the CRS differs, the rest are
+# interpolated, as GDAL's approximate transformer does
+NODE_STEP = 16
+
+BLOCK_ROWS = 1024
+
+
+def grid_key(grid):
+    """ Hashable key of a grid: CRS, transform, height and width.
+
+    :param grid: rasterio profile or open dataset
+    """
+    crs, transform, height, width = _grid(grid)
+    return (crs.to_wkt() if hasattr(crs, 'to_wkt') else str(crs),
+            tuple(round(v, 9) for v in tuple(transform)[:6]), int(height), int(width))
+
+
+class WarpPlan(object):
+    """ Nearest-neighbour source pixel of every target pixel, as flat source indices.
+
+    Applying the plan is a gather, so every variable warped between the same two grids,
+    e.g. tmax, tmin and pet of a scene, or the shared DEM onto each scene of a season,
+    reuses one coordinate transform.
+    """
+
+    def __init__(self, index, source_shape, target_shape):
+        self.index = index
+        self.source_shape = tuple(source_shape)
+        self.target_shape = tuple(target_shape)
+        invalid = index < 0
+        # target pixels filled rather than gathered, shared by every variable of the plan
+        self._invalid = invalid.ravel() if invalid.any() else None
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes + (0 if self._invalid is None else self._invalid.nbytes)
+
+    @classmethod
+    def compute(cls, source, target):
+        """ Plan from source to target grid, both rasterio profiles or open datasets. """
+        src_crs, src_t, src_h, src_w = _grid(source)
+        dst_crs, dst_t, dst_h, dst_w = _grid(target)
+        dtype = int32 if src_h * src_w < 2 ** 31 else int64
+        index = empty((dst_h, dst_w), dtype=dtype)
+        inverse = ~src_t
+        same_crs = src_crs == dst_crs
+
+        for start in range(0, dst_h, BLOCK_ROWS):
+            rows = arange(start, min(start + BLOCK_ROWS, dst_h))
+            if same_crs:
+                x, y = _centers(dst_t, rows, arange(dst_w))
+            else:
+                x, y = _projected_centers(dst_t, dst_crs, src_crs, rows, dst_w, dst_h)
+            col = floor(inverse.a * x + inverse.b * y + inverse.c)
+            row = floor(inverse.d * x + inverse.e * y + inverse.f)
+            valid = (col >= 0) & (col < src_w) & (row >= 0) & (row < src_h)
+            block = (row * src_w + col)
+            block[~valid] = -1
+            index[rows[0]:rows[-1] + 1] = block.astype(dtype)
+
+        return cls(index, (src_h, src_w), (dst_h, dst_w))
+
+    def rows(self, start, stop):
+        """ Plan of target rows start to stop, to gather a large target block by block. """
+        return WarpPlan(self.index[start:stop], self.source_shape,
+                        (stop - start, self.target_shape[1]))
+
+    def apply(self, arr, fill):
+        """ arr, on the source grid, on the target grid; fill where the source has no pixel.
+
+        :param arr: (height, width) or (bands, height, width) array
+        :return: array of the same number of dimensions on the target grid
+        """
+        arr = asarray(arr)
+        flat = arr.reshape(-1, self.source_shape[0] * self.source_shape[1])
+        # the -1 of target pixels without a source pixel take pixel 0, then are filled
+        out = flat.take(self.index.ravel(), axis=1, mode='clip')
+        if self._invalid is not None:
+            out[:, self._invalid] = fill
+        if arr.ndim == 2:
+            return out.reshape(self.target_shape)
+        return out.reshape((flat.shape[0],) + self.target_shape)
+
+
+class PlanMemory(object):
+    """ Plans held in memory, least recently used dropped first past a budget of bytes.
+
+    One PlanMemory serves every WarpCache of the process, so a long run over many
+    path/rows holds no more than the budget, whatever the number of caches.
+    """
+
+    def __init__(self, max_bytes=MAX_PLAN_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def get(self, key):
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+            return plan
+
+    def put(self, key, plan):
+        """ Hold plan, unless it alone is over the budget. """
+        with self._lock:
+            old = self._plans.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            if plan.nbytes > self.max_bytes:
+                return None
+            self._plans[key] = plan
+            self.nbytes += plan.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self._plans.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.nbytes = 0
+
+
+_MEMORY = PlanMemory()
+
+
+class WarpCache(object):
+    """ Plans by (source grid, target grid), in memory and optionally in a directory.
+
+    A plan depends only on its two grids, so plans in memory are kept in the process's
+    PlanMemory, shared by every cache. With a directory, e.g. one per path/row, plans are
+    also saved as compressed .npz files and reused by later runs and other processes, up
+    to max_bytes of files. Only plans from a grid shared by many runs, such as gridMET,
+    the DEM or the dT climatology, are worth saving; a plan between two scene grids is
+    kept in memory only.
+    """
+
+    def __init__(self, directory=None, memory=None, max_bytes=MAX_PLAN_DIR_BYTES):
+        """
+        :param directory: directory of saved plans, or None to keep them in memory only
+        :param memory: PlanMemory, default the process's
+        :param max_bytes: bytes of saved plans in directory
+        """
+        self.directory = directory
+        self.memory = _MEMORY if memory is None else memory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+
+    def plan(self, source, target):
+        key = _digest(grid_key(source), grid_key(target))
+        plan = self.memory.get(key)
+        if plan is not None:
+            self.hits += 1
+            return plan
+
+        plan = self._load(key)
+        if plan is None:
+            self.misses += 1
+            plan = WarpPlan.compute(source, target)
+            self._save(key, plan)
+        else:
+            self.hits += 1
+
+        self.memory.put(key, plan)
+        return plan
+
+    def warp(self, arr, source, target, fill):
+        """ arr on the source grid gathered onto the target grid. """
+        return self.plan(source, target).apply(arr, fill)
+
+    def clear(self):
+        self.memory.clear()
+
+    def _file(self, key):
+        return os.path.join(self.directory, '{}.npz'.format(key))
+
+    def _load(self, key):
+        if not self.directory or not os.path.isfile(self._file(key)):
+            return None
+        with load(self._file(key)) as npz:
+            plan = WarpPlan(npz['index'], npz['source_shape'], npz['index'].shape)
+        try:
+            # a used plan is the last to be removed
+            os.utime(self._file(key), None)
+        except OSError:
+            pass
+        return plan
+
+    def _save(self, key, plan):
+        if not self.directory:
+            return None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        with atomic_output(self._file(key)) as tmp:
+            with open(tmp, 'wb') as f:
+                savez_compressed(f, index=plan.index, source_shape=asarray(plan.source_shape))
+        self._evict()
+        return None
+
+    def _evict(self):
+        """ Remove the least recently used plans of the directory past max_bytes. """
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        return None
+
+
+def warp_cache(directory=None):
+    """ WarpCache of a directory, or in memory only for None, on the process's PlanMemory. """
+    return WarpCache(directory)
+
+
+def path_row_cache(path_row_dir, storage=None):
+    """ WarpCache of a path/row, saved in <path_row>/warp_plans or its local mirror. """
+    if storage is not None:
+        path_row_dir = storage.cache_path(path_row_dir)
+    return warp_cache(os.path.join(path_row_dir, WARP_CACHE_DIR))
+
+
+def fill_value(nodata):
+    """ Value of target pixels without a source pixel: the nodata value, else 0 as in a
+    GDAL warp into a new array. """
+    return 0 if nodata is None else nodata
+
+
+def _grid(obj):
+    if hasattr(obj, 'keys'):
+        return obj['crs'], obj['transform'], obj['height'], obj['width']
+    return obj.crs, obj.transform, obj.height, obj.width
+
+
+def _digest(source_key, target_key):
+    return sha1(repr((source_key, target_key)).encode('utf-8')).hexdigest()[:20]
+
+
+def _centers(t, rows, cols):
+    """ Map coordinates of the centers of a block of pixels. """
+    c, r = cols[None, :] + 0.5, rows[:, None] + 0.5
+    return t.a * c + t.b * r + t.c, t.d * c + t.e * r + t.f
+
+
+def _projected_centers(t, dst_crs, src_crs, rows, width, height):
+    """ Pixel centers of rows in the source CRS, exact at every NODE_STEP pixels. """
+    node_cols = _nodes(width)
+    node_rows = _nodes(height)
+    node_rows = node_rows[(node_rows >= rows[0] - NODE_STEP) & (node_rows <= rows[-1] + NODE_STEP)]
+    x, y = _centers(t, node_rows.astype(float), node_cols.astype(float))
+    xs, ys = transform_coords(dst_crs, src_crs, x.ravel().tolist(), y.ravel().tolist())
+    xs = asarray(xs).reshape(x.shape)
+    ys = asarray(ys).reshape(y.shape)
+
+    # along columns on the node rows, then linearly between node rows
+    cols = arange(width)
+    along_x = asarray([interp(cols, node_cols, r) for r in xs])
+    along_y = asarray([interp(cols, node_cols, r) for r in ys])
+    if len(node_rows) == 1:
+        return along_x.repeat(len(rows), axis=0), along_y.repeat(len(rows), axis=0)
+    pos = (searchsorted(node_rows, rows, side='right') - 1).clip(0, len(node_rows) - 2)
+    w = ((rows - node_rows[pos]) / (node_rows[pos + 1] - node_rows[pos]))[:, None]
+    return (along_x[pos] * (1 - w) + along_x[pos + 1] * w,
+            along_y[pos] * (1 - w) + along_y[pos + 1] * w)
+
+
+def _nodes(n):
+    nodes = arange(0, n, NODE_STEP)
+    if nodes[-1] != n - 1:
+        nodes = asarray(list(nodes) + [n - 1])
+    return nodes
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
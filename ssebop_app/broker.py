@@ -0,0 +1,251 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import logging
+import socket
+import sqlite3
+import traceback
+from threading import Thread, Event
+from collections import namedtuple
+
+QUEUED, LEASED, DONE, FAILED = 'queued', 'leased', 'done', 'failed'
+
+Job = namedtuple('Job', ['job_id', 'payload', 'attempts', 'worker', 'lease_expires'])
+
+# under the 'ssebop' logger of ssebop_app.log, as the package's modules are
+logger = logging.getLogger('ssebop.broker')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL
+)
+'''
+
+
+class SQLiteBroker(object):
+    """ Job queue of serialized RunSpecs backed by a single SQLite file.
+
+    Workers take a job under a time-limited lease; a job whose lease expires (the worker
+    died or lost its node) is handed to the next worker until its attempts run out.
+    The database must sit on a filesystem with working POSIX locks shared by all nodes.
+    """
+
+    def __init__(self, path, timeout=60.):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as conn:
+            conn.execute(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        return _Transaction(conn)
+
+    def put(self, job_id, payload, max_attempts=3):
+        """ Queue a job, submitting an existing job_id again is a no-op.
+
+        :return: True if the job was added
+        """
+        with self._connect() as conn:
+            cur = conn.execute('INSERT OR IGNORE INTO jobs (job_id, payload, state, max_attempts, updated) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (job_id, json.dumps(payload), QUEUED, max_attempts, time.time()))
+            return cur.rowcount == 1
+
+    def lease(self, worker, lease_seconds=3600.):
+        """ Take the oldest queued or expired job.
+
+        :return: Job, or None if nothing is available
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET state = ?, error = ?, updated = ? '
+                         'WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts',
+                         (FAILED, 'lease expired', now, LEASED, now))
+
+            row = conn.execute('SELECT job_id, payload, attempts FROM jobs '
+                               'WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                               'ORDER BY rowid LIMIT 1', (QUEUED, LEASED, now)).fetchone()
+            if row is None:
+                return None
+
+            job_id, payload, attempts = row
+            expires = now + lease_seconds
+            conn.execute('UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, '
+                         'attempts = ?, updated = ? WHERE job_id = ?',
+                         (LEASED, worker, expires, attempts + 1, now, job_id))
+
+        return Job(job_id, json.loads(payload), attempts + 1, worker, expires)
+
+    def renew(self, job, lease_seconds=3600.):
+        """ Extend a lease still held by job.worker.
+
+        :return: True if the lease is still ours
+        """
+        with self._connect() as conn:
+            cur = conn.execute('UPDATE jobs SET lease_expires = ?, updated = ? '
+                               'WHERE job_id = ? AND worker = ? AND state = ?',
+                               (time.time() + lease_seconds, time.time(), job.job_id, job.worker, LEASED))
+            return cur.rowcount == 1
+
+    def complete(self, job):
+        """ Mark a job done; completing a job twice, or one another worker finished, is harmless. """
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET state = ?, lease_expires = NULL, error = NULL, updated = ? '
+                         'WHERE job_id = ?', (DONE, time.time(), job.job_id))
+
+    def fail(self, job, error):
+        """ Record a failure, requeueing the job while attempts remain. """
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN ? ELSE ? END, '
+                         'lease_expires = NULL, error = ?, updated = ? '
+                         'WHERE job_id = ? AND worker = ? AND state = ?',
+                         (QUEUED, FAILED, error, time.time(), job.job_id, job.worker, LEASED))
+
+    def state(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT state FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict(rows)
+
+    def failures(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT job_id, attempts, error FROM jobs WHERE state = ?',
+                                (FAILED,)).fetchall()
+
+
+class _Transaction(object):
+    """ Hold the database write lock for the whole block so leasing is atomic across processes. """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.conn.execute('COMMIT')
+            else:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self.conn.close()
+
+
+class _Heartbeat(Thread):
+    def __init__(self, broker, job, lease_seconds):
+        Thread.__init__(self)
+        self.daemon = True
+        self.broker = broker
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 3.):
+            self.broker.renew(self.job, self.lease_seconds)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def submit(broker, runspecs, max_attempts=3):
+    """ Queue one job per runspec, keyed by image id.
+
+    :return: number of new jobs
+    """
+    count = 0
+    for runspec in runspecs:
+        if broker.put(runspec.image_id, runspec.to_dict(), max_attempts=max_attempts):
+            count += 1
+    return count
+
+
+def run_job(payload):
+    """ Run SSEBop for one serialized runspec; a scene whose products all exist is
+    completed without being recomputed. """
+    from ssebop_app.config import RunSpec
+    from ssebop_app.paths import paths
+    from ssebop.ssebop import SSEBopModel
+
+    runspec = RunSpec.from_dict(payload)
+    paths.build(runspec.root)
+
+    sseb = SSEBopModel(runspec)
+    sseb.configure_run()
+    sseb.run()
+
+
+def worker_id():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def run_worker(broker, worker=None, lease_seconds=3600., poll=0., runner=run_job):
+    """ Lease and run jobs until the queue is empty.
+
+    :param broker: SQLiteBroker
+    :param worker: name recorded on leases, default is host-pid
+    :param lease_seconds: lease length, renewed in the background while a job runs
+    :param poll: seconds to wait for new jobs when the queue is empty, 0 exits immediately
+    :param runner: callable taking the job payload
+    :return: number of jobs completed by this worker
+    """
+    worker = worker or worker_id()
+    done = 0
+    while True:
+        job = broker.lease(worker, lease_seconds)
+        if job is None:
+            if not poll:
+                return done
+            time.sleep(poll)
+            continue
+
+        logger.info('%s running %s (attempt %s)', worker, job.job_id, job.attempts)
+        heartbeat = _Heartbeat(broker, job, lease_seconds)
+        heartbeat.start()
+        try:
+            runner(job.payload)
+        except Exception:
+            broker.fail(job, traceback.format_exc())
+        else:
+            broker.complete(job)
+            done += 1
+        finally:
+            heartbeat.stop()
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ============= EOF =============================================
@@ -17,25 +17,33 @@
 from __future__ import print_function
 
 import os
-import sys
 import click
 import logging
+import traceback
 
 # checkout rasterio.rio.options creation_options for mixins todo
 
+# heavy geospatial and network packages are imported inside the commands that use them,
+# so 'ssebop --help' and 'ssebop mkconfig' start without loading them
 from ssebop_app.paths import paths
-from ssebop_app.config import Config, check_config
-from ssebop.ssebop import SSEBopModel
-
-pp = os.path.realpath(__file__)
-sys.path.append(os.path.dirname(os.path.dirname(pp)))
+from ssebop_app.config import Config, RunSpec, check_config
+from ssebop_app.journal import RunJournal, DOWNLOADING, RUNNING, DONE, FAILED, SKIPPED
+from ssebop_app.log import configure_logging, stop_logging, verbosity_level
 
 logger = logging.getLogger('ssebop')
 
 
 @click.group()
-def cli():
-    pass
+@click.option('--verbose', '-v', 'verbose', count=True, help='Log debug messages')
+@click.option('--quiet', '-q', 'quiet', is_flag=True, default=False, help='Log warnings and errors only')
+@click.option('--log-file', 'log_file', default=None, type=click.Path(dir_okay=False, writable=True),
+              help='Also write the log to this file')
+@click.option('--log-json', 'log_json', is_flag=True, default=False, help='Log JSON lines')
+@click.pass_context
+def cli(ctx, verbose, quiet, log_file, log_json):
+    """ Log records go through a queue to one writer thread, shared by worker processes. """
+    configure_logging(level=verbosity_level(verbose, quiet), log_file=log_file, as_json=log_json)
+    ctx.call_on_close(stop_logging)
 
 
 @click.command('mkconfig', help='Create a template configuration file')
@@ -60,30 +68,333 @@ def configure(path):
 
 @click.command('run', help='Run the SSEBop model')
 @click.argument('config_path', default=None, type=click.Path(exists=True))
-def run(config_path):
+@click.option('--max-retries', '-r', 'max_retries', default=None, type=int,
+              help='Times a failed scene is retried, overrides the config')
+@click.option('--profile', 'profile_dir', default=None, type=click.Path(file_okay=False),
+              help='Write a cProfile of each scene to DIR/<image_id>.prof')
+@click.option('--profile-memory', 'profile_memory', is_flag=True, default=False,
+              help='With --profile, also write the top allocations of each scene, slows the run')
+def run(config_path, max_retries, profile_dir, profile_memory):
     """ Run the SSEBop model.
+
+    Each scene's state is recorded in a journal in the year directory; running the same
+    config again resumes where the last run stopped and retries failed scenes.
     
     :param config_path: Path to a configuration file, if the file does not exist
                      a blank template will be created at your root directory. :type str
+    :param max_retries: Times a failed scene is retried :type int
+    :param profile_dir: Directory of per-scene profiles, see 'ssebop profile-report' :type str
+    :param profile_memory: Trace allocations of each scene :type bool
     :return: None
     """
 
     click.echo('Configuration file: {}'.format(config_path))
     click.echo('Running Model')
 
-    cfg = Config(config_path)
-    for runspec in cfg.runspecs:
-        paths.build(runspec.input_root, runspec.output_root)
+    cfg = Config(config_path, build_runspecs=False)
+    if max_retries is None:
+        max_retries = cfg.max_retries if cfg.max_retries is not None else 1
+
+    # appended line by line, so kept in the local mirror of an object store root
+    journal_dir = cfg.storage.cache_path(cfg.year_dir)
+    if not os.path.isdir(journal_dir):
+        os.makedirs(journal_dir)
+    journal = RunJournal.for_directory(journal_dir, max_retries=max_retries)
+    journal.add(cfg.get_image_list())
+
+    profiler = None
+    if profile_dir:
+        from ssebop_app.profiling import SceneProfiler
+        profiler = SceneProfiler(profile_dir, memory=profile_memory)
 
+    if logger.isEnabledFor(logging.INFO):
         welcome()
 
-        sseb = SSEBopModel(runspec)
-        sseb.configure_run(runspec)
-        sseb.run()
+    remaining = journal.remaining()
+    while remaining:
+        if cfg.composite:
+            run_composites(cfg, remaining, journal, profiler)
+        else:
+            for image in remaining:
+                run_scene(cfg, image, journal, profiler=profiler)
+        remaining = journal.remaining()
+
+    click.echo('Run complete: {}'.format(journal.summary()))
+    for image_id, error in journal.errors.items():
+        if journal.state(image_id) == FAILED:
+            click.echo('{} failed:\n{}'.format(image_id, error))
+
+
+def run_scene(cfg, image, journal, group=None, profiler=None, runspec=None):
+    """ Download and run one scene, recording each step in the journal.
+
+    With a CompositeGroup, met and DEM inputs the group fetched or a sibling scene of
+    the same date already has are reused instead of downloaded, and the c-factor of a
+    sibling that has run serves the scene. With the runspec of download_scene, the image
+    is already downloaded. With a SceneProfiler, the scene's download and run are
+    profiled.
+    """
+    from ssebop.ssebop import SSEBopModel
+    from ssebop_app.profiling import profiled
+
+    try:
+        with profiled(profiler, image):
+            if runspec is None:
+                runspec = download_scene(cfg, image, journal)
+                if runspec is None:
+                    return None
+            if group is not None:
+                group.share_inputs(runspec)
+
+            journal.mark(image, RUNNING)
+            sseb = SSEBopModel(runspec)
+            if group is not None:
+                sseb.shared_c = group.c_factor(runspec)
+            sseb.configure_run()
+            sseb.run()
+            if group is not None:
+                group.add_c_factor(runspec, sseb.c_estimate)
+    except Exception:
+        journal.mark(image, FAILED, error=traceback.format_exc())
+    else:
+        screened = sseb.screen_result
+        if screened is not None and not screened:
+            report_skip(journal, screened)
+        else:
+            journal.mark(image, DONE)
+
+
+def download_scene(cfg, image, journal):
+    """ RunSpec of a scene, its image downloaded, or None if the download failed. """
+    try:
+        journal.mark(image, DOWNLOADING)
+        runspec = RunSpec(image, cfg)
+        paths.build(runspec.root)
+    except Exception:
+        journal.mark(image, FAILED, error=traceback.format_exc())
+        return None
+    return runspec
+
+
+def report_skip(journal, screened):
+    """ Record a scene rejected by the pre-screen and the time the screen saved. """
+    typical = journal.mean_run_seconds()
+    journal.mark(screened.image_id, SKIPPED, reason=screened.reason)
+    if typical is None:
+        saved = 'a full scene run'
+    else:
+        saved = 'about {:.0f} s'.format(max(typical - screened.seconds, 0.))
+    click.echo('{} skipped: {}; screened in {:.1f} s, saving {}'.format(
+        screened.image_id, screened.reason, screened.seconds, saved))
+
+
+def run_composites(cfg, images, journal, profiler=None):
+    """ Run scenes date by date, sharing inputs and the c-factor within each date, and
+    write a best-pixel ET composite of each date's scenes.
+
+    The date's images are downloaded first, so its shared inputs are fetched once for
+    all of them; the scenes then run in sensor priority order, the profile of each
+    covering its run only.
+    """
+    from ssebop_app.composite import CompositeGroup, group_by_date, priority
+
+    for same_date in group_by_date(images):
+        # scenes of the date finished in an earlier run still feed the composite
+        siblings = [i for i in journal.scenes if i[9:16] == same_date[0][9:16]]
+        group = CompositeGroup([RunSpec.local(i, cfg) for i in siblings])
+        runspecs = [(image, download_scene(cfg, image, journal))
+                    for image in sorted(same_date, key=priority)]
+        try:
+            group.fetch_inputs()
+        except Exception:
+            # each scene fetches what it lacks
+            click.echo('Shared inputs of {} failed:\n{}'.format(', '.join(same_date),
+                                                                 traceback.format_exc()))
+        for image, runspec in runspecs:
+            if runspec is not None:
+                run_scene(cfg, image, journal, group, profiler=profiler, runspec=runspec)
+        try:
+            group.write_composites()
+        except Exception:
+            click.echo('Composite of {} failed:\n{}'.format(', '.join(siblings), traceback.format_exc()))
+
+
+@click.command('dtclim', help='Build the day-of-year dT climatology for a path/row')
+@click.argument('config_path', default=None, type=click.Path(exists=True))
+@click.option('--start-year', '-s', 'start_year', default=2001, type=int)
+@click.option('--end-year', '-e', 'end_year', default=2016, type=int)
+def dt_climatology(config_path, start_year, end_year):
+    """ Build the dT climatology used when the config sets dt_source: climatology.
+
+    The climatology is built once per path/row on the grid of the first scene in the config.
+
+    :param config_path: Path to a configuration file :type str
+    :param start_year: First year of temperature history :type int
+    :param end_year: Last year of temperature history :type int
+    :return: None
+    """
+
+    from ssebop.ssebop import SSEBopModel
+
+    cfg = Config(config_path)
+    runspec = cfg.runspecs[0]
+    paths.build(runspec.root)
+
+    sseb = SSEBopModel(runspec)
+    sseb.configure_run()
+    clim = sseb.build_dt_climatology(years=range(start_year, end_year + 1))
+    click.echo('dT climatology written to {}'.format(clim.path))
+
+
+@click.command('submit', help='Queue the scenes of a config for distributed workers')
+@click.argument('config_path', default=None, type=click.Path(exists=True))
+@click.option('--broker', '-b', 'broker_path', required=True, type=click.Path())
+@click.option('--max-attempts', '-m', 'max_attempts', default=3, type=int)
+def submit(config_path, broker_path, max_attempts):
+    """ Queue one job per scene of the configuration.
+
+    :param config_path: Path to a configuration file :type str
+    :param broker_path: Path to the broker database, shared by all worker nodes :type str
+    :param max_attempts: Number of times a scene is tried before it is marked failed :type int
+    :return: None
+    """
+    from ssebop_app.broker import SQLiteBroker, submit as submit_jobs
+
+    cfg = Config(config_path)
+    broker = SQLiteBroker(broker_path)
+    count = submit_jobs(broker, cfg.runspecs, max_attempts=max_attempts)
+    click.echo('Queued {} new scenes, broker state {}'.format(count, broker.counts()))
+
+
+@click.command('worker', help='Run queued scenes until the broker is empty')
+@click.option('--broker', '-b', 'broker_path', required=True, type=click.Path(exists=True))
+@click.option('--lease', '-l', 'lease_seconds', default=3600., type=float)
+@click.option('--poll', '-p', 'poll', default=0., type=float,
+              help='Seconds between checks for new jobs, 0 exits when the queue is empty')
+def worker(broker_path, lease_seconds, poll):
+    """ Lease and run scenes from a broker; start one per core on each node.
+
+    :param broker_path: Path to the broker database :type str
+    :param lease_seconds: Lease length, renewed while a scene runs :type float
+    :param poll: Seconds to wait for new jobs :type float
+    :return: None
+    """
+    from ssebop_app.broker import SQLiteBroker, run_worker
+
+    broker = SQLiteBroker(broker_path)
+    done = run_worker(broker, lease_seconds=lease_seconds, poll=poll)
+    click.echo('Completed {} scenes, broker state {}'.format(done, broker.counts()))
+
+
+@click.command('plan', help='Report the work, I/O and memory a config needs, without running it')
+@click.argument('config_path', default=None, type=click.Path(exists=True))
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Emit the job graph as JSON')
+def plan(config_path, as_json):
+    """ Dry run: inspect the disk for the scenes of a config and print the job graph with
+    estimated download bytes, written bytes and peak memory per scene. Only scenes already
+    on disk are listed; nothing is downloaded, computed or written.
+
+    :param config_path: Path to a configuration file :type str
+    :param as_json: Print JSON instead of a table :type bool
+    :return: None
+    """
+    import json
+    from ssebop_app.planner import plan as plan_config, format_plan
+
+    cfg = Config(config_path, build_runspecs=False)
+    result = plan_config(cfg)
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+    else:
+        click.echo(format_plan(result))
+
+
+@click.command('mosaic', help='Mosaic per-scene outputs into one raster')
+@click.argument('out_path', type=click.Path())
+@click.argument('inputs', nargs=-1, type=click.Path(exists=True))
+@click.option('--root', '-d', 'root', default=None, type=click.Path(exists=True),
+              help='Mosaic every scene output of the product under this directory')
+@click.option('--product', 'product', default='ssebop_et_mskd')
+@click.option('--rule', 'rule', default='latest', type=click.Choice(['latest', 'max-clear', 'mean']))
+@click.option('--crs', 'crs', default=None, help='Output CRS, e.g. EPSG:5070, default is the first input\'s')
+@click.option('--res', 'res', default=None, type=float, help='Output pixel size in CRS units')
+def mosaic(out_path, inputs, root, product, rule, crs, res):
+    """ Stream per-scene outputs into one tiled GeoTIFF, block by block, with bounded memory.
+    An out_path ending in .vrt writes a VRT referencing the inputs when they share a grid.
+
+    :param out_path: Output filename :type str
+    :param inputs: Rasters to mosaic :type str
+    :param root: Directory searched for *_<product>.tif :type str
+    :param product: Product name, e.g. ssebop_et_mskd :type str
+    :param rule: Overlap rule: latest, max-clear or mean :type str
+    :return: None
+    """
+    from ssebop.mosaic import mosaic as write_mosaic, find_outputs
+
+    inputs = list(inputs)
+    if root:
+        inputs += find_outputs(root, product)
+    if not inputs:
+        raise click.UsageError('No rasters to mosaic, pass INPUTS or --root')
+    write_mosaic(inputs, out_path, rule=rule, crs=crs, res=res)
+    click.echo('Mosaic of {} rasters written to {}'.format(len(inputs), out_path))
+
+
+@click.command('fmask', help='Write the Fmask of every scene under a directory, ahead of the model')
+@click.argument('root', type=click.Path(exists=True))
+@click.option('--workers', '-w', 'workers', default=None, type=int,
+              help='Worker processes, default is one per core')
+@click.option('--overwrite', '-f', 'overwrite', is_flag=True, default=False,
+              help='Remake masks that are newer than their MTL file')
+def fmask(root, workers, overwrite):
+    """ Compute the cloud mask of each scene directory under root in a process pool and
+    write it where the model reads it, <image_id>_fmask.tif. Masks newer than the scene's
+    MTL file are kept.
+
+    :param root: Directory searched for scene directories :type str
+    :param workers: Number of processes :type int
+    :param overwrite: Remake up-to-date masks :type bool
+    :return: None
+    """
+    from ssebop.masks import batch_fmask, WRITTEN, CURRENT, FAILED
+
+    results = batch_fmask(root, workers=workers, overwrite=overwrite)
+    states = [r[1] for r in results]
+    click.echo('{} masks written, {} up to date, {} failed'.format(
+        states.count(WRITTEN), states.count(CURRENT), states.count(FAILED)))
+    if FAILED in states:
+        raise SystemExit(1)
+
+
+@click.command('profile-report', help='Summarize the scene profiles written by run --profile')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--top', '-n', 'top', default=20, type=int, help='Number of functions listed')
+@click.option('--sort', 'sort', default='tottime', type=click.Choice(['tottime', 'cumtime']))
+@click.option('--package', 'package', default=None,
+              help='List only functions of a package, e.g. ssebop, numpy or rasterio')
+def profile_report(paths, top, sort, package):
+    """ Time by package and the hottest functions over a batch of scene profiles.
+
+    :param paths: Profile directories or .prof files :type str
+    :param top: Number of functions :type int
+    :param sort: tottime, time in the function itself, or cumtime, with its callees :type str
+    :param package: Package of the listed functions :type str
+    :return: None
+    """
+    from ssebop_app.profiling import report
+
+    click.echo(report(paths, top=top, sort=sort, package=package))
 
 
 cli.add_command(configure)
 cli.add_command(run)
+cli.add_command(dt_climatology)
+cli.add_command(submit)
+cli.add_command(worker)
+cli.add_command(plan)
+cli.add_command(mosaic)
+cli.add_command(fmask)
+cli.add_command(profile_report)
 
 
 def welcome():
@@ -106,4 +417,8 @@ For more information regarding a specific command use
 with the command of interest.
         ''')
 
+
+if __name__ == '__main__':
+    cli()
+
 # ============= EOF =============================================
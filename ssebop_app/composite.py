@@ -0,0 +1,381 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import logging
+from copy import deepcopy
+from collections import OrderedDict
+from datetime import datetime
+
+from numpy import full, nan, isnan, isfinite, float32, uint8, where, zeros
+from rasterio import open as rasopen
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds, from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from ssebop.collector import SSEBopData, variable_path
+from ssebop.file_index import index_for
+from ssebop.masks import QAMask, MASK_NODATA
+from ssebop.mosaic import windows
+from ssebop.mtl import find_mtl, parse_mtl
+from ssebop.results import product_path
+from ssebop.roi import roi_tag
+from ssebop_app.log import scene_logger
+
+# met and terrain inputs that do not depend on the sensor
+SHARED_VARIABLES = ('tmax', 'tmin', 'pet', 'dem')
+
+# clear pixels are taken from the first sensor in this order
+SENSOR_PRIORITY = ('LC8', 'LE7', 'LT5')
+
+NO_SOURCE = 255
+
+# under the 'ssebop' logger of ssebop_app.log, as the package's modules are
+logger = logging.getLogger('ssebop.composite')
+
+
+def priority(image_id):
+    """ Rank of a scene's sensor in SENSOR_PRIORITY, other sensors last. """
+    try:
+        return SENSOR_PRIORITY.index(image_id[:3])
+    except ValueError:
+        return len(SENSOR_PRIORITY)
+
+
+def group_by_date(image_ids):
+    """ Scene ids grouped by acquisition date, in date order. """
+    groups = OrderedDict()
+    for image_id in sorted(image_ids, key=lambda x: x[9:16]):
+        groups.setdefault(image_id[9:16], []).append(image_id)
+    return list(groups.values())
+
+
+def footprint(image_dir):
+    """ (west, south, east, north) of a scene in degrees from its MTL corners, or None. """
+    mtl = find_mtl(image_dir)
+    if mtl is None:
+        return None
+    m = parse_mtl(mtl)
+    lats = [m['corner_{}_lat_product'.format(c)] for c in ('ul', 'ur', 'll', 'lr')]
+    lons = [m['corner_{}_lon_product'.format(c)] for c in ('ul', 'ur', 'll', 'lr')]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def overlaps(runspec, other):
+    """ True if two scenes overlap, by MTL footprint or, lacking an MTL, by path/row. """
+    a, b = footprint(runspec.image_dir), footprint(other.image_dir)
+    if a is None or b is None:
+        return (runspec.path, runspec.row) == (other.path, other.row)
+    return intersects(a, b)
+
+
+def best_pixel(et_stack, clear_stack):
+    """ Per-pixel ET from the first scene in priority order that is clear there.
+
+    :param et_stack: (scenes, rows, cols) ET on a common grid, nan outside a scene
+    :param clear_stack: (scenes, rows, cols) boolean, True where the scene is cloud free
+    :return: composite ET, index of the source scene (255 where no scene is clear)
+    """
+    composite = full(et_stack.shape[1:], nan, dtype=float32)
+    source = full(et_stack.shape[1:], NO_SOURCE, dtype=uint8)
+    for i in range(et_stack.shape[0]):
+        take = isnan(composite) & clear_stack[i] & isfinite(et_stack[i])
+        composite[take] = et_stack[i][take]
+        source[take] = i
+    return composite, source
+
+
+def _et_path(runspec):
+    """ The scene's ET product, that of its ROI if the run has one. """
+    return product_path(runspec.image_dir, runspec.image_id, 'ssebop_et',
+                        tag=roi_tag(getattr(runspec, 'roi', None)))
+
+
+def _input_path(runspec, config, var):
+    """ A shared input of runspec's scene, pet of the source and crop of config's run. """
+    return variable_path(runspec.image_dir, runspec.image_id, var,
+                         pet_source=getattr(config, 'pet_source', None),
+                         ref_crop=getattr(config, 'ref_crop', None))
+
+
+def _first_band(image_dir):
+    tifs = [x for x in index_for().listdir(image_dir) if x.endswith('.TIF')]
+    return os.path.join(image_dir, tifs[0])
+
+
+def scene_profile(image_dir):
+    """ Grid of a scene, taken from its first band as sat_image does. """
+    with rasopen(_first_band(image_dir)) as src:
+        return deepcopy(src.profile)
+
+
+def has_bands(image_dir):
+    """ True if the scene's image is downloaded. """
+    index = index_for()
+    return index.isdir(image_dir) and any(x.endswith('.TIF') for x in index.listdir(image_dir))
+
+
+def union_grid(base, profiles):
+    """ Grid of base's CRS and resolution covering every grid of profiles.
+
+    :param base: profile whose CRS, resolution and other keys the grid takes
+    :param profiles: rasterio profiles
+    """
+    res = base['transform'].a
+    west, south, east, north = [], [], [], []
+    for p in profiles:
+        bounds = transform_bounds(p['crs'], base['crs'],
+                                  *array_bounds(p['height'], p['width'], p['transform']))
+        west.append(bounds[0])
+        south.append(bounds[1])
+        east.append(bounds[2])
+        north.append(bounds[3])
+
+    grid = deepcopy(base)
+    grid.update({'transform': from_origin(min(west), max(north), res, res),
+                 'width': int(round((max(east) - min(west)) / res)),
+                 'height': int(round((max(north) - min(south)) / res))})
+    return grid
+
+
+def scene_footprint(image_dir):
+    """ Boolean array on the scene grid, True inside the scene's imaged footprint,
+    where its first band is not the Landsat fill value of 0. """
+    with rasopen(_first_band(image_dir)) as src:
+        return src.read(1) != 0
+
+
+def read_on_grid(path, profile, resampling=Resampling.nearest, window=None):
+    """ Read band 1 of a raster warped onto profile's grid, nan outside the source.
+
+    :param window: Window of profile's grid to read, default all of it
+    """
+    with rasopen(path) as src:
+        with WarpedVRT(src, crs=profile['crs'], transform=profile['transform'],
+                       height=profile['height'], width=profile['width'],
+                       resampling=resampling, src_nodata=src.nodata, nodata=nan,
+                       dtype='float32') as vrt:
+            return vrt.read(1, window=window)
+
+
+class CompositeGroup(object):
+    """ Scenes acquired on one date whose footprints overlap, e.g. LE7 and LC8 on the
+    same path/row.
+
+    The group shares work between its scenes. fetch_inputs downloads tmax, tmin, pet
+    and the DEM once for overlapping scenes, on a grid covering all of them, and
+    share_inputs warps that raster onto each scene's own grid. The c-factor of the first
+    scene to run, in sensor priority, serves its siblings. After the group has run,
+    write_composites produces one best-pixel ET mosaic per date, taking each pixel from
+    the highest priority sensor that is clear there according to its fmask.
+    """
+
+    def __init__(self, runspecs):
+        self.runspecs = sorted(runspecs, key=lambda r: priority(r.image_id))
+        # CFactor of each scene that has run, by image_id
+        self.c_factors = {}
+
+    def siblings(self, runspec):
+        for other in self.runspecs:
+            if other.image_id != runspec.image_id and overlaps(runspec, other):
+                yield other
+
+    def fetch_inputs(self):
+        """ Fetch each shared input once for every set of overlapping, downloaded scenes,
+        before they run.
+
+        An input none of the scenes has is fetched for the highest priority scene, on a
+        grid covering every scene of the set and not clipped to a footprint, so
+        share_inputs finds it covers the others.
+
+        :return: list of variables fetched
+        """
+        index = index_for()
+        for runspec in self.runspecs:
+            # downloaded since the group was made
+            index.invalidate(runspec.image_dir)
+        fetched = []
+        for cluster in self._clusters([r for r in self.runspecs if has_bands(r.image_dir)]):
+            if len(cluster) < 2:
+                continue
+            lead = cluster[0]
+            missing = [var for var in SHARED_VARIABLES
+                       if not any(index.isfile(_input_path(r, lead, var)) for r in cluster)]
+            if not missing:
+                continue
+            grid = union_grid(scene_profile(lead.image_dir),
+                              [scene_profile(r.image_dir) for r in cluster])
+            data = SSEBopData(image_id=lead.image_id, image_dir=lead.image_dir,
+                              transform=grid['transform'], profile=grid, clip_geo=None,
+                              date=lead.image_date,
+                              pet_source=getattr(lead, 'pet_source', None) or 'gridmet',
+                              ref_crop=getattr(lead, 'ref_crop', None) or 'eto')
+            for var in missing:
+                # the model reads temperatures in K
+                data.data_check(var, temp_units='K')
+                scene_logger(lead.image_id, logger.name).info(
+                    '%s fetched for %s', var, ', '.join(r.image_id for r in cluster))
+                fetched.append(var)
+        return fetched
+
+    def c_factor(self, runspec):
+        """ CFactor of the first sibling of runspec's scene that has one, or None. """
+        for other in self.siblings(runspec):
+            if self.c_factors.get(other.image_id) is not None:
+                return self.c_factors[other.image_id]
+        return None
+
+    def add_c_factor(self, runspec, estimate):
+        """ Record the CFactor of a scene that has run, None if it had too few cold pixels. """
+        if estimate is not None:
+            self.c_factors[runspec.image_id] = estimate
+
+    def share_inputs(self, runspec):
+        """ Give runspec's scene any shared input a sibling already has and that covers it.
+
+        Inputs are clipped to each scene's footprint, so a sibling's raster covers the
+        scene if it has values over the scene's footprint; the scene's fill corners,
+        outside any footprint, may be nan.
+
+        :return: list of variables shared
+        """
+        index = index_for()
+        profile, inside = None, None
+        shared = []
+        for var in SHARED_VARIABLES:
+            target = _input_path(runspec, runspec, var)
+            if index.isfile(target):
+                continue
+            for other in self.siblings(runspec):
+                source = _input_path(other, runspec, var)
+                if not index.isfile(source):
+                    continue
+                if profile is None:
+                    profile = scene_profile(runspec.image_dir)
+                    inside = scene_footprint(runspec.image_dir)
+                arr = read_on_grid(source, profile)
+                if isnan(arr[inside]).any():
+                    # the sibling does not cover this scene
+                    continue
+                meta = deepcopy(profile)
+                meta.update({'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': None})
+                with index.writer(target) as tmp:
+                    with rasopen(tmp, 'w', **meta) as dst:
+                        dst.write(arr, 1)
+                scene_logger(runspec.image_id, logger.name).info('%s shared from %s', var,
+                                                                 other.image_id)
+                shared.append(var)
+                break
+        return shared
+
+    def completed(self):
+        index = index_for()
+        done = []
+        for runspec in self.runspecs:
+            et = _et_path(runspec)
+            fmask = variable_path(runspec.image_dir, runspec.image_id, 'fmask')
+            if index.isfile(et) and index.isfile(fmask):
+                done.append(runspec)
+        return done
+
+    def clusters(self):
+        """ Completed scenes partitioned into sets of overlapping footprints. """
+        return self._clusters(self.completed())
+
+    @staticmethod
+    def _clusters(runspecs):
+        clusters = []
+        for runspec in runspecs:
+            for cluster in clusters:
+                if any(overlaps(runspec, r) for r in cluster):
+                    cluster.append(runspec)
+                    break
+            else:
+                clusters.append([runspec])
+        return clusters
+
+    def write_composites(self):
+        """ Write a best-pixel ET mosaic for each cluster of two or more scenes.
+
+        :return: list of output filenames
+        """
+        outputs = []
+        for cluster in self.clusters():
+            if len(cluster) < 2:
+                continue
+            outputs.append(self._write_composite(cluster))
+        return outputs
+
+    @staticmethod
+    def _union_profile(cluster):
+        profiles = []
+        for runspec in cluster:
+            with rasopen(_et_path(runspec)) as src:
+                profiles.append(src.profile)
+        base = union_grid(scene_profile(cluster[0].image_dir), profiles)
+        base.update({'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'nodata': None,
+                     'tiled': True, 'blockxsize': 256, 'blockysize': 256, 'compress': 'deflate'})
+        return base
+
+    def _write_composite(self, cluster):
+        """ Write the mosaic of a cluster and the index of its source scenes, one block at
+        a time as ssebop.mosaic does, so only a block of each scene is in memory. """
+        profile = self._union_profile(cluster)
+        src_profile = deepcopy(profile)
+        src_profile.update({'dtype': 'uint8', 'nodata': NO_SOURCE})
+
+        first = cluster[0]
+        date = datetime.strftime(first.image_date, '%Y%j')
+        tag = roi_tag(getattr(first, 'roi', None))
+        out = os.path.join(first.parent_dir, '{}_{}_{}_ssebop_et_composite{}.tif'.format(
+            date, first.path, first.row, '_{}'.format(tag) if tag else ''))
+        index = index_for()
+        with index.writer(out) as tmp, index.writer(out.replace('.tif', '_source.tif')) as src_tmp:
+            with rasopen(tmp, 'w', **profile) as dst, rasopen(src_tmp, 'w', **src_profile) as src_dst:
+                for window in windows(profile):
+                    composite, source = self._composite_window(cluster, profile, window)
+                    dst.write(composite, 1, window=window)
+                    src_dst.write(source, 1, window=window)
+
+        logger.info('Composite of %s written to %s', ', '.join(r.image_id for r in cluster), out)
+        return out
+
+    @staticmethod
+    def _composite_window(cluster, profile, window):
+        """ Best-pixel ET and source index of one window of the composite grid. """
+        shape = (len(cluster), int(window.height), int(window.width))
+        et_stack = zeros(shape, dtype=float32)
+        clear_stack = zeros(shape, dtype=bool)
+        for i, runspec in enumerate(cluster):
+            et = _et_path(runspec)
+            fmask = variable_path(runspec.image_dir, runspec.image_id, 'fmask')
+            et_stack[i] = read_on_grid(et, profile, window=window)
+            flags = read_on_grid(fmask, profile, window=window)
+            clear_stack[i] = QAMask(where(isfinite(flags), flags, MASK_NODATA)).clear
+        return best_pixel(et_stack, clear_stack)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ============= EOF =============================================
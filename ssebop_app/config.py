@@ -21,8 +21,9 @@ import sys
 from datetime import datetime
 
 import yaml
-from landsat.google_download import GoogleDownload
 
+from ssebop.storage import storage_for
+from ssebop.file_index import index_for
 from ssebop_app.paths import paths
 
 DEFAULT_CFG = '''
@@ -31,13 +32,46 @@ path: 39
 row: 27
 root: /home/dgketchum/IrrigationGIS/western_states_irrgis/MT/
 output_root: /home/dgketchum/IrrigationGIS/western_states_irrgis/MT/39/27/2013/
-satellite: 8
+# one satellite, e.g. LC8, or a list, e.g. [LC8, LE7], to run every sensor over the dates
+satellite: LC8
 start_date: 20130401
 end_date: 20131001
 verify_paths: True
 agrimet_corrected: True
 down_images_only: False
 use_existing_images: True
+# 'scene' computes dT per image, 'climatology' serves it from the path/row dT climatology
+dt_source: scene
+# 'numpy' runs in memory, 'dask' computes chunked outputs in parallel
+backend: numpy
+chunk_size: 1024
+# times a failed scene is retried, in this run and on restart
+max_retries: 1
+# directory for memory-mapped intermediates of large scenes, leave empty to keep them in memory
+scratch_dir:
+# with several satellites, write a best-pixel ET composite of scenes acquired on the same date
+composite: False
+# reject scenes that cannot yield a c-factor from the MTL and decimated bands, before any download
+screen: True
+# 'exact' c-factor from every pixel, or 'strided' / 'stratified' from one pixel in c_factor_step ** 2
+c_factor_method: exact
+c_factor_step: 8
+# root may be an object store, e.g. s3://bucket/prefix; set the endpoint for MinIO or other S3-compatible stores
+storage_endpoint:
+# local read-through cache of an object store root, leave empty for ranged reads of each raster
+cache_dir:
+# append each scene's etrf, et, lst and fmask to a NetCDF season cube in the year directory
+cube: False
+# LST, NDVI and albedo from one read of each band, float32; False calls sat_image for each
+surface_kernel: True
+# process only a region of interest: [west, south, east, north] in degrees, or a GeoJSON polygon file
+roi:
+# c-factor from the 'roi' pixels or from the whole 'scene'
+c_factor_extent: roi
+# reference ET from 'gridmet' per scene, or 'refet' computed from the path/row's cached daily gridMET
+pet_source: gridmet
+# 'eto' grass or 'etr' alfalfa reference; each source and crop keeps its own pet raster
+ref_crop: eto
 '''
 
 DATETIME_FMT = '%Y%m%d'
@@ -59,16 +93,38 @@ class Config:
     verify_paths = None
     down_images_only = None
     use_existing_images = False
+    dt_source = None
+    max_retries = None
+    scratch_dir = None
+    backend = None
+    chunk_size = None
+    composite = None
+    screen = None
+    c_factor_method = None
+    c_factor_step = None
+    storage_endpoint = None
+    cache_dir = None
+    cube = None
+    surface_kernel = None
+    roi = None
+    c_factor_extent = None
+    pet_source = None
+    ref_crop = None
+    storage = None
     g = None
+    downloads = None
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, build_runspecs=True):
         self.load(path=path)
 
         p, r, s = str(self.path), str(self.row), str(self.start_date.year)
         self.path_row_dir = os.path.join(self.root, p, r)
         self.year_dir = os.path.join(self.path_row_dir, s)
+        self.storage = index_for(storage_for(self.root, endpoint_url=self.storage_endpoint,
+                                             cache_dir=self.cache_dir))
 
-        self.set_runspecs()
+        if build_runspecs:
+            self.set_runspecs()
 
     def load(self, path=None):
         if path is None:
@@ -82,7 +138,7 @@ class Config:
 
         with open(rfile, 'r') as stream:
             try:
-                self._obj = yaml.load(stream)
+                self._obj = yaml.safe_load(stream)
             except yaml.YAMLError as exc:
                 print(exc)
 
@@ -92,7 +148,24 @@ class Config:
                      'verify_paths',
                      'down_images_only',
                      'agrimet_corrected',
-                     'use_existing_images')
+                     'use_existing_images',
+                     'dt_source',
+                     'backend',
+                     'chunk_size',
+                     'max_retries',
+                     'scratch_dir',
+                     'composite',
+                     'screen',
+                     'c_factor_method',
+                     'c_factor_step',
+                     'storage_endpoint',
+                     'cache_dir',
+                     'cube',
+                     'surface_kernel',
+                     'roi',
+                     'c_factor_extent',
+                     'pet_source',
+                     'ref_crop')
 
             time_attrs = ('start_date', 'end_date')
 
@@ -121,49 +194,93 @@ class Config:
 
             self.runspecs = None
 
+    def satellites(self):
+        """ Satellites of the config as a list, e.g. ['LC8', 'LE7']. """
+        if isinstance(self.satellite, (list, tuple)):
+            return [str(s) for s in self.satellite]
+        return [str(self.satellite)]
+
     def get_image_list(self, max_cloud_pct=20):
+        from landsat.google_download import GoogleDownload
 
         super_list = []
         s = datetime.strftime(self.start_date, '%Y-%m-%d')
         e = datetime.strftime(self.end_date, '%Y-%m-%d')
-        sat_key = int(self.satellite[-1])
-        self.g = GoogleDownload(start=s, end=e, satellite=sat_key, output_path=self.year_dir,
-                                path=self.path, row=self.row, max_cloud_percent=max_cloud_pct)
-        images = self.g.scene_ids_low_cloud
-        if images:
-            super_list.append(images)
+        self.downloads = {}
+        for satellite in self.satellites():
+            sat_key = int(satellite[-1])
+            # images are downloaded locally, then stored at the root by RunSpec
+            output_path = self.storage.cache_path(self.year_dir)
+            self.g = GoogleDownload(start=s, end=e, satellite=sat_key, output_path=output_path,
+                                    path=self.path, row=self.row, max_cloud_percent=max_cloud_pct)
+            self.downloads[satellite] = self.g
+            images = self.g.scene_ids_low_cloud
+            if images:
+                super_list.append(images)
+        if super_list:
             try:
                 flat_list = [item for sublist in super_list for item in sublist]
                 flat_list.reverse()
-                return flat_list
             except TypeError:
-                super_list.reverse()
-                return super_list
+                flat_list = super_list
+                flat_list.reverse()
+            if len(super_list) > 1:
+                flat_list.sort(key=lambda x: x[9:16])
+            return flat_list
         else:
             raise AttributeError('No images for this time-frame and satellite....')
 
+    def get_local_image_list(self):
+        """ Scene directories already on disk for this config's satellite and dates, no network. """
+        images = []
+        index = index_for()
+        for year in range(self.start_date.year, self.end_date.year + 1):
+            year_dir = os.path.join(self.path_row_dir, str(year))
+            if not index.isdir(year_dir):
+                continue
+            for name in index.listdir(year_dir):
+                if name[:3] not in self.satellites() or not index.isdir(os.path.join(year_dir, name)):
+                    continue
+                try:
+                    date = datetime.strptime(name[9:16], JULIAN_FMT)
+                except ValueError:
+                    continue
+                if self.start_date <= date <= self.end_date:
+                    images.append(name)
+        return sorted(images, key=lambda x: x[9:16])
+
 
 class RunSpec(object):
-    def __init__(self, image, cfg):
-        self.image_id = image
-        attrs = ('path', 'row',
-                 'satellite',
-                 'api_key',
-                 'verify_paths',
-                 'root',
-                 'start_date',
-                 'end_date',
-                 'down_images_only',
-                 'agrimet_corrected',
-                 'use_existing_images')
-
-        for attr in attrs:
-            cfg_attr = getattr(cfg, attr)
-            setattr(self, attr, cfg_attr)
+    attrs = ('path', 'row',
+             'satellite',
+             'api_key',
+             'verify_paths',
+             'root',
+             'start_date',
+             'end_date',
+             'down_images_only',
+             'agrimet_corrected',
+             'use_existing_images',
+             'dt_source',
+             'backend',
+             'chunk_size',
+             'scratch_dir',
+             'screen',
+             'c_factor_method',
+             'c_factor_step',
+             'storage_endpoint',
+             'cache_dir',
+             'cube',
+             'surface_kernel',
+             'roi',
+             'c_factor_extent',
+             'pet_source',
+             'ref_crop')
+
+    scene_attrs = ('image_id', 'image_date', 'parent_dir', 'image_dir', 'image_exists')
 
-        self.image_date = date = datetime.strptime(image[9:16], JULIAN_FMT)
-        self.parent_dir = os.path.join(cfg.path_row_dir, str(date.year))
-        self.image_dir = os.path.join(self.parent_dir, image)
+    def __init__(self, image, cfg):
+        self._set_scene(image, cfg)
         pseudo_spec = {'path': self.path,
                        'row': self.row,
                        'start_date': self.start_date,
@@ -172,11 +289,55 @@ class RunSpec(object):
                        'root': self.root,
                        'agrimet_corrected': self.agrimet_corrected,
                        'use_existing_images': self.use_existing_images}
-        self.image_exists = paths.configure_project_dirs(pseudo_spec)
+        self.image_exists = paths.configure_project_dirs(pseudo_spec, storage=cfg.storage)
         if not self.image_exists:
-            cfg.g.download()
+            downloads = cfg.downloads or {}
+            downloads.get(self.satellite, cfg.g).download()
+            cfg.storage.put_dir(self.image_dir)
             self.image_exists = True
 
+    def _set_scene(self, image, cfg):
+        self.image_id = image
+        for attr in self.attrs:
+            cfg_attr = getattr(cfg, attr)
+            setattr(self, attr, cfg_attr)
+        if isinstance(self.satellite, (list, tuple)):
+            # multi-sensor config, the scene id names the sensor
+            self.satellite = image[:3]
+
+        self.image_date = date = datetime.strptime(image[9:16], JULIAN_FMT)
+        self.parent_dir = os.path.join(cfg.path_row_dir, str(date.year))
+        self.image_dir = os.path.join(self.parent_dir, image)
+
+    @classmethod
+    def local(cls, image, cfg):
+        """ Runspec for a scene without creating directories or downloading the image. """
+        spec = cls.__new__(cls)
+        spec._set_scene(image, cfg)
+        spec.image_exists = index_for().isdir(spec.image_dir)
+        return spec
+
+    def to_dict(self):
+        """ Serialize the scene id, paths and config of this runspec to plain types. """
+        d = {}
+        for attr in self.attrs + self.scene_attrs:
+            val = getattr(self, attr, None)
+            if isinstance(val, datetime):
+                val = datetime.strftime(val, DATETIME_FMT)
+            d[attr] = val
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        """ Rebuild a runspec from to_dict output without touching the network or disk. """
+        spec = cls.__new__(cls)
+        for attr in cls.attrs + cls.scene_attrs:
+            val = d.get(attr)
+            if attr in ('start_date', 'end_date', 'image_date') and val is not None:
+                val = datetime.strptime(val, DATETIME_FMT)
+            setattr(spec, attr, val)
+        return spec
+
 
 def check_config(path=None):
     if path is None:
@@ -14,25 +14,82 @@
 # limitations under the License.
 # ===============================================================================
 
-import os
-import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-abspath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(abspath)
 from ssebop.ssebop import SSEBopModel
+from ssebop.results import SceneArrays
 
 
 def get_image(image_dir=None, parent_dir=None, image_exists=None,
               image_date=None, satellite=None, path=None, row=None,
-        image_id=None, landsat_object=None, overwrite=False, override_count=False):
-    
+        image_id=None, landsat_object=None, overwrite=False, override_count=False,
+              backend=None, write=True):
+    """ Run one scene; see SSEBopModel.run for backend and write.
+
+    :return: SceneResult, or None if the scene has no result
+    """
     spec = {'image_dir': image_dir, 'parent_dir': parent_dir, 'image_exists': image_exists,
             'image_date': image_date, 'satellite': satellite, 'path': path, 'row': row,
             'image_id': image_id, 'image': landsat_object, 'overwrite': overwrite, 'override_count': override_count}
 
     sseb = SSEBopModel(**spec)
     sseb.configure_run()
-    sseb.run(overwrite=overwrite)
+    return sseb.run(overwrite=overwrite, backend=backend, write=write)
+
+
+def iter_images(scenes, write=False, overwrite=False, backend=None, workers=1):
+    """ Run a batch of scenes, yielding the SceneResult of each as it completes.
+
+    With workers, scenes run in threads and results come in the order they finish;
+    no more than workers results are held before they are taken, so a long batch
+    runs in bounded memory. Scenes without a result, screened out or with too few
+    cold pixels, yield nothing; an error stops the batch.
+
+    :param scenes: iterable of RunSpec, dicts of get_image keywords, or
+    ssebop.results.SceneArrays of inputs already in memory
+    :param write: also write each scene's products, as get_image does; SceneArrays are
+    written to their image_dir
+    :param overwrite: run scenes whose products exist
+    :param backend: 'numpy' or 'dask', default the scene's own
+    :param workers: scenes run at once
+    :return: generator of SceneResult
+    """
+    scenes = iter(scenes)
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        pending = set()
+        while True:
+            for scene in scenes:
+                pending.add(pool.submit(run_scene, scene, write, overwrite, backend))
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    yield result
+
+
+def run_scene(scene, write=False, overwrite=False, backend=None):
+    """ Run one scene of iter_images.
+
+    :return: SceneResult, or None
+    """
+    if isinstance(scene, SceneArrays):
+        result = scene.run()
+        if write and result is not None:
+            if not scene.image_dir:
+                raise ValueError('SceneArrays {} has no image_dir to write to'.format(scene.image_id))
+            result.save(scene.image_dir)
+        return result
+    if isinstance(scene, dict):
+        kwargs = dict({'overwrite': overwrite}, **scene)
+        return get_image(backend=backend, write=write, **kwargs)
+
+    sseb = SSEBopModel(scene)
+    sseb.configure_run()
+    return sseb.run(overwrite=overwrite, backend=backend, write=write)
 
 
 if __name__ == '__main__':
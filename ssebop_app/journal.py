@@ -0,0 +1,127 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+import json
+import time
+from collections import OrderedDict
+
+PENDING, DOWNLOADING, RUNNING, DONE, FAILED = 'pending', 'downloading', 'running', 'done', 'failed'
+# rejected by the pre-screen, not run again
+SKIPPED = 'skipped'
+
+JOURNAL_FILE = 'ssebop_journal.jsonl'
+
+
+class RunJournal(object):
+    """ Append-only record of each scene's state in a batch run.
+
+    Every state change is one JSON line flushed to disk, so after a crash the journal
+    is replayed and the run resumes at the first scene that is not done. A scene
+    interrupted while downloading or running is simply run again; a failed scene is
+    retried until it has failed max_retries + 1 times.
+    """
+
+    def __init__(self, path, max_retries=1):
+        self.path = path
+        self.max_retries = max_retries
+        self.scenes = OrderedDict()
+        self.failures = {}
+        self.errors = {}
+        self.reasons = {}
+        self.durations = {}
+        self._started = {}
+        if os.path.isfile(path):
+            self._replay()
+
+    @classmethod
+    def for_directory(cls, directory, max_retries=1):
+        return cls(os.path.join(directory, JOURNAL_FILE), max_retries=max_retries)
+
+    def _replay(self):
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut off by a crash
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        image_id, state = record['image_id'], record['state']
+        self.scenes[image_id] = state
+        if state == RUNNING:
+            self._started[image_id] = record['time']
+        elif state == DONE and image_id in self._started:
+            self.durations[image_id] = record['time'] - self._started.pop(image_id)
+        elif state == FAILED:
+            self.failures[image_id] = self.failures.get(image_id, 0) + 1
+            self.errors[image_id] = record.get('error')
+        elif state == SKIPPED:
+            self.reasons[image_id] = record.get('reason')
+
+    def mark(self, image_id, state, error=None, reason=None):
+        record = {'image_id': image_id, 'state': state, 'time': time.time()}
+        if error:
+            record['error'] = error
+        if reason:
+            record['reason'] = reason
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(record)
+
+    def add(self, image_ids):
+        """ Register scenes not yet in the journal as pending. """
+        for image_id in image_ids:
+            if image_id not in self.scenes:
+                self.mark(image_id, PENDING)
+
+    def state(self, image_id):
+        return self.scenes.get(image_id)
+
+    def should_run(self, image_id):
+        state = self.scenes.get(image_id)
+        if state in (DONE, SKIPPED):
+            return False
+        if state == FAILED:
+            return self.failures[image_id] <= self.max_retries
+        return True
+
+    def remaining(self):
+        return [image_id for image_id in self.scenes if self.should_run(image_id)]
+
+    def mean_run_seconds(self):
+        """ Mean time from running to done of the scenes completed so far, or None. """
+        if not self.durations:
+            return None
+        return sum(self.durations.values()) / len(self.durations)
+
+    def summary(self):
+        counts = {}
+        for state in self.scenes.values():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ============= EOF =============================================
@@ -0,0 +1,151 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import json
+import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = 'ssebop'
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-7s %(processName)s %(name)s [%(image_id)s] %(message)s'
+
+# the running listener and its queue, set by configure_logging
+_STATE = {'listener': None, 'queue': None, 'level': None}
+
+
+class SceneAdapter(logging.LoggerAdapter):
+    """ Logger carrying a scene's image_id on every record it emits. """
+
+    def process(self, msg, kwargs):
+        extra = dict(self.extra)
+        extra.update(kwargs.get('extra') or {})
+        kwargs['extra'] = extra
+        return msg, kwargs
+
+
+def scene_logger(image_id, name=LOGGER_NAME):
+    """ Logger of a module, e.g. __name__ within the ssebop package, for one scene. """
+    return SceneAdapter(logging.getLogger(name), {'image_id': image_id or '-'})
+
+
+class SceneFilter(logging.Filter):
+    """ Gives records logged outside of a scene an image_id of '-'. """
+
+    def filter(self, record):
+        if not hasattr(record, 'image_id'):
+            record.image_id = '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, for log collectors. """
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'process': record.processName,
+                 'image_id': getattr(record, 'image_id', '-'),
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def verbosity_level(verbose=0, quiet=False):
+    """ WARNING with quiet, INFO by default, DEBUG with one or more verbose flags. """
+    if quiet:
+        return logging.WARNING
+    return logging.DEBUG if verbose else logging.INFO
+
+
+def configure_logging(level=logging.INFO, log_file=None, as_json=False, stream=True):
+    """ Send the 'ssebop' logger's records through a queue to a listener thread.
+
+    Callers only put records on a queue, so a scene's run does not wait on terminal or
+    file writes. The queue is a multiprocessing one: worker processes forked from this
+    one inherit the handler, and pool_logging gives spawned workers the same queue, so
+    one listener writes the records of every process.
+
+    :param level: logging level of the 'ssebop' logger
+    :param log_file: also write records to this file
+    :param as_json: JSON lines instead of text
+    :param stream: write records to stderr
+    :return: QueueListener, stopped by stop_logging
+    """
+    stop_logging()
+
+    formatter = JsonFormatter() if as_json else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    if stream:
+        handlers.append(logging.StreamHandler())
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(SceneFilter())
+
+    queue = multiprocessing.Queue(-1)
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+
+    _attach(queue, level)
+    _STATE.update({'listener': listener, 'queue': queue, 'level': level})
+    return listener
+
+
+def stop_logging():
+    """ Flush the queue and detach the handlers set by configure_logging. """
+    listener = _STATE['listener']
+    if listener is None:
+        return None
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    logger.propagate = True
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    _STATE.update({'listener': None, 'queue': None, 'level': None})
+    return None
+
+
+def pool_logging():
+    """ Keyword arguments of a ProcessPoolExecutor that route its workers' records to
+    the listener; empty if logging is not configured. """
+    if _STATE['queue'] is None:
+        return {}
+    return {'initializer': _attach, 'initargs': (_STATE['queue'], _STATE['level'])}
+
+
+def _attach(queue, level):
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(queue))
+    logger.setLevel(level)
+    # records stop at the queue rather than also reaching the root logger's handlers
+    logger.propagate = False
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -21,6 +21,9 @@ import sys
 
 from dateutil.rrule import rrule, YEARLY
 
+from ssebop.storage import S3_SCHEME
+from ssebop.file_index import index_for
+
 
 class PathsNotSetExecption(BaseException):
     def __str__(self):
@@ -40,43 +43,56 @@ class Paths:
         self._is_set = True
         self.ssebop_root = parent_root
 
+    @classmethod
+    def for_root(cls, parent_root):
+        """ Paths of one run, independent of the module-level paths other runs may rebuild. """
+        run_paths = cls()
+        run_paths.build(parent_root)
+        return run_paths
+
     def verify(self):
 
+        if str(self.ssebop_root).startswith(S3_SCHEME):
+            # object store prefixes exist once something is written under them
+            return None
+
         if not os.path.exists(self.ssebop_root):
             print('NOT FOUND {}'.format(self.ssebop_root))
             sys.exit(1)
 
     @staticmethod
-    def configure_project_dirs(spec):
+    def configure_project_dirs(spec, storage=None):
+        """ Create the path/row/year directories of a runspec.
+
+        :param spec: dict of path, row, root, start_date, end_date, image_dir, use_existing_images
+        :param storage: ssebop.storage backend or FileIndex of the root, default is the local filesystem
+        :return: True if the image directory already holds the image
+        """
+        if storage is None:
+            storage = index_for()
 
         p, r, s = str(spec['path']), str(spec['row']), str(spec['start_date'].year)
         path_row_dir = os.path.join(spec['root'], p, r)
 
-        if not os.path.exists(path_row_dir):
-            try:
-                os.mkdir(path_row_dir)
-            except FileNotFoundError:
-                os.makedirs(path_row_dir, exist_ok=1)
+        if not storage.exists(path_row_dir):
+            storage.makedirs(path_row_dir)
         start, end = spec['start_date'], spec['end_date']
 
         for dt in rrule(YEARLY, dtstart=start, until=end):
             year_dir = os.path.join(path_row_dir, str(dt.year))
-            if not os.path.exists(year_dir):
-                os.mkdir(year_dir)
+            if not storage.exists(year_dir):
+                storage.makedirs(year_dir)
 
         image_path = spec['image_dir']
-        if os.path.exists(image_path):
-            if len(os.listdir(image_path)) > 2:
+        if storage.exists(image_path):
+            if len(storage.listdir(image_path)) > 2:
                 return True
             else:
                 return False
         elif spec['use_existing_images']:
             pass
         else:
-            try:
-                os.mkdir(os.path.dirname(image_path))
-            except FileExistsError:
-                pass
+            storage.makedirs(os.path.dirname(image_path))
             return False
 
     def is_set(self):
@@ -0,0 +1,228 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+from __future__ import print_function
+
+import os
+from collections import OrderedDict
+
+from ssebop.mtl import find_mtl, parse_mtl
+from ssebop.collector import pet_name, variable_path
+from ssebop.file_index import index_for
+from ssebop.dt_climatology import DtClimatology
+from ssebop.lazy import CHUNK_SIZE
+from ssebop.refet_grid import MetCube, MET_VARIABLES, GRIDMET_CELL
+from ssebop.results import product_path
+from ssebop.roi import roi_tag
+from ssebop.ssebop import SSEBopModel
+from ssebop_app.config import RunSpec
+
+# typical WRS-2 scene in 30 m pixels, used until the image is on disk
+DEFAULT_SHAPE = (7800, 8800)
+
+# band count and bytes per pixel of the level-1 product
+BANDS = {'LT5': (7, 1), 'LE7': (9, 1), 'LC8': (11, 2)}
+
+FLOAT_BYTES = 8
+MASK_BYTES = 1
+
+# full resolution float64 arrays alive at once in the eager run:
+# ts, ndvi, albedo, dt, tmin, tmax, dem, pet, etrf, et
+EAGER_PEAK_ARRAYS = 10
+
+# degrees of a 30 m pixel, to size a year of the met cube from a scene's shape
+PIXEL_DEGREES = 30. / 111000.
+
+# the dask backend still computes ts, ndvi, dt and c in memory, the rest is chunked
+LAZY_PEAK_ARRAYS = 5
+LAZY_CHUNK_ARRAYS = 8
+
+
+def scene_shape(image_dir):
+    """ (rows, cols) of a scene from its MTL, without reading any band. """
+    mtl = find_mtl(image_dir)
+    if mtl is None:
+        return None
+    meta = parse_mtl(mtl)
+    return meta['reflective_lines'], meta['reflective_samples']
+
+
+def peak_memory(shape, backend='numpy', chunk_size=None, workers=None, scratch=False):
+    """ Estimated peak memory of one scene in bytes. """
+    pixels = shape[0] * shape[1]
+    if backend == 'dask':
+        chunk_size = chunk_size or CHUNK_SIZE
+        workers = workers or os.cpu_count() or 1
+        chunks = workers * chunk_size ** 2 * FLOAT_BYTES * LAZY_CHUNK_ARRAYS
+        return pixels * FLOAT_BYTES * LAZY_PEAK_ARRAYS + chunks
+    if scratch:
+        # intermediates are paged from disk, about three arrays are resident while combining
+        return pixels * FLOAT_BYTES * 3
+    return pixels * FLOAT_BYTES * EAGER_PEAK_ARRAYS
+
+
+def met_cube_bytes(shape):
+    """ Estimated size of a year of the met cube over a scene. """
+    cells = (shape[0] * PIXEL_DEGREES / GRIDMET_CELL + 4) * (shape[1] * PIXEL_DEGREES / GRIDMET_CELL + 4)
+    return int(cells * 366 * 4 * len(MET_VARIABLES))
+
+
+def plan_scene(runspec, planned_dems=None):
+    """ Work, I/O and memory needed to run one scene, from the state of the disk only.
+
+    :param runspec: RunSpec, e.g. from RunSpec.local
+    :param planned_dems: set of shared input paths, the DEM of a year directory and the
+    met cube of a year, already scheduled by another scene of the plan
+    :return: OrderedDict describing the scene's tasks
+    """
+    planned_dems = planned_dems if planned_dems is not None else set()
+    image_id, image_dir = runspec.image_id, runspec.image_dir
+
+    shape = scene_shape(image_dir)
+    estimated = shape is None
+    shape = shape or DEFAULT_SHAPE
+    pixels = shape[0] * shape[1]
+    raster = pixels * FLOAT_BYTES
+
+    tag = roi_tag(getattr(runspec, 'roi', None))
+    pet = {'pet_source': getattr(runspec, 'pet_source', None),
+           'ref_crop': getattr(runspec, 'ref_crop', None)}
+    outputs = [product_path(image_dir, image_id, pet_name(**pet) if p == 'pet' else p, tag=tag)
+               for p in SSEBopModel.products]
+    index = index_for()
+    done = all(index.isfile(p) for p in outputs)
+
+    tasks = []
+    if estimated:
+        count, depth = BANDS.get(runspec.satellite, BANDS['LC8'])
+        tasks.append(_task('download', 'image', pixels * count * depth))
+
+    clim = DtClimatology.for_path_row(os.path.dirname(runspec.parent_dir))
+    use_clim = runspec.dt_source == 'climatology' and clim.exists()
+    refet = pet['pet_source'] == 'refet'
+    needed = ['tmax', 'pet', 'fmask']
+    if not use_clim:
+        needed += ['tmin', 'dem']
+
+    if refet and not index.isfile(variable_path(image_dir, image_id, 'pet', **pet)):
+        # computed in the run from the met cube and the DEM, nothing is fetched per scene
+        needed.remove('pet')
+        if 'dem' not in needed:
+            needed.append('dem')
+        cube = MetCube.for_path_row(os.path.dirname(runspec.parent_dir), storage=index)
+        year = runspec.image_date.year
+        if not cube.exists(year) and cube.path('tmin', year) not in planned_dems:
+            planned_dems.add(cube.path('tmin', year))
+            tasks.append(_task('download', 'met_cube', met_cube_bytes(shape)))
+
+    for var in needed:
+        path = variable_path(image_dir, image_id, var, **pet)
+        if index.isfile(path):
+            continue
+        if var == 'dem':
+            if path in planned_dems:
+                continue
+            planned_dems.add(path)
+        if var == 'fmask':
+            tasks.append(_task('compute', var, pixels * MASK_BYTES,
+                               depends='image' if estimated else None))
+        else:
+            tasks.append(_task('download', var, raster))
+
+    tasks.append(_task('compute', 'dt', 0, source='climatology' if use_clim else 'scene'))
+    tasks.append(_task('run', 'ssebop', raster * len(SSEBopModel.products),
+                       depends=[t['name'] for t in tasks]))
+
+    scene = OrderedDict()
+    scene['image_id'] = image_id
+    scene['status'] = 'done' if done else 'todo'
+    scene['shape'] = list(shape)
+    scene['shape_estimated'] = estimated
+    scene['tasks'] = [] if done else tasks
+    scene['download_bytes'] = 0 if done else sum(t['bytes'] for t in tasks if t['action'] == 'download')
+    scene['write_bytes'] = 0 if done else sum(t['bytes'] for t in tasks if t['action'] != 'download')
+    scene['peak_memory'] = 0 if done else peak_memory(shape, backend=runspec.backend or 'numpy',
+                                                      chunk_size=runspec.chunk_size,
+                                                      scratch=bool(runspec.scratch_dir))
+    return scene
+
+
+def plan(cfg):
+    """ Job graph of a config with cost estimates; nothing is downloaded, computed or written.
+
+    :param cfg: Config built with build_runspecs=False
+    :return: OrderedDict
+    """
+    planned_dems = set()
+    scenes = [plan_scene(RunSpec.local(image, cfg), planned_dems)
+              for image in cfg.get_local_image_list()]
+    todo = [s for s in scenes if s['status'] == 'todo']
+
+    summary = OrderedDict()
+    summary['scenes'] = len(scenes)
+    summary['done'] = len(scenes) - len(todo)
+    summary['todo'] = len(todo)
+    summary['download_bytes'] = sum(s['download_bytes'] for s in todo)
+    summary['write_bytes'] = sum(s['write_bytes'] for s in todo)
+    summary['max_peak_memory'] = max([s['peak_memory'] for s in todo] or [0])
+
+    result = OrderedDict()
+    result['summary'] = summary
+    result['scenes'] = scenes
+    return result
+
+
+def format_plan(result):
+    """ Human readable table of a plan. """
+    lines = ['{:<24s}{:<7s}{:>12s}{:>12s}{:>12s}  {}'.format('scene', 'status', 'download',
+                                                             'write', 'peak mem', 'tasks')]
+    for s in result['scenes']:
+        tasks = ', '.join('{} {}'.format(t['action'], t['name']) for t in s['tasks'])
+        lines.append('{:<24s}{:<7s}{:>12s}{:>12s}{:>12s}  {}'.format(
+            s['image_id'], s['status'], _size(s['download_bytes']), _size(s['write_bytes']),
+            _size(s['peak_memory']), tasks + (' (size estimated)' if s['shape_estimated'] else '')))
+
+    summ = result['summary']
+    lines.append('{} scenes, {} done, {} to run; download {}, write {}, max peak memory {}'.format(
+        summ['scenes'], summ['done'], summ['todo'], _size(summ['download_bytes']),
+        _size(summ['write_bytes']), _size(summ['max_peak_memory'])))
+    return '\n'.join(lines)
+
+
+def _task(action, name, nbytes, depends=None, source=None):
+    task = OrderedDict()
+    task['action'] = action
+    task['name'] = name
+    task['bytes'] = nbytes
+    if depends:
+        task['depends'] = depends if isinstance(depends, list) else [depends]
+    if source:
+        task['source'] = source
+    return task
+
+
+def _size(nbytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if nbytes < 1024.:
+            return '{:.1f} {}'.format(nbytes, unit)
+        nbytes /= 1024.
+    return '{:.1f} TB'.format(nbytes)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ============= EOF =============================================
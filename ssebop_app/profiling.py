@@ -0,0 +1,192 @@
+# =============================================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================================
+
+import os
+import cProfile
+import pstats
+import sysconfig
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from glob import glob
+
+PROFILE_EXT = '.prof'
+MEMORY_EXT = '.mem.txt'
+
+# allocation sites written per scene with memory profiling
+MEMORY_TOP = 25
+
+SORT_KEYS = ('tottime', 'cumtime')
+
+_STDLIB = os.path.normpath(sysconfig.get_paths()['stdlib'])
+
+
+class SceneProfiler(object):
+    """ Opt-in profiles of each scene of a run, written to a directory by image_id.
+
+    <image_id>.prof is a cProfile dump, readable by pstats, snakeviz and report below;
+    with memory, <image_id>.mem.txt lists the peak traced memory and the lines that
+    allocated the most, from tracemalloc. A retried scene overwrites its files.
+    """
+
+    def __init__(self, directory, memory=False, top=MEMORY_TOP):
+        self.directory = directory
+        self.memory = memory
+        self.top = top
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, image_id, ext=PROFILE_EXT):
+        return os.path.join(self.directory, '{}{}'.format(image_id, ext))
+
+    @contextmanager
+    def scene(self, image_id):
+        """ Profile the block as the run of image_id. """
+        profile = cProfile.Profile()
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            profile.dump_stats(self.path(image_id))
+            if tracing:
+                snapshot = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self._write_memory(image_id, snapshot, peak)
+
+    def _write_memory(self, image_id, snapshot, peak):
+        stats = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        lines = ['{} peak traced memory {}'.format(image_id, _size(peak))]
+        for stat in stats.statistics('lineno')[:self.top]:
+            frame = stat.traceback[0]
+            lines.append('{:>12s} {:>9d} blocks  {}:{}'.format(_size(stat.size), stat.count,
+                                                                frame.filename, frame.lineno))
+        with open(self.path(image_id, MEMORY_EXT), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+@contextmanager
+def profiled(profiler, image_id):
+    """ profiler.scene(image_id), or nothing if profiler is None. """
+    if profiler is None:
+        yield None
+    else:
+        with profiler.scene(image_id) as profile:
+            yield profile
+
+
+def package_of(filename):
+    """ Top-level package of a profiled function's file: the installed package, 'ssebop'
+    or 'ssebop_app' for this repo, 'stdlib', or 'builtins' for C functions. """
+    if filename == '~' or filename.startswith('<'):
+        return 'builtins'
+    parts = os.path.normpath(filename).split(os.sep)
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts[:-1]:
+            name = parts[len(parts) - parts[::-1].index(marker)]
+            return os.path.splitext(name)[0]
+    for name in ('ssebop', 'ssebop_app'):
+        if name in parts[:-1]:
+            return name
+    if os.path.normpath(filename).startswith(_STDLIB):
+        return 'stdlib'
+    return 'other'
+
+
+def aggregate(paths):
+    """ Function statistics summed over the profiles of a batch.
+
+    :param paths: .prof files, or directories of them
+    :return: OrderedDict of (file, line, function): {'scenes', 'calls', 'tottime',
+    'cumtime', 'package'}, and the number of profiles
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob(os.path.join(path, '*' + PROFILE_EXT))))
+        else:
+            files.append(path)
+
+    functions = OrderedDict()
+    for f in files:
+        for key, (_, calls, tottime, cumtime, _) in pstats.Stats(f).stats.items():
+            entry = functions.get(key)
+            if entry is None:
+                entry = functions[key] = {'scenes': 0, 'calls': 0, 'tottime': 0., 'cumtime': 0.,
+                                          'package': package_of(key[0])}
+            entry['scenes'] += 1
+            entry['calls'] += calls
+            entry['tottime'] += tottime
+            entry['cumtime'] += cumtime
+    return functions, len(files)
+
+
+def report(paths, top=20, sort='tottime', package=None):
+    """ Time by package and the hottest functions of a batch of scene profiles.
+
+    :param paths: .prof files, or directories of them
+    :param top: number of functions listed
+    :param sort: 'tottime', time in the function itself, or 'cumtime', with its callees
+    :param package: list only functions of this package, e.g. 'ssebop'
+    :return: str
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError('Invalid sort: "{}", available = {}'.format(sort, SORT_KEYS))
+    functions, count = aggregate(paths)
+    if not count:
+        return 'No profiles found'
+
+    packages = OrderedDict()
+    for entry in functions.values():
+        packages[entry['package']] = packages.get(entry['package'], 0.) + entry['tottime']
+    total = sum(packages.values())
+
+    lines = ['{} scene profiles, {:.2f} s profiled'.format(count, total), '',
+             '{:<20s}{:>10s}{:>8s}'.format('package', 'tottime', '%')]
+    for name, seconds in sorted(packages.items(), key=lambda x: -x[1]):
+        lines.append('{:<20s}{:>10.2f}{:>8.1f}'.format(name, seconds, 100. * seconds / (total or 1.)))
+
+    rows = [(k, v) for k, v in functions.items() if package is None or v['package'] == package]
+    rows = sorted(rows, key=lambda x: -x[1][sort])[:top]
+    lines += ['', '{:>10s}{:>10s}{:>10s}{:>8s}  {}'.format('calls', 'tottime', 'cumtime', 'scenes',
+                                                          'function')]
+    for (filename, line, name), v in rows:
+        lines.append('{:>10d}{:>10.3f}{:>10.3f}{:>8d}  {} ({}:{})'.format(
+            v['calls'], v['tottime'], v['cumtime'], v['scenes'], name, _short(filename), line))
+    return '\n'.join(lines)
+
+
+def _short(filename):
+    parts = os.path.normpath(filename).split(os.sep)
+    return os.sep.join(parts[-2:]) if len(parts) > 1 else filename
+
+
+def _size(nbytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(nbytes) < 1024.:
+            return '{:.1f} {}'.format(nbytes, unit)
+        nbytes /= 1024.
+    return '{:.1f} TB'.format(nbytes)
+
+
+if __name__ == '__main__':
+    home = os.path.expanduser('~')
+
+# ========================= EOF ====================================================================
@@ -0,0 +1,105 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from ssebop_app.broker import SQLiteBroker, run_worker, QUEUED, LEASED, DONE, FAILED
+from ssebop_app.config import RunSpec
+
+
+class BrokerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.broker = SQLiteBroker(os.path.join(self.root, 'jobs.db'))
+        self.broker.put('LC80380272014227LGN00', {'image_id': 'LC80380272014227LGN00'})
+        self.broker.put('LC80380272014243LGN00', {'image_id': 'LC80380272014243LGN00'}, max_attempts=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_put_idempotent(self):
+        self.assertFalse(self.broker.put('LC80380272014227LGN00', {}))
+        self.assertEqual(self.broker.counts(), {QUEUED: 2})
+
+    def test_lease_complete(self):
+        job = self.broker.lease('a')
+        self.assertEqual(job.job_id, 'LC80380272014227LGN00')
+        self.assertEqual(job.payload['image_id'], job.job_id)
+        self.assertEqual(self.broker.state(job.job_id), LEASED)
+        other = self.broker.lease('b')
+        self.assertEqual(other.job_id, 'LC80380272014243LGN00')
+        self.assertIsNone(self.broker.lease('c'))
+        self.broker.complete(job)
+        self.broker.complete(job)
+        self.assertEqual(self.broker.state(job.job_id), DONE)
+
+    def test_expired_lease(self):
+        job = self.broker.lease('a', lease_seconds=-1.)
+        retry = self.broker.lease('b')
+        self.assertEqual(retry.job_id, job.job_id)
+        self.assertEqual(retry.attempts, 2)
+        self.assertFalse(self.broker.renew(job))
+        self.assertTrue(self.broker.renew(retry))
+
+    def test_retry_then_fail(self):
+        first = self.broker.lease('a')
+        self.broker.fail(first, 'error')
+        self.assertEqual(self.broker.state(first.job_id), QUEUED)
+        self.broker.lease('a')
+        last = self.broker.lease('a')
+        self.assertEqual(last.job_id, 'LC80380272014243LGN00')
+        self.broker.fail(last, 'error')
+        self.assertEqual(self.broker.state(last.job_id), FAILED)
+        self.assertEqual(self.broker.failures(), [(last.job_id, 1, 'error')])
+
+    def test_worker(self):
+        ran = []
+
+        def runner(payload):
+            ran.append(payload['image_id'])
+            if payload['image_id'].endswith('243LGN00'):
+                raise ValueError
+
+        done = run_worker(self.broker, worker='test', runner=runner)
+        self.assertEqual(done, 1)
+        self.assertEqual(len(ran), 2)
+        self.assertEqual(self.broker.counts(), {DONE: 1, FAILED: 1})
+
+
+class RunSpecSerializeTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        spec = RunSpec.__new__(RunSpec)
+        for attr in RunSpec.attrs + RunSpec.scene_attrs:
+            setattr(spec, attr, None)
+        spec.image_id = 'LC80380272014227LGN00'
+        spec.image_date = datetime(2014, 8, 15)
+        spec.start_date = datetime(2014, 8, 14)
+        spec.image_dir = '/data/38/27/2014/LC80380272014227LGN00'
+        spec.path, spec.row = 38, 27
+
+        copy = RunSpec.from_dict(spec.to_dict())
+        for attr in RunSpec.attrs + RunSpec.scene_attrs:
+            self.assertEqual(getattr(copy, attr), getattr(spec, attr))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,103 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import unittest
+
+from numpy import where, nan, nanmean, nanstd, count_nonzero, isnan, zeros, uint8, linspace
+from numpy.random import RandomState
+
+from ssebop.c_factor import c_factor_exact, c_factor_sampled, sample_index
+from ssebop.masks import QAMask, SHADOW, WATER
+
+
+def synthetic_scene(shape=(800, 900), cold_fraction=0.3, seed=1):
+    rng = RandomState(seed)
+    ndvi = rng.uniform(0., 0.6, shape)
+    cold = rng.uniform(size=shape) < cold_fraction
+    ndvi[cold] = rng.uniform(0.71, 0.9, count_nonzero(cold))
+    ts = rng.normal(310., 6., shape)
+    ts[cold] = rng.normal(300., 2., count_nonzero(cold))
+    ts[:5, :5] = nan
+    tmax = 290. + linspace(0., 3., shape[1])[None, :].repeat(shape[0], axis=0)
+    fmask = (rng.uniform(size=shape) < 0.2).astype(uint8)
+    return ts, ndvi, tmax, fmask
+
+
+def legacy_c_factor(ts, ndvi, tmax, fmask):
+    """ c as computed in SSEBopModel.c_factor before the estimators were added. """
+    loc = where(ndvi > 0.7)
+    ta = tmax[loc[0][0], loc[1][0]]
+    t_corr_mean = nanmean(ts / ta)
+    t_corr = where((ndvi >= 0.7) & (ndvi <= 1.0), ts / ta, nan)
+    t_corr = where(ts > 270., t_corr, nan)
+    t_corr = where((ts - ta > 0) & (ts - ta < 30), t_corr, nan)
+    t_corr = where(fmask == 0, t_corr, nan)
+    return t_corr_mean - 2 * nanstd(t_corr), count_nonzero(~isnan(t_corr))
+
+
+class CFactorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ts, self.ndvi, self.tmax, self.fmask = synthetic_scene()
+        self.args = (self.ts, self.ndvi, self.tmax, QAMask(self.fmask).clear)
+
+    def test_exact_matches_legacy(self):
+        c, count = legacy_c_factor(self.ts, self.ndvi, self.tmax, self.fmask)
+        estimate = c_factor_exact(*self.args)
+        self.assertAlmostEqual(estimate.c, c, places=6)
+        self.assertEqual(estimate.count, count)
+        self.assertEqual(estimate.low, estimate.high)
+
+    def test_qa_flags(self):
+        # water is clear, shadow is not, whatever other bits are set
+        flags = self.fmask.copy()
+        flags[:400][flags[:400] == 0] = WATER
+        flags[400:][flags[400:] == 1] = SHADOW | WATER
+        estimate = c_factor_exact(self.ts, self.ndvi, self.tmax, QAMask(flags).clear)
+        self.assertEqual(estimate, c_factor_exact(*self.args))
+
+    def test_sampled_agreement(self):
+        exact = c_factor_exact(*self.args).c
+        for method in ('strided', 'stratified'):
+            estimate = c_factor_sampled(*self.args, method=method, step=4)
+            self.assertEqual(estimate.method, method)
+            self.assertLess(estimate.low, estimate.high)
+            self.assertTrue(estimate.low - 1e-4 <= exact <= estimate.high + 1e-4)
+            self.assertAlmostEqual(estimate.c, exact, places=3)
+
+    def test_fallback(self):
+        ts, ndvi, tmax, fmask = synthetic_scene(cold_fraction=0.002)
+        estimate = c_factor_sampled(ts, ndvi, tmax, QAMask(fmask).clear, step=8, min_sample=200)
+        self.assertEqual(estimate.method, 'exact')
+        self.assertAlmostEqual(estimate.c, legacy_c_factor(ts, ndvi, tmax, fmask)[0], places=6)
+
+    def test_insufficient(self):
+        clear = zeros(self.fmask.shape, dtype=bool)
+        self.assertIsNone(c_factor_exact(self.ts, self.ndvi, self.tmax, clear))
+        self.assertIsNone(c_factor_sampled(self.ts, self.ndvi * 0., self.tmax, self.args[3]))
+
+    def test_sample_index(self):
+        rows, cols = sample_index((10, 7), step=4, method='stratified')
+        self.assertEqual(rows.shape, (3, 2))
+        self.assertTrue((rows // 4 == [[0], [1], [2]]).all())
+        self.assertTrue((cols // 4 == [[0, 1]]).all())
+        self.assertTrue((rows < 10).all() and (cols < 7).all())
+        self.assertRaises(ValueError, sample_index, (10, 7), 4, 'random')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,39 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import unittest
+
+from click.testing import CliRunner
+
+from benchmarks.bench_cli_import import heavy_imports
+from ssebop_app.cli import cli
+
+
+class CliStartupTestCase(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        self.assertEqual(heavy_imports(), [])
+
+    def test_help(self):
+        result = CliRunner().invoke(cli, ['--help'])
+        self.assertEqual(result.exit_code, 0)
+        for command in ('mkconfig', 'run'):
+            self.assertIn(command, result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,225 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+
+from numpy import array, full, nan, isnan, float32, uint8
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from ssebop.c_factor import CFactor
+from ssebop.collector import SSEBopData
+from ssebop.ssebop import SSEBopModel
+from ssebop_app import cli
+from ssebop_app.config import Config, RunSpec
+from ssebop_app.journal import RunJournal
+from ssebop_app.composite import CompositeGroup, best_pixel, group_by_date, NO_SOURCE
+from ssebop.masks import CLEAR, SHADOW, WATER
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'image_test', 'lc8_image')
+MTL = 'LC80400282014193LGN00_MTL.txt'
+
+LC8 = 'LC80380272014227LGN00'
+LE7 = 'LE70380272014227EDC00'
+
+CONFIG = '''
+path: 38
+row: 27
+root: {}
+satellite: [LC8, LE7]
+start_date: 20140801
+end_date: 20140930
+composite: True
+'''
+
+
+def _write(path, arr, west):
+    profile = {'driver': 'GTiff', 'count': 1, 'dtype': arr.dtype.name, 'height': arr.shape[0],
+               'width': arr.shape[1], 'crs': CRS.from_epsg(32612),
+               'transform': from_origin(west, 5000030., 30., 30.)}
+    with rasopen(path, 'w', **profile) as dst:
+        dst.write(arr, 1)
+
+
+class CompositeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        year_dir = os.path.join(self.root, '38', '27', '2014')
+        self.config_path = os.path.join(self.root, 'config.yml')
+        with open(self.config_path, 'w') as f:
+            f.write(CONFIG.format(self.root))
+
+        # the LE7 grid is shifted two pixels east of the LC8 grid; LC8 is water, clear,
+        # then shadow over water, not clear
+        for image_id, west, et, fmask in ((LC8, 300000., 2., (WATER, SHADOW | WATER)),
+                                          (LE7, 300060., 4., (CLEAR, CLEAR))):
+            d = os.path.join(year_dir, image_id)
+            os.makedirs(d)
+            shutil.copy(os.path.join(DATA, MTL), d)
+            _write(os.path.join(d, '{}_B1.TIF'.format(image_id)), full((4, 6), 9, dtype=uint8), west)
+            _write(os.path.join(d, '{}_ssebop_et.tif'.format(image_id)),
+                   full((4, 6), et, dtype=float32), west)
+            mask = full((4, 6), fmask[0], dtype=uint8)
+            mask[:, 3:] = fmask[1]
+            _write(os.path.join(d, '{}_fmask.tif'.format(image_id)), mask, west)
+        _write(os.path.join(year_dir, LC8, '{}_tmax.tif'.format(LC8)),
+               full((4, 10), 300., dtype=float32), 300000.)
+
+        cfg = Config(self.config_path, build_runspecs=False)
+        self.specs = [RunSpec.local(i, cfg) for i in (LE7, LC8)]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_best_pixel(self):
+        et = array([[[1., nan, 1.]], [[2., 2., 2.]]], dtype=float32)
+        clear = array([[[True, True, False]], [[True, True, True]]])
+        composite, source = best_pixel(et, clear)
+        self.assertEqual(composite.tolist(), [[1., 2., 2.]])
+        self.assertEqual(source.tolist(), [[0, 1, 1]])
+
+        composite, source = best_pixel(et, ~clear)
+        self.assertTrue(isnan(composite[0, 0]))
+        self.assertEqual(source[0, 0], NO_SOURCE)
+
+    def test_group_by_date(self):
+        ids = [LC8, 'LC80380272014243LGN00', LE7]
+        self.assertEqual(group_by_date(ids), [[LC8, LE7], ['LC80380272014243LGN00']])
+
+    def test_runspec_satellite(self):
+        self.assertEqual([s.satellite for s in self.specs], ['LE7', 'LC8'])
+
+    def test_share_inputs(self):
+        group = CompositeGroup(self.specs)
+        self.assertEqual([s.image_id for s in group.runspecs], [LC8, LE7])
+        self.assertEqual(group.share_inputs(self.specs[0]), ['tmax'])
+        with rasopen(os.path.join(self.specs[0].image_dir, '{}_tmax.tif'.format(LE7))) as src:
+            self.assertEqual(src.shape, (4, 6))
+            self.assertTrue((src.read(1) == 300.).all())
+
+    def test_share_clipped_inputs(self):
+        year_dir = os.path.join(self.root, '38', '27', '2014')
+        # LC8's tmax clipped to its footprint, the last three columns are outside it;
+        # they fall on the last column of the LE7 grid
+        tmax = full((4, 10), 300., dtype=float32)
+        tmax[:, 7:] = nan
+        _write(os.path.join(year_dir, LC8, '{}_tmax.tif'.format(LC8)), tmax, 300000.)
+        group = CompositeGroup(self.specs)
+        self.assertEqual(group.share_inputs(self.specs[0]), [])
+
+        # outside the LE7 footprint too, so LC8's tmax covers it
+        band = full((4, 6), 9, dtype=uint8)
+        band[:, 5] = 0
+        _write(os.path.join(year_dir, LE7, '{}_B1.TIF'.format(LE7)), band, 300060.)
+        self.assertEqual(group.share_inputs(self.specs[0]), ['tmax'])
+        with rasopen(os.path.join(self.specs[0].image_dir, '{}_tmax.tif'.format(LE7))) as src:
+            shared = src.read(1)
+        self.assertTrue((shared[:, :5] == 300.).all())
+        self.assertTrue(isnan(shared[:, 5]).all())
+
+    def test_fetch_inputs(self):
+        fetched = []
+
+        def fetch(data, request):
+            # a constant raster on the grid requested
+            fetched.append((request.variable, data.profile['width']))
+            arr = full((1, data.profile['height'], data.profile['width']), 1., dtype=float32)
+            meta = dict(data.profile, driver='GTiff', count=1, dtype='float32')
+            with rasopen(request.path, 'w', **meta) as dst:
+                dst.write(arr)
+            return arr
+
+        group = CompositeGroup(self.specs)
+        with mock.patch.object(SSEBopData, 'fetch', fetch):
+            self.assertEqual(group.fetch_inputs(), ['tmin', 'pet', 'dem'])
+            # once for the group, on a grid covering LC8 and LE7, two pixels east
+            self.assertEqual(fetched, [('tmin', 8), ('pet', 8), ('dem', 8)])
+            self.assertEqual(group.fetch_inputs(), [])
+
+        # LC8 is first in priority, LE7 takes its inputs
+        self.assertTrue(os.path.isfile(os.path.join(self.specs[1].image_dir, '{}_tmin.tif'.format(LC8))))
+        self.assertEqual(group.share_inputs(self.specs[0]), ['tmax', 'tmin', 'pet'])
+        with rasopen(os.path.join(self.specs[0].image_dir, '{}_pet.tif'.format(LE7))) as src:
+            self.assertEqual(src.shape, (4, 6))
+            self.assertTrue((src.read(1) == 1.).all())
+
+    def test_c_factor(self):
+        le7, lc8 = self.specs
+        group = CompositeGroup(self.specs)
+        self.assertIsNone(group.c_factor(le7))
+        estimate = CFactor(0.98, 0.98, 0.98, 500, 'exact')
+        group.add_c_factor(lc8, estimate)
+        group.add_c_factor(le7, None)
+        self.assertIs(group.c_factor(le7), estimate)
+        self.assertIsNone(group.c_factor(lc8))
+
+        # the sibling's c is not estimated again
+        model = SSEBopModel(shared_c=estimate)
+        self.assertEqual(model.c_factor(None), 0.98)
+        self.assertIs(model.c_estimate, estimate)
+
+    def test_run_composites(self):
+        cfg = Config(self.config_path, build_runspecs=False)
+        journal = RunJournal.for_directory(os.path.join(self.root, '38', '27', '2014'))
+        journal.add([LE7, LC8])
+        calls = []
+
+        def download_scene(cfg, image, journal):
+            calls.append(('download', image))
+            return RunSpec.local(image, cfg)
+
+        def run_scene(cfg, image, journal, group=None, profiler=None, runspec=None):
+            calls.append(('run', image))
+
+        with mock.patch.object(cli, 'download_scene', side_effect=download_scene), \
+                mock.patch.object(cli, 'run_scene', side_effect=run_scene), \
+                mock.patch.object(CompositeGroup, 'fetch_inputs',
+                                  side_effect=lambda: calls.append(('fetch', None))):
+            cli.run_composites(cfg, [LE7, LC8], journal)
+        # the date's inputs are fetched once both images are downloaded; LC8 runs first
+        self.assertEqual(calls, [('download', LC8), ('download', LE7), ('fetch', None),
+                                 ('run', LC8), ('run', LE7)])
+
+    def test_composite(self):
+        outputs = CompositeGroup(self.specs).write_composites()
+        self.assertEqual(len(outputs), 1)
+        self.assertTrue(outputs[0].endswith('2014227_38_27_ssebop_et_composite.tif'))
+        with rasopen(outputs[0]) as src:
+            self.assertEqual(src.shape, (4, 8))
+            row = src.read(1)[0]
+        # clear LC8 first, then LE7 where LC8 is cloudy or absent
+        self.assertEqual(row.tolist(), [2., 2., 2., 4., 4., 4., 4., 4.])
+
+    def test_composite_window(self):
+        group = CompositeGroup(self.specs)
+        cluster = group.clusters()[0]
+        profile = group._union_profile(cluster)
+        # a block of the composite reads the same block of each scene only
+        composite, source = group._composite_window(cluster, profile, Window(1, 2, 4, 2))
+        self.assertEqual(composite.tolist(), [[2., 2., 4., 4.]] * 2)
+        self.assertEqual(source.tolist(), [[0, 0, 1, 1]] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
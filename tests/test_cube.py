@@ -0,0 +1,117 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import mkdtemp
+
+from numpy import full, float32, uint8, isnan
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from ssebop.cube import SeasonCube, TIME_CHUNK, SPACE_CHUNK
+from ssebop.warp_cache import WARP_CACHE_DIR
+
+SHAPE = (100, 130)
+
+
+def _profile(west=300000.):
+    return {'crs': CRS.from_epsg(32612), 'transform': from_origin(west, 5000000., 30., 30.),
+            'height': SHAPE[0], 'width': SHAPE[1]}
+
+
+def _scene(value):
+    return {'etrf': full(SHAPE, value / 10., dtype=float32),
+            'et': full((1,) + SHAPE, value, dtype=float32),
+            'lst': full(SHAPE, 290. + value, dtype=float32),
+            'fmask': full(SHAPE, value % 2, dtype=uint8)}
+
+
+@unittest.skipIf(netCDF4 is None, 'netCDF4 is not installed')
+class SeasonCubeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.cube = SeasonCube.for_year_dir(os.path.join(self.root, '38', '27', '2014'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_append(self):
+        # scenes finish out of date order
+        for doy, value in ((225, 3.), (193, 1.), (209, 2.)):
+            date = datetime.strptime('2014{}'.format(doy), '%Y%j')
+            self.cube.append('LC80380272014{}LGN00'.format(doy), date, _scene(value), _profile())
+
+        self.assertEqual([s[0][13:16] for s in self.cube.scenes()], ['193', '209', '225'])
+        dates, et = self.cube.pixel_series('et', 50, 60)
+        self.assertEqual(et.tolist(), [1., 2., 3.])
+        self.assertEqual(dates[0], datetime(2014, 7, 12))
+
+        # a re-run overwrites its slice
+        self.cube.append('LC80380272014209LGN00', datetime(2014, 7, 28), _scene(5.), _profile())
+        self.assertEqual(self.cube.pixel_series('et', 0, 0)[1].tolist(), [1., 5., 3.])
+        self.assertEqual(self.cube.pixel_series('fmask', 0, 0)[1].tolist(), [1, 1, 1])
+
+        with netCDF4.Dataset(self.cube.path) as nc:
+            var = nc.variables['et']
+            self.assertEqual(var.chunking(), [TIME_CHUNK, SPACE_CHUNK, SPACE_CHUNK])
+            self.assertTrue(var.filters()['zlib'])
+            self.assertTrue(nc.dimensions['time'].isunlimited())
+            self.assertEqual(var.shape, (3,) + SHAPE)
+
+    def test_other_grid(self):
+        self.cube.append('LC80380272014193LGN00', datetime(2014, 7, 12), _scene(1.), _profile())
+        # shifted 10 pixels east, the western columns of the cube are empty
+        self.cube.append('LC80380272014209LGN00', datetime(2014, 7, 28), _scene(2.),
+                         _profile(west=300300.))
+        _, et = self.cube.pixel_series('et', 10, 5)
+        self.assertEqual(et[0], 1.)
+        self.assertTrue(isnan(et[1]))
+        self.assertEqual(self.cube.pixel_series('et', 10, 50)[1].tolist(), [1., 2.])
+        self.assertEqual(self.cube.profile()['transform'], _profile()['transform'])
+
+        # off the cube's pixels by half a pixel, warped without saving a plan
+        self.cube.append('LC80380272014225LGN00', datetime(2014, 8, 13), _scene(3.),
+                         _profile(west=300315.))
+        self.assertEqual(self.cube.pixel_series('et', 10, 50)[1].tolist(), [1., 2., 3.])
+        self.assertFalse(os.path.exists(os.path.join(self.root, '38', '27', WARP_CACHE_DIR)))
+
+    def test_concurrent_appends(self):
+        def append(doy):
+            date = datetime.strptime('2014{}'.format(doy), '%Y%j')
+            self.cube.append('LC80380272014{}LGN00'.format(doy), date, _scene(float(doy)),
+                             _profile())
+
+        doys = list(range(150, 270, 8))
+        with ThreadPoolExecutor(6) as pool:
+            list(pool.map(append, doys))
+
+        self.assertEqual(len(self.cube.scenes()), len(doys))
+        self.assertEqual(self.cube.pixel_series('et', 99, 129)[1].tolist(), [float(d) for d in doys])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,114 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+
+from numpy import arange, float32, full, array_equal, testing
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+from ssebop.dt_climatology import DtClimatology, daily_dt, DAYS, DT_CLIMATOLOGY_FILE, CLIMATOLOGY_ALBEDO
+from ssebop.refet_grid import GRIDMET_CELL
+
+
+class DtClimatologyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.profile = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1,
+                        'height': 20, 'width': 30, 'nodata': None,
+                        'crs': CRS({'init': 'epsg:32612'}),
+                        'transform': from_origin(300000., 5000000., 30., 30.)}
+        cube = arange(DAYS * 20 * 30, dtype=float32).reshape(DAYS, 20, 30)
+        self.cube = cube
+        self.clim = DtClimatology.for_path_row(self.root)
+        self.clim.write(cube, self.profile)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_path(self):
+        self.assertEqual(self.clim.path, os.path.join(self.root, DT_CLIMATOLOGY_FILE))
+        self.assertTrue(self.clim.exists())
+
+    def test_get_day(self):
+        dt = self.clim.get(200, target_profile=self.profile)
+        self.assertEqual(dt.shape, (1, 20, 30))
+        self.assertTrue(array_equal(dt[0], self.cube[199]))
+
+    def test_get_warped(self):
+        profile = dict(self.profile)
+        profile.update({'height': 10, 'width': 10,
+                        'transform': from_origin(300150., 4999850., 30., 30.)})
+        dt = self.clim.get(1, target_profile=profile)
+        self.assertEqual(dt.shape, (1, 10, 10))
+        self.assertTrue(array_equal(dt[0], self.cube[0, 5:15, 5:15]))
+
+    def test_wrong_days(self):
+        self.assertRaises(ValueError, self.clim.write, self.cube[:365], self.profile)
+
+    def test_build(self):
+        requests = []
+
+        class GridMet(object):
+            # a year of constant temperatures, 2 K warmer in 2013
+            def __init__(self, variable, start, end, bbox, target_profile):
+                requests.append((variable, start.year))
+                days = (end - start).days + 1
+                value = {'tmmn': 280., 'tmmx': 300.}[variable] + (start.year - 2012) * 2.
+                self.shape = (days, target_profile['height'], target_profile['width'])
+                self.value = value
+
+            def get_data_subset(self):
+                return full(self.shape, self.value, dtype=float32)
+
+        profile = dict(self.profile, crs=CRS.from_epsg(32612))
+        west, south, east, north = transform_bounds(profile['crs'], 'EPSG:4326', 300000., 4999400.,
+                                                    300900., 5000000.)
+        data = mock.Mock(profile=profile, bounds=mock.Mock(west=west, south=south, east=east, north=north))
+        data.data_check.return_value = full((1, 20, 30), 1000., dtype=float32)
+        clim = DtClimatology(os.path.join(self.root, 'built.tif'))
+        with mock.patch('met.thredds.GridMet', GridMet):
+            self.assertRaises(ValueError, clim.build, data, lat=0.8, years=[])
+            clim.build(data, lat=0.8, years=[2012, 2013])
+
+        # one request of each variable and year, on the coarse gridMET grid
+        self.assertEqual(requests, [('tmmn', 2012), ('tmmx', 2012), ('tmmn', 2013), ('tmmx', 2013)])
+        with rasopen(clim.path) as src:
+            self.assertEqual(src.count, DAYS)
+            self.assertAlmostEqual(src.res[0], GRIDMET_CELL)
+            self.assertLess(src.width, 10)
+
+        dt = clim.get(200, target_profile=profile)
+        self.assertEqual(dt.shape, (1, 20, 30))
+        expected = (daily_dt(tmin=281., tmax=301., doy=200, elevation=1000., lat=0.8,
+                             albedo=CLIMATOLOGY_ALBEDO))
+        testing.assert_allclose(dt, expected, rtol=1e-5)
+        # 2012 is the only leap year
+        testing.assert_allclose(clim.get(DAYS, target_profile=profile),
+                                daily_dt(tmin=280., tmax=300., doy=DAYS, elevation=1000., lat=0.8,
+                                         albedo=CLIMATOLOGY_ALBEDO), rtol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
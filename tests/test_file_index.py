@@ -0,0 +1,111 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+from threading import Thread
+
+from ssebop.collector import variable_path
+from ssebop.file_index import FileIndex, index_for
+from ssebop.storage import LocalStorage
+
+IMAGE_ID = 'LC80380272014227LGN00'
+
+
+class FileIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.year_dir = os.path.join(self.root, '38', '27', '2014')
+        self.image_dir = os.path.join(self.year_dir, IMAGE_ID)
+        os.makedirs(self.image_dir)
+        for var in ('tmax', 'pet'):
+            open(variable_path(self.image_dir, IMAGE_ID, var), 'w').close()
+        self.index = FileIndex(LocalStorage())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_listed_once(self):
+        for var in ('tmax', 'tmin', 'pet', 'fmask', 'tmax', 'pet'):
+            self.index.exists(variable_path(self.image_dir, IMAGE_ID, var))
+        self.assertEqual(self.index.listings, 1)
+        self.assertTrue(self.index.isfile(variable_path(self.image_dir, IMAGE_ID, 'pet')))
+        self.assertFalse(self.index.isfile(variable_path(self.image_dir, IMAGE_ID, 'tmin')))
+        self.assertTrue(self.index.isdir(self.image_dir))
+        self.assertFalse(self.index.isfile(self.image_dir))
+        self.assertEqual(self.index.stat(variable_path(self.image_dir, IMAGE_ID, 'pet')).size, 0)
+
+    def test_writer_records(self):
+        tmin = variable_path(self.image_dir, IMAGE_ID, 'tmin')
+        self.assertFalse(self.index.exists(tmin))
+        with self.index.writer(tmin) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('tmin')
+        self.assertTrue(self.index.isfile(tmin))
+        self.assertEqual(self.index.stat(tmin).size, 4)
+        self.assertEqual(self.index.listings, 1)
+
+        # the DEM is written in the year directory
+        dem = variable_path(self.image_dir, IMAGE_ID, 'dem')
+        self.assertFalse(self.index.exists(dem))
+        with self.index.writer(dem) as tmp:
+            open(tmp, 'w').close()
+        self.assertTrue(self.index.exists(dem))
+
+        scene = os.path.join(self.year_dir, 'LC80380272014243LGN00')
+        self.index.makedirs(os.path.join(scene, 'sub'))
+        self.assertTrue(self.index.isdir(scene))
+
+    def test_invalidate(self):
+        fmask = variable_path(self.image_dir, IMAGE_ID, 'fmask')
+        self.assertFalse(self.index.exists(fmask))
+        open(fmask, 'w').close()
+        # written outside the index, not seen until the listing is refreshed
+        self.assertFalse(self.index.exists(fmask))
+        self.index.invalidate(fmask)
+        self.assertTrue(self.index.exists(fmask))
+
+        expiring = FileIndex(max_age=0.)
+        self.assertTrue(expiring.exists(fmask))
+        os.remove(fmask)
+        self.assertFalse(expiring.exists(fmask))
+
+    def test_threads(self):
+        results = []
+
+        def check():
+            results.append(all(self.index.exists(variable_path(self.image_dir, IMAGE_ID, v))
+                               for v in ('tmax', 'pet')))
+
+        threads = [Thread(target=check) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [True] * 8)
+        self.assertEqual(self.index.listings, 1)
+
+    def test_registry(self):
+        self.assertIs(index_for(), index_for(LocalStorage()))
+        self.assertIs(index_for(self.index), self.index)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,95 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from ssebop.atomic import atomic_output
+from ssebop_app.journal import RunJournal, PENDING, RUNNING, DONE, FAILED, SKIPPED
+
+
+class RunJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.scenes = ['LC80380272014211LGN00', 'LC80380272014227LGN00', 'LC80380272014243LGN00']
+        self.journal = RunJournal.for_directory(self.root, max_retries=1)
+        self.journal.add(self.scenes)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_resume(self):
+        self.journal.mark(self.scenes[0], RUNNING)
+        self.journal.mark(self.scenes[0], DONE)
+        self.journal.mark(self.scenes[1], RUNNING)
+
+        restarted = RunJournal(self.journal.path)
+        self.assertEqual(restarted.state(self.scenes[0]), DONE)
+        self.assertEqual(restarted.state(self.scenes[1]), RUNNING)
+        self.assertEqual(restarted.state(self.scenes[2]), PENDING)
+        self.assertEqual(restarted.remaining(), self.scenes[1:])
+
+    def test_retry_policy(self):
+        self.journal.mark(self.scenes[2], FAILED, error='Traceback: ValueError')
+        self.assertTrue(self.journal.should_run(self.scenes[2]))
+        self.journal.mark(self.scenes[2], FAILED, error='Traceback: ValueError')
+        restarted = RunJournal(self.journal.path, max_retries=1)
+        self.assertFalse(restarted.should_run(self.scenes[2]))
+        self.assertEqual(restarted.errors[self.scenes[2]], 'Traceback: ValueError')
+        self.assertTrue(RunJournal(self.journal.path, max_retries=2).should_run(self.scenes[2]))
+
+    def test_skipped(self):
+        self.assertIsNone(self.journal.mean_run_seconds())
+        self.journal.mark(self.scenes[0], RUNNING)
+        self.journal.mark(self.scenes[0], DONE)
+        self.journal.mark(self.scenes[1], SKIPPED, reason='cloud cover 95.0% > 90.0%')
+
+        restarted = RunJournal(self.journal.path)
+        self.assertEqual(restarted.remaining(), self.scenes[2:])
+        self.assertEqual(restarted.reasons[self.scenes[1]], 'cloud cover 95.0% > 90.0%')
+        self.assertGreaterEqual(restarted.mean_run_seconds(), 0.)
+
+    def test_truncated_line(self):
+        with open(self.journal.path, 'a') as f:
+            f.write('{"image_id": "LC8038')
+        restarted = RunJournal(self.journal.path)
+        self.assertEqual(restarted.summary(), {PENDING: 3})
+
+    def test_atomic_output(self):
+        path = os.path.join(self.root, 'et.tif')
+        with atomic_output(path) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('done')
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.isfile(path))
+
+        failed = os.path.join(self.root, 'etrf.tif')
+        try:
+            with atomic_output(failed) as tmp:
+                with open(tmp, 'w') as f:
+                    f.write('partial')
+                raise MemoryError
+        except MemoryError:
+            pass
+        self.assertEqual(sorted(os.listdir(self.root)), ['et.tif', 'ssebop_journal.jsonl'])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
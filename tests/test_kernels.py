@@ -0,0 +1,96 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+
+from numpy import allclose, empty, float32, isnan, array_equal
+from rasterio import open as rasopen
+from rasterio.windows import Window
+
+from benchmarks.bench_kernels import IMAGE_TEST, SCENES, per_call
+from ssebop import kernels
+from ssebop.kernels import surface_parameters, coefficients, SurfaceParameters
+from ssebop.mtl import parse_mtl
+from ssebop.roi import crop
+from ssebop.screen import band_path
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class KernelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dirs = {sat: os.path.join(IMAGE_TEST, name) for sat, name in SCENES.items()}
+
+    def test_matches_per_call(self):
+        for sat, image_dir in self.dirs.items():
+            result = surface_parameters(image_dir, sat, engine='numpy')
+            for name, ref, arr in zip(SurfaceParameters._fields, per_call(image_dir, sat), result):
+                self.assertEqual(arr.dtype, float32)
+                self.assertEqual(arr.shape, ref.shape)
+                self.assertTrue(array_equal(isnan(arr), isnan(ref)), '{} {}'.format(sat, name))
+                self.assertTrue(allclose(arr, ref, rtol=1e-5, atol=1e-4, equal_nan=True),
+                                '{} {}'.format(sat, name))
+
+    def test_block_rows(self):
+        image_dir = self.dirs['LC8']
+        whole = surface_parameters(image_dir, 'LC8', engine='numpy', block_rows=10000)
+        blocked = surface_parameters(image_dir, 'LC8', engine='numpy', block_rows=37)
+        for a, b in zip(whole, blocked):
+            self.assertTrue(array_equal(a, b, equal_nan=True))
+
+    def test_window(self):
+        image_dir = self.dirs['LT5']
+        window = Window(120, 35, 200, 90)
+        part = surface_parameters(image_dir, 'LT5', engine='numpy', window=window, block_rows=40)
+        for a, b in zip(part, surface_parameters(image_dir, 'LT5', engine='numpy')):
+            self.assertTrue(array_equal(a, crop(b, window), equal_nan=True))
+
+    def test_loop_matches_block(self):
+        # the numba engine's loop, run as plain python on a few rows
+        image_dir = self.dirs['LE7']
+        meta = parse_mtl(image_dir)
+        coef = coefficients(meta, 'LE7')
+        dns = []
+        for band in coef.bands:
+            with rasopen(band_path(image_dir, meta, band)) as src:
+                dns.append(src.read(1)[100:104])
+        out = [empty(dns[0].shape, dtype=float32) for _ in range(3)]
+        kernels._surface_loop(*(dns + [coef.gains, coef.offsets, coef.k1, coef.k2] + out))
+        for a, b in zip(out, kernels.surface_block(dns, coef)):
+            self.assertTrue(allclose(a, b, rtol=1e-5, atol=1e-4, equal_nan=True))
+
+    @unittest.skipIf(numba is None, 'numba is not installed')
+    def test_numba(self):
+        for sat, image_dir in self.dirs.items():
+            fast = surface_parameters(image_dir, sat, engine='numba')
+            for a, b in zip(fast, surface_parameters(image_dir, sat, engine='numpy')):
+                self.assertTrue(allclose(a, b, rtol=1e-5, atol=1e-4, equal_nan=True))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            surface_parameters(self.dirs['LC8'], 'LC8', engine='fortran')
+        with self.assertRaises(KeyError):
+            surface_parameters(self.dirs['LC8'], 'LC7')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,107 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from numpy import where, nan, float32, float64, array_equal
+from numpy.random import RandomState
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from ssebop.dt_climatology import daily_dt
+from ssebop.lazy import read_lazy, as_lazy, et_graph, store_rasters, lazy_daily_dt
+
+
+class LazyBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.profile = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1,
+                        'height': 70, 'width': 50, 'nodata': None,
+                        'crs': CRS({'init': 'epsg:32612'}),
+                        'transform': from_origin(300000., 5000000., 30., 30.)}
+        rs = RandomState(1)
+        shape = (1, 70, 50)
+        self.ts = (rs.uniform(280., 320., shape[1:])).astype(float64)
+        self.dt = rs.uniform(5., 15., shape).astype(float64)
+        self.ta = rs.uniform(285., 305., shape).astype(float32)
+        self.pet = rs.uniform(3., 9., shape).astype(float32)
+        self.fmask = (rs.uniform(0., 1., shape) > 0.8).astype('uint8')
+        self.c = float64(0.98123)
+
+        self.paths = {}
+        for name in ('tmax', 'pet', 'fmask'):
+            arr = {'tmax': self.ta, 'pet': self.pet, 'fmask': self.fmask}[name]
+            path = os.path.join(self.root, '{}.tif'.format(name))
+            profile = dict(self.profile)
+            profile['dtype'] = str(arr.dtype)
+            with rasopen(path, 'w', **profile) as dst:
+                dst.write(arr)
+            self.paths[name] = path
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_windowed_read(self):
+        arr = read_lazy(self.paths['tmax'], chunk_size=32)
+        self.assertEqual(arr.shape, (1, 70, 50))
+        self.assertEqual(arr.chunks[1], (32, 32, 6))
+        self.assertTrue(array_equal(arr[:, 40:60, 10:45].compute(), self.ta[:, 40:60, 10:45]))
+
+    def test_bit_compatible(self):
+        tc = self.c * self.ta
+        th = tc + self.dt
+        etrf = (th - self.ts) / self.dt
+        et = self.pet * etrf
+        et_mskd = where(self.fmask == 0, et, nan)
+
+        outputs = et_graph(ts=as_lazy(self.ts, 32), c=self.c,
+                           ta=read_lazy(self.paths['tmax'], 32),
+                           dt=as_lazy(self.dt, 32),
+                           pet=read_lazy(self.paths['pet'], 32),
+                           clear=read_lazy(self.paths['fmask'], 32) == 0)
+        files = {os.path.join(self.root, '{}_out.tif'.format(k)): v for k, v in outputs.items()}
+        store_rasters(files, self.profile, chunk_size=32)
+
+        expected = {'ssebop_et_mskd': et_mskd, 'ssebop_et': et, 'ssebop_etrf': etrf}
+        for name, arr in expected.items():
+            with rasopen(os.path.join(self.root, '{}_out.tif'.format(name))) as src:
+                written = src.read()
+            self.assertEqual(written.dtype, arr.dtype)
+            self.assertTrue(array_equal(written, arr, equal_nan=True))
+
+    def test_daily_dt(self):
+        rs = RandomState(2)
+        tmin = rs.uniform(270., 285., (1, 70, 50)).astype(float32)
+        dem = rs.uniform(900., 2000., (1, 70, 50)).astype(float32)
+        albedo = rs.uniform(0.1, 0.3, (70, 50)).astype(float32)
+        expected = daily_dt(tmin=tmin, tmax=self.ta, doy=193, elevation=dem, lat=0.8, albedo=albedo)
+
+        dt = lazy_daily_dt(tmin=as_lazy(tmin, 32), tmax=read_lazy(self.paths['tmax'], 32), doy=193,
+                           elevation=as_lazy(dem, 32), lat=0.8, albedo=as_lazy(albedo, 16))
+        self.assertEqual(dt.chunks, as_lazy(tmin, 32).chunks)
+        computed = dt.compute()
+        self.assertEqual(computed.dtype, expected.dtype)
+        self.assertTrue(array_equal(computed, expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,99 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import json
+import shutil
+import logging
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import mkdtemp
+
+from click.testing import CliRunner
+
+from ssebop_app.cli import cli
+from ssebop_app.log import (configure_logging, stop_logging, pool_logging, scene_logger,
+                            verbosity_level, LOGGER_NAME)
+
+IMAGE_ID = 'LC80400282014193LGN00'
+
+
+def _log_in_worker(image_id):
+    scene_logger(image_id, 'ssebop.masks').info('worker %s', os.getpid())
+    return os.getpid()
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.path = os.path.join(self.root, 'ssebop.log')
+
+    def tearDown(self):
+        stop_logging()
+        shutil.rmtree(self.root)
+
+    def _lines(self):
+        stop_logging()
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_levels(self):
+        self.assertEqual(verbosity_level(), logging.INFO)
+        self.assertEqual(verbosity_level(verbose=2), logging.DEBUG)
+        self.assertEqual(verbosity_level(verbose=1, quiet=True), logging.WARNING)
+
+        configure_logging(level=logging.WARNING, log_file=self.path, stream=False)
+        log = scene_logger(IMAGE_ID, 'ssebop.ssebop')
+        log.info('not written')
+        log.warning('c is %.2f', 1.5)
+        logging.getLogger('ssebop.collector').error('no scene')
+        lines = self._lines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('WARNING', lines[0])
+        self.assertIn('ssebop.ssebop [{}] c is 1.50'.format(IMAGE_ID), lines[0])
+        self.assertIn('ssebop.collector [-] no scene', lines[1])
+        self.assertTrue(logging.getLogger(LOGGER_NAME).propagate)
+
+    def test_json(self):
+        configure_logging(level=logging.DEBUG, log_file=self.path, as_json=True, stream=False)
+        scene_logger(IMAGE_ID, 'ssebop.ssebop').debug('configuration: %s', 'x=1')
+        entry = json.loads(self._lines()[0])
+        self.assertEqual(entry['image_id'], IMAGE_ID)
+        self.assertEqual(entry['level'], 'DEBUG')
+        self.assertEqual(entry['message'], 'configuration: x=1')
+
+    def test_workers(self):
+        configure_logging(log_file=self.path, stream=False)
+        with ProcessPoolExecutor(2, **pool_logging()) as pool:
+            pids = set(pool.map(_log_in_worker, [IMAGE_ID] * 4))
+        lines = self._lines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(all('[{}] worker'.format(IMAGE_ID) in line for line in lines))
+        self.assertEqual(set(int(line.split()[-1]) for line in lines), pids)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_cli(self):
+        config = os.path.join(self.root, 'config.yml')
+        result = CliRunner().invoke(cli, ['-q', '--log-file', self.path, 'mkconfig', '--path', config])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.isfile(config))
+        self.assertFalse(logging.getLogger(LOGGER_NAME).handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,154 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import time
+import unittest
+from tempfile import mkdtemp
+from unittest import mock
+
+from numpy import zeros, uint8, arange, isnan, ones, shares_memory
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from ssebop import masks
+from ssebop.collector import SSEBopData
+from ssebop.file_index import index_for
+from ssebop.masks import (QAMask, save_mask, batch_fmask, mask_path, mask_is_current,
+                          satellite_of, WRITTEN, CURRENT, FAILED, CLOUD, SHADOW, SNOW, WATER)
+
+SHAPE = (300, 400)
+PROFILE = {'driver': 'GTiff', 'dtype': 'uint16', 'count': 1, 'height': SHAPE[0],
+           'width': SHAPE[1], 'crs': CRS.from_epsg(32612),
+           'transform': from_origin(300000., 5000000., 30., 30.)}
+
+
+class _Image(object):
+    rasterio_geometry = PROFILE
+
+
+def _mask():
+    mask = zeros(SHAPE, dtype=uint8)
+    mask[:100, :150] = 1
+    return mask
+
+
+class MaskTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.scenes = []
+        for image_id in ('LC80380272014193LGN00', 'LE70380272014201EDC00'):
+            image_dir = os.path.join(self.root, '38', '27', '2014', image_id)
+            os.makedirs(image_dir)
+            open(os.path.join(image_dir, '{}_MTL.txt'.format(image_id)), 'w').close()
+            self.scenes.append(image_dir)
+        index_for().invalidate()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_mask(self):
+        path = mask_path(self.scenes[0])
+        save_mask(_mask(), path, PROFILE)
+        with rasopen(path) as src:
+            self.assertEqual(src.dtypes[0], 'uint8')
+            # a combined fmask is stored at one bit per pixel
+            self.assertEqual(src.tags(1, 'IMAGE_STRUCTURE')['NBITS'], '1')
+            self.assertEqual(src.compression.value, 'DEFLATE')
+            self.assertEqual(src.block_shapes[0], (masks.BLOCK_SIZE, masks.BLOCK_SIZE))
+            self.assertEqual(src.overviews(1), list(masks.OVERVIEWS))
+            self.assertEqual(int(src.read(1).sum()), 100 * 150)
+        self.assertEqual(os.listdir(self.scenes[0]).count(os.path.basename(path)), 1)
+
+        # the model's data_check reads the precomputed mask instead of running Fmask
+        data = SSEBopData('LC80380272014193LGN00', self.scenes[0], PROFILE['transform'],
+                          PROFILE, clip_geo=None, date=None)
+        self.assertEqual(data.data_check('fmask').shape, (1,) + SHAPE)
+
+    def test_qa_mask(self):
+        flags = arange(16, dtype=uint8).reshape(1, 4, 4)
+        qa = QAMask(flags)
+        self.assertEqual(qa.shape, (4, 4))
+        # the flags are a view, not a copy
+        self.assertTrue(shares_memory(qa.flags, flags))
+        self.assertFalse(qa.binary)
+        # water alone is clear
+        self.assertEqual(qa.clear.ravel().tolist(), [v in (0, WATER) for v in range(16)])
+        self.assertIs(qa.clear, qa.clear)
+        self.assertEqual(int(qa.flagged(SHADOW | SNOW).sum()), 12)
+        self.assertEqual(qa.clear_fraction(), 2 / 16.)
+
+        et = qa.where_clear(ones((1, 4, 4)))
+        self.assertEqual(int(isnan(et).sum()), 14)
+        self.assertTrue(QAMask(_mask()).binary)
+        self.assertEqual(QAMask(_mask()).clear.sum(), SHAPE[0] * SHAPE[1] - 100 * 150)
+
+        # more than the cloud bit is kept as uint8
+        path = mask_path(self.scenes[0])
+        flags = _mask() * (CLOUD | SNOW)
+        save_mask(flags, path, PROFILE)
+        with rasopen(path) as src:
+            self.assertNotIn('NBITS', src.tags(1, 'IMAGE_STRUCTURE'))
+            self.assertEqual(int(src.read(1).max()), CLOUD | SNOW)
+
+    def test_current(self):
+        self.assertFalse(mask_is_current(self.scenes[0]))
+        save_mask(_mask(), mask_path(self.scenes[0]), PROFILE)
+        self.assertTrue(mask_is_current(self.scenes[0]))
+
+        # a reprocessed scene has a newer MTL
+        mtl = os.path.join(self.scenes[0], 'LC80380272014193LGN00_MTL.txt')
+        later = time.time() + 60
+        os.utime(mtl, (later, later))
+        index_for().invalidate()
+        self.assertFalse(mask_is_current(self.scenes[0]))
+
+    def test_batch(self):
+        with mock.patch.object(masks, 'landsat_image', return_value=_Image()), \
+                mock.patch.object(masks, 'compute_fmask', return_value=_mask()) as compute:
+            results = batch_fmask(self.root, workers=1)
+            self.assertEqual([r[1] for r in results], [WRITTEN, WRITTEN])
+            self.assertEqual([r[0] for r in results], self.scenes)
+
+            results = batch_fmask(self.root, workers=1)
+            self.assertEqual([r[1] for r in results], [CURRENT, CURRENT])
+            self.assertEqual(compute.call_count, 2)
+
+            batch_fmask(self.root, workers=1, overwrite=True)
+            self.assertEqual(compute.call_count, 4)
+
+    def test_pool_failures(self):
+        # scenes without bands fail in the worker and are reported, not raised
+        bad = os.path.join(self.root, 'XX9')
+        os.makedirs(bad)
+        open(os.path.join(bad, 'XX9_MTL.txt'), 'w').close()
+        results = batch_fmask(self.root, workers=2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(set(r[1] for r in results), {FAILED})
+        self.assertIn('Invalid satellite', [r for r in results if r[0] == bad][0][3])
+
+    def test_satellite_of(self):
+        self.assertEqual(satellite_of('LC80380272014193LGN00'), 'LC8')
+        self.assertEqual(satellite_of('LT05_L1TP_040028_20060706_20160909_01_T1'), 'LT5')
+        self.assertEqual(satellite_of('LE07_L1TP_038027_20140720_20161111_01_T1'), 'LE7')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
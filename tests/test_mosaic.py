@@ -0,0 +1,100 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from numpy import full, nan, isnan, float32, array_equal
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from ssebop.mosaic import Mosaic, mosaic, find_outputs
+
+EARLY = 'LC80380272014227LGN00_ssebop_et_mskd.tif'
+LATE = 'LC80380282014243LGN00_ssebop_et_mskd.tif'
+
+
+def _write(path, arr, west, north):
+    profile = {'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'height': arr.shape[0],
+               'width': arr.shape[1], 'crs': CRS.from_epsg(32612),
+               'transform': from_origin(west, north, 30., 30.)}
+    with rasopen(path, 'w', **profile) as dst:
+        dst.write(arr, 1)
+
+
+class MosaicTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        # two 40 x 40 scenes overlapping by 20 rows, the early one mostly clear
+        early = full((40, 40), 1., dtype=float32)
+        early[:5] = nan
+        late = full((40, 40), 3., dtype=float32)
+        late[:20, :30] = nan
+        self.early = os.path.join(self.root, EARLY)
+        self.late = os.path.join(self.root, LATE)
+        _write(self.early, early, 300000., 5001200.)
+        _write(self.late, late, 300000., 5000600.)
+        self.inputs = [self.early, self.late]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _read(self, path):
+        with rasopen(path) as src:
+            return src.read(1)
+
+    def test_find_outputs(self):
+        self.assertEqual(find_outputs(self.root), sorted(self.inputs))
+
+    def test_latest(self):
+        out = mosaic(self.inputs, os.path.join(self.root, 'latest.tif'), block_size=16)
+        arr = self._read(out)
+        self.assertEqual(arr.shape, (60, 40))
+        self.assertTrue(isnan(arr[0, 0]))
+        self.assertEqual(arr[10, 0], 1.)
+        # overlap: the late scene where it is valid, the early scene under its gap
+        self.assertEqual(arr[25, 0], 1.)
+        self.assertEqual(arr[25, 35], 3.)
+        self.assertEqual(arr[50, 0], 3.)
+
+    def test_max_clear(self):
+        m = Mosaic(self.inputs, rule='max-clear', block_size=16)
+        self.assertEqual([s.path for s in m.sources], [self.early, self.late])
+        arr = self._read(m.write(os.path.join(self.root, 'clear.tif')))
+        self.assertEqual(arr[25, 35], 1.)
+        self.assertEqual(arr[45, 35], 3.)
+
+    def test_mean(self):
+        arr = self._read(mosaic(self.inputs, os.path.join(self.root, 'mean.tif'), rule='mean'))
+        self.assertEqual(arr[25, 35], 2.)
+        self.assertEqual(arr[25, 0], 1.)
+
+    def test_vrt(self):
+        tif = self._read(mosaic(self.inputs, os.path.join(self.root, 'latest.tif')))
+        vrt = self._read(mosaic(self.inputs, os.path.join(self.root, 'latest.vrt')))
+        self.assertTrue(array_equal(isnan(tif), isnan(vrt)))
+        self.assertTrue(array_equal(tif[~isnan(tif)], vrt[~isnan(vrt)]))
+        self.assertRaises(ValueError, mosaic, self.inputs, os.path.join(self.root, 'm.vrt'),
+                          rule='mean')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
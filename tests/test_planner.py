@@ -0,0 +1,107 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import json
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from ssebop.mtl import parse_mtl
+from ssebop_app.config import Config
+from ssebop_app.planner import plan, scene_shape
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'image_test', 'lc8_image')
+MTL = 'LC80400282014193LGN00_MTL.txt'
+
+CONFIG = '''
+path: 38
+row: 27
+root: {}
+satellite: LC8
+start_date: 20140801
+end_date: 20140930
+backend: numpy
+'''
+
+
+class PlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        year_dir = os.path.join(self.root, '38', '27', '2014')
+        self.todo = os.path.join(year_dir, 'LC80380272014227LGN00')
+        self.done = os.path.join(year_dir, 'LC80380272014243LGN00')
+        for d in (self.todo, self.done):
+            os.makedirs(d)
+            shutil.copy(os.path.join(DATA, MTL), d)
+        os.makedirs(os.path.join(year_dir, 'LE70380272014235EDC00'))
+        open(os.path.join(self.todo, 'LC80380272014227LGN00_tmax.tif'), 'w').close()
+        for p in ('ssebop_et_mskd', 'pet', 'lst', 'ssebop_et', 'ssebop_etrf'):
+            open(os.path.join(self.done, 'LC80380272014243LGN00_{}.tif'.format(p)), 'w').close()
+
+        self.config_path = os.path.join(self.root, 'config.yml')
+        with open(self.config_path, 'w') as f:
+            f.write(CONFIG.format(self.root))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_mtl(self):
+        meta = parse_mtl(self.todo)
+        self.assertEqual(meta['landsat_scene_id'], 'LC80400282014193LGN00')
+        self.assertEqual(meta['cloud_cover'], 7.55)
+        self.assertEqual(scene_shape(self.todo), (8071, 7951))
+
+    def test_plan(self):
+        before = sorted(os.walk(self.root))
+        result = plan(Config(self.config_path, build_runspecs=False))
+        self.assertEqual(sorted(os.walk(self.root)), before)
+
+        summary = result['summary']
+        self.assertEqual((summary['scenes'], summary['done'], summary['todo']), (2, 1, 1))
+
+        scene = result['scenes'][0]
+        self.assertEqual(scene['image_id'], 'LC80380272014227LGN00')
+        tasks = [(t['action'], t['name']) for t in scene['tasks']]
+        self.assertEqual(tasks, [('download', 'pet'), ('compute', 'fmask'), ('download', 'tmin'),
+                                 ('download', 'dem'), ('compute', 'dt'), ('run', 'ssebop')])
+        self.assertEqual(scene['download_bytes'], 3 * 8071 * 7951 * 8)
+        self.assertEqual(scene['peak_memory'], 10 * 8071 * 7951 * 8)
+        self.assertEqual(result['scenes'][1]['tasks'], [])
+        json.dumps(result)
+
+    def test_plan_refet(self):
+        with open(self.config_path, 'a') as f:
+            f.write('pet_source: refet\n')
+        scene = plan(Config(self.config_path, build_runspecs=False))['scenes'][0]
+        tasks = [(t['action'], t['name']) for t in scene['tasks']]
+        self.assertEqual(tasks, [('download', 'met_cube'), ('compute', 'fmask'), ('download', 'tmin'),
+                                 ('download', 'dem'), ('compute', 'dt'), ('run', 'ssebop')])
+        # a year of the five variables over the scene, a few megabytes
+        self.assertLess(scene['tasks'][0]['bytes'], 50e6)
+
+    def test_plan_roi(self):
+        # the products of the whole scene are not those of an ROI
+        with open(self.config_path, 'a') as f:
+            f.write('roi: [-112.0, 45.0, -111.9, 45.1]\n')
+        summary = plan(Config(self.config_path, build_runspecs=False))['summary']
+        self.assertEqual((summary['scenes'], summary['done'], summary['todo']), (2, 0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,102 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import json
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+import numpy
+from click.testing import CliRunner
+
+from ssebop.roi import Roi
+from ssebop_app.cli import cli
+from ssebop_app.profiling import SceneProfiler, profiled, aggregate, report, package_of
+
+IMAGE_IDS = ('LC80400282014193LGN00', 'LC80400282014209LGN00')
+
+
+def _work(n):
+    # a little time in this repo, numpy and the standard library
+    Roi.from_bbox(-113.6, 45.0, -113.5, 45.2).tag
+    json.dumps(list(range(n)))
+    return numpy.ones((n, n)).sum()
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.directory = os.path.join(self.root, 'profiles')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_scene(self):
+        profiler = SceneProfiler(self.directory, memory=True)
+        for image_id in IMAGE_IDS:
+            with profiled(profiler, image_id):
+                _work(300)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['{}.prof'.format(i) for i in IMAGE_IDS] +
+                                ['{}.mem.txt'.format(i) for i in IMAGE_IDS]))
+        with open(profiler.path(IMAGE_IDS[0], '.mem.txt')) as f:
+            self.assertIn('peak traced memory', f.readline())
+
+        with profiled(None, IMAGE_IDS[0]) as profile:
+            self.assertIsNone(profile)
+
+    def test_failed_scene(self):
+        profiler = SceneProfiler(self.directory)
+        with self.assertRaises(ZeroDivisionError):
+            with profiler.scene(IMAGE_IDS[0]):
+                1 / 0
+        self.assertTrue(os.path.isfile(profiler.path(IMAGE_IDS[0])))
+
+    def test_report(self):
+        profiler = SceneProfiler(self.directory)
+        for image_id in IMAGE_IDS:
+            with profiler.scene(image_id):
+                _work(200)
+
+        functions, count = aggregate([self.directory])
+        self.assertEqual(count, 2)
+        work = [v for k, v in functions.items() if k[2] == '_work'][0]
+        self.assertEqual((work['scenes'], work['calls']), (2, 2))
+        self.assertEqual(package_of(numpy.__file__), 'numpy')
+        self.assertEqual(package_of(json.__file__), 'stdlib')
+        self.assertEqual(package_of(os.path.join('repo', 'ssebop', 'roi.py')), 'ssebop')
+
+        text = report([self.directory], top=5, package='ssebop')
+        self.assertIn('2 scene profiles', text)
+        listed = text.split('function')[-1].strip().splitlines()
+        self.assertTrue(0 < len(listed) <= 5)
+        self.assertTrue(all('ssebop' in line for line in listed))
+        self.assertRaises(ValueError, report, [self.directory], sort='ncalls')
+
+        result = CliRunner().invoke(cli, ['profile-report', self.directory, '--sort', 'cumtime'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('_work', result.output)
+
+    def test_run_option(self):
+        result = CliRunner().invoke(cli, ['run', '--help'])
+        self.assertIn('--profile', result.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,182 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from unittest import mock
+
+import refet
+from numpy import arange, float32, full, allclose, array_equal, isnan
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from ssebop.collector import SSEBopData, variable_path
+from ssebop.refet_grid import (MetCube, MET_VARIABLES, GRIDMET_CELL, GRIDMET_ORIGIN, met_grid,
+                               grid_bounds, reference_et, actual_vapor_pressure)
+from ssebop.warp_cache import WarpPlan
+
+IMAGE_ID = 'LC80400282014193LGN00'
+DATE = datetime(2014, 7, 12)
+
+# a small UTM scene in the cube below
+SCENE = {'crs': CRS.from_epsg(32612), 'transform': from_origin(300015., 5000015., 30., 30.),
+         'height': 120, 'width': 150}
+
+# day of year values, constant in space so the warped met is known exactly
+MET = {'tmin': 280., 'tmax': 300., 'wind': 3., 'humidity': 0.006, 'radiation': 280.}
+
+
+class RefetGridTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.path_row_dir = os.path.join(self.root, '040', '028')
+        self.cube = MetCube.for_path_row(self.path_row_dir)
+        self.grid = met_grid(-113.6, 45.0, -113.5, 45.2)
+        days = arange(1, 366, dtype=float32)[:, None, None]
+        shape = (365, self.grid['height'], self.grid['width'])
+        for variable in MET_VARIABLES:
+            # varies by day, the value of DATE is MET
+            cube = full(shape, MET[variable], dtype=float32) + (days - 193) * 0.001
+            self.cube.write(variable, 2014, cube, self.grid)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_grid(self):
+        t = self.grid['transform']
+        # on the gridMET cells
+        cols, rows = (t.c - GRIDMET_ORIGIN[0]) / GRIDMET_CELL, (GRIDMET_ORIGIN[1] - t.f) / GRIDMET_CELL
+        self.assertAlmostEqual(cols, round(cols), places=6)
+        self.assertAlmostEqual(rows, round(rows), places=6)
+        west, south, east, north = grid_bounds(self.grid)
+        self.assertTrue(west < -113.6 and south < 45.0 and east > -113.5 and north > 45.2)
+
+    def test_reference_et(self):
+        ea = actual_vapor_pressure(0.006, 1000.)
+        expected = refet.Daily(tmin=6.85, tmax=26.85, ea=ea, rs=280. * 0.0864, uz=3., zw=10.,
+                               elev=1000., lat=45., doy=193, method='asce').eto()
+        eto = reference_et(280., 300., 0.006, 280., 3., 1000., 45., 193)
+        self.assertTrue(allclose(eto, expected, rtol=1e-5))
+        etr = reference_et(280., 300., 0.006, 280., 3., 1000., 45., 193, ref_crop='etr')
+        self.assertTrue((etr > eto).all())
+
+        # a stack of days at once
+        stack = reference_et(full((3, 2, 2), 280.), 300., 0.006, 280., 3., full((2, 2), 1000.), 45.,
+                             arange(192, 195)[:, None, None])
+        self.assertEqual(stack.shape, (3, 2, 2))
+        self.assertTrue(allclose(stack[1], eto, rtol=1e-5))
+        self.assertRaises(ValueError, reference_et, 280., 300., 0.006, 280., 3., 1000., 45., 193,
+                          ref_crop='kc')
+
+    def test_cube(self):
+        self.assertTrue(self.cube.exists(2014))
+        self.assertFalse(self.cube.exists(2015))
+        # from the grid bounds, without a warp plan
+        with mock.patch.object(WarpPlan, 'compute', side_effect=AssertionError):
+            self.assertTrue(self.cube.covers(2014, SCENE))
+            # across the cube's east edge
+            shifted = dict(SCENE, transform=from_origin(306015., 5000015., 30., 30.))
+            self.assertFalse(self.cube.covers(2014, shifted))
+        self.assertTrue(allclose(self.cube.day(DATE)['humidity'], 0.006))
+        self.assertRaises(ValueError, self.cube.write, 'tmin', 2015,
+                          full((366, self.grid['height'], self.grid['width']), 280.), self.grid)
+
+        elevation = full((1, 120, 150), 1000., dtype=float32)
+        elevation[0, :, :10] = 2000.
+        eto = self.cube.reference_et(DATE, SCENE, elevation)
+        self.assertEqual(eto.shape, (1, 120, 150))
+        self.assertEqual(eto.dtype, float32)
+        lat = 45.13
+        self.assertTrue(allclose(eto[0, :, 10:], reference_et(elevation=1000., lat=lat, doy=193,
+                                                              q=MET['humidity'], rs=MET['radiation'],
+                                                              uz=MET['wind'], tmin=MET['tmin'],
+                                                              tmax=MET['tmax']), rtol=1e-3))
+        self.assertFalse(allclose(eto[0, 0, 0], eto[0, 0, 10], rtol=1e-3))
+        blocked = self.cube.reference_et(DATE, SCENE, elevation, block_rows=7)
+        self.assertTrue(array_equal(blocked, eto))
+
+        outside = dict(SCENE, transform=from_origin(500015., 5000015., 30., 30.))
+        self.assertFalse(self.cube.covers(2014, outside))
+        self.assertRaises(ValueError, self.cube.reference_et, DATE, outside, elevation)
+
+    def test_collector(self):
+        image_dir = os.path.join(self.path_row_dir, '2014', IMAGE_ID)
+        os.makedirs(image_dir)
+        meta = dict(SCENE, driver='GTiff', count=1, dtype='float32')
+        with rasopen(variable_path(image_dir, IMAGE_ID, 'dem'), 'w', **meta) as dst:
+            dst.write(full((1, 120, 150), 1000., dtype=float32))
+
+        data = SSEBopData(IMAGE_ID, image_dir, SCENE['transform'], meta, clip_geo=None,
+                          date=DATE, pet_source='refet', ref_crop='etr')
+        etr = data.data_check('pet')
+        self.assertEqual(etr.shape, (1, 120, 150))
+        self.assertFalse(isnan(etr).any())
+        path = variable_path(image_dir, IMAGE_ID, 'pet', pet_source='refet', ref_crop='etr')
+        self.assertTrue(path.endswith('_pet_refet_etr.tif'))
+        with rasopen(path) as src:
+            self.assertTrue(array_equal(src.read(), etr))
+        eto = self.cube.reference_et(DATE, SCENE, full((1, 120, 150), 1000.))
+        self.assertTrue((etr > eto).all())
+
+        # the grass reference of the same source is cached apart, not read from the alfalfa's
+        data.ref_crop = 'eto'
+        self.assertTrue(array_equal(data.data_check('pet'), eto))
+        self.assertTrue(os.path.isfile(data.variable_path('pet')))
+        self.assertFalse(os.path.isfile(variable_path(image_dir, IMAGE_ID, 'pet')))
+
+    def test_partial_year(self):
+        # a cube built on May 10th, 2016, day 131 of the leap year
+        shape = (130, self.grid['height'], self.grid['width'])
+        for variable in MET_VARIABLES:
+            self.cube.write(variable, 2016, full(shape, MET[variable], dtype=float32), self.grid)
+        self.assertEqual(self.cube.days(2016), 130)
+        self.assertEqual(self.cube.days(2014), 365)
+        with rasopen(self.cube.path('tmin', 2016)) as src:
+            self.assertEqual(src.count, 366)
+            self.assertTrue(isnan(src.read(131)).all())
+        self.assertTrue(self.cube.covers(2016, SCENE, doy=130))
+        self.assertFalse(self.cube.covers(2016, SCENE, doy=131))
+        elevation = full((1, 120, 150), 1000., dtype=float32)
+        self.assertRaises(ValueError, self.cube.reference_et, datetime(2016, 7, 12), SCENE, elevation)
+
+        # a date past the last day rebuilds the cube
+        image_dir = os.path.join(self.path_row_dir, '2016', IMAGE_ID)
+        os.makedirs(image_dir)
+        meta = dict(SCENE, driver='GTiff', count=1, dtype='float32')
+        with rasopen(variable_path(image_dir, IMAGE_ID, 'dem'), 'w', **meta) as dst:
+            dst.write(elevation)
+        data = SSEBopData(IMAGE_ID, image_dir, SCENE['transform'], meta, clip_geo=None,
+                          date=datetime(2016, 7, 12), pet_source='refet')
+
+        def build(cube, year, bounds):
+            for variable in MET_VARIABLES:
+                cube.write(variable, year, full((200,) + shape[1:], MET[variable]), self.grid)
+
+        with mock.patch.object(MetCube, 'build', autospec=True, side_effect=build) as built:
+            eto = data.data_check('pet')
+        self.assertEqual(built.call_count, 1)
+        self.assertEqual(self.cube.days(2016), 200)
+        self.assertFalse(isnan(eto).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
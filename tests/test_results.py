@@ -0,0 +1,150 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from numpy import full, float32, uint8, testing
+from rasterio import open as rasopen
+
+try:
+    import xarray
+except ImportError:
+    xarray = None
+
+from ssebop.collector import variable_path
+from ssebop.results import SceneResult, SceneArrays, PRODUCTS
+from ssebop.ssebop import SSEBopModel
+from ssebop_app.image import iter_images
+from tests.test_threads import _Scene, _write, IMAGE_IDS
+
+
+class ResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.profile = _Scene(IMAGE_IDS[0]).rasterio_geometry
+        self.profile.update({'driver': 'GTiff', 'tiled': False})
+        self.profile.pop('blockysize')
+        self.profile.pop('blockxsize')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _model(self, i, image_id, **kwargs):
+        image_dir = os.path.join(self.root, '2014', image_id)
+        os.makedirs(image_dir)
+        inputs = {'tmax': 280. + i, 'tmin': 265. + i, 'pet': 5. + i, 'dem': 1000.}
+        for var, value in inputs.items():
+            _write(variable_path(image_dir, image_id, var), value, self.profile)
+        _write(variable_path(image_dir, image_id, 'fmask'), 0, self.profile, dtype=uint8)
+        model = SSEBopModel(image=_Scene(image_id), image_id=image_id, image_dir=image_dir,
+                            parent_dir=os.path.dirname(image_dir), satellite='LC8',
+                            image_date=datetime.strptime(image_id[9:16], '%Y%j'),
+                            path=40, row=28, image_exists=True, **kwargs)
+        model.configure_run()
+        return model
+
+    def test_run(self):
+        model = self._model(0, IMAGE_IDS[0])
+        result = model.run(write=False)
+        self.assertEqual(result.keys(), list(PRODUCTS))
+        self.assertEqual(result['ssebop_et'].shape, result.shape)
+        self.assertEqual(result.c, model.c_estimate.c)
+        self.assertEqual(result.transform, self.profile['transform'])
+        # pet is also the input, fetched to the same file
+        self.assertFalse(any(os.path.isfile(model._output_filename(p)) for p in PRODUCTS if p != 'pet'))
+
+        written = model.run()
+        for product in PRODUCTS:
+            with rasopen(model._output_filename(product)) as src:
+                testing.assert_array_equal(src.read(1), result[product])
+            testing.assert_array_equal(written[product], result[product])
+
+        # a completed run returns its products from their files
+        model.check_products()
+        existing = model.run()
+        self.assertEqual(sorted(existing.paths), sorted(PRODUCTS))
+        testing.assert_array_equal(existing['ssebop_etrf'], result['ssebop_etrf'])
+
+    def test_dask_and_scratch(self):
+        expected = self._model(0, IMAGE_IDS[0]).run(write=False)
+        lazy = self._model(1, IMAGE_IDS[1], backend='dask').run(write=False)
+        self.assertEqual(lazy.keys(), list(PRODUCTS))
+
+        scratch = self._model(2, IMAGE_IDS[2], scratch_dir=os.path.join(self.root, 'scratch'))
+        result = scratch.run(write=False)
+        self.assertFalse(os.path.isdir(os.path.join(self.root, 'scratch', IMAGE_IDS[2])))
+        self.assertEqual(float(result['pet'][0, 0]), 7.)
+        testing.assert_array_equal(result['lst'], expected['lst'])
+
+    def test_scene_arrays(self):
+        model = self._model(0, IMAGE_IDS[0])
+        expected = model.run(write=False)
+        shape = expected.shape
+        arrays = SceneArrays(IMAGE_IDS[0], model.image_date, model.profile,
+                             ts=expected['lst'], ndvi=model.image.ndvi(),
+                             tmax=full(shape, 280., dtype=float32), dt=model.difference_temp(),
+                             pet=full(shape, 5., dtype=float32), fmask=full(shape, 0, dtype=uint8))
+        result = arrays.run()
+        self.assertEqual(result.c, expected.c)
+        for product in PRODUCTS:
+            testing.assert_allclose(result[product], expected[product], rtol=1e-6)
+
+        paths = result.save(os.path.join(self.root, 'saved'))
+        with rasopen(paths['ssebop_et']) as src:
+            testing.assert_array_equal(src.read(1), result['ssebop_et'])
+        self.assertRaises(ValueError, SceneArrays, IMAGE_IDS[0], model.image_date, model.profile,
+                          ts=expected['lst'][:10], ndvi=expected['lst'], tmax=expected['lst'],
+                          dt=expected['lst'], pet=expected['lst'], fmask=expected['lst'])
+
+    @unittest.skipIf(xarray is None, 'xarray is not installed')
+    def test_xarray(self):
+        result = self._model(0, IMAGE_IDS[0]).run(write=False)
+        ds = result.to_xarray()
+        self.assertEqual(ds['ssebop_et'].dims, ('y', 'x'))
+        t = result.transform
+        self.assertAlmostEqual(float(ds.x[0]), t.c + t.a / 2.)
+        self.assertAlmostEqual(float(ds.y[-1]), t.f + (result.shape[0] - 0.5) * t.e)
+        self.assertEqual(ds.attrs['c_factor'], result.c)
+
+    def test_iter_images(self):
+        models = [self._model(i, image_id) for i, image_id in enumerate(IMAGE_IDS)]
+        arrays = SceneArrays('LC80400282014257LGN00', datetime(2014, 9, 14),
+                             dict(models[0].profile, height=10, width=10),
+                             ts=full((10, 10), 300.), ndvi=full((10, 10), 0.1), tmax=full((10, 10), 290.),
+                             dt=full((10, 10), 15.), pet=full((10, 10), 5.),
+                             fmask=full((10, 10), 0, dtype=uint8))
+        scenes = [dict(landsat_object=m.image, image_id=m.image_id, image_dir=m.image_dir,
+                       parent_dir=m.parent_dir, satellite='LC8', image_date=m.image_date,
+                       path=40, row=28, image_exists=True) for m in models]
+        # no dense vegetation in arrays, so no result
+        results = list(iter_images(scenes + [arrays], workers=3))
+        self.assertEqual(sorted(r.image_id for r in results), IMAGE_IDS)
+        self.assertEqual(len(set(r.c for r in results)), len(IMAGE_IDS))
+        self.assertFalse(os.path.isfile(models[0]._output_filename('ssebop_et')))
+
+        first = next(iter_images(scenes, write=True))
+        self.assertIsInstance(first, SceneResult)
+        self.assertTrue(os.path.isfile(models[0]._output_filename('ssebop_et')))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,204 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import json
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from numpy import arange, array_equal, float32, isnan, nan, testing
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import transform
+from rasterio.windows import Window
+
+from ssebop.collector import SSEBopData, variable_path
+from ssebop.roi import Roi, RoiError, covering_window, crop, pixel_offset, shift, window_profile
+from ssebop.ssebop import SSEBopModel
+from tests.test_threads import _Scene, _write, IMAGE_IDS
+
+PROFILE = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1, 'height': 200, 'width': 300,
+           'crs': CRS.from_epsg(32612), 'transform': from_origin(300000., 5000000., 30., 30.)}
+
+
+def _bbox(profile, rows, cols):
+    """ Geographic bbox of the corners of a block of pixels, shrunk by a pixel. """
+    t = profile['transform']
+    xs = [t.c + (c + 1) * t.a for c in cols]
+    ys = [t.f + (r + 1) * t.e for r in rows]
+    lon, lat = transform(profile['crs'], 'EPSG:4326', xs + xs[::-1], ys + ys)
+    return [min(lon), min(lat), max(lon), max(lat)]
+
+
+class RoiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_window(self):
+        roi = Roi.from_config(_bbox(PROFILE, (50, 99), (100, 179)))
+        window = roi.window(PROFILE)
+        # the bbox of a projected geographic bbox covers a little more than the block
+        self.assertLessEqual(window.row_off, 51)
+        self.assertGreaterEqual(window.row_off + window.height, 99)
+        self.assertLessEqual(window.col_off, 101)
+        self.assertGreaterEqual(window.col_off + window.width, 179)
+        self.assertLess(window.width, 120)
+
+        profile = window_profile(PROFILE, window)
+        self.assertEqual((profile['height'], profile['width']), (window.height, window.width))
+        self.assertEqual(covering_window(PROFILE, profile), window)
+        self.assertIsNone(covering_window(profile, PROFILE))
+        self.assertIsNone(covering_window(PROFILE, PROFILE))
+        self.assertEqual(pixel_offset(profile, PROFILE), (-window.row_off, -window.col_off))
+
+        arr = arange(200 * 300).reshape(1, 200, 300)
+        self.assertEqual(crop(arr, window).shape, (1, window.height, window.width))
+        self.assertEqual(int(crop(arr, window)[0, 0, 0]), window.row_off * 300 + window.col_off)
+
+        outside = roi.outside(profile)
+        self.assertTrue(outside.any() and not outside.all())
+
+    def test_shift(self):
+        arr = arange(200 * 300, dtype=float32).reshape(200, 300)
+        # 10 rows south and 20 columns west of PROFILE
+        profile = dict(PROFILE, transform=from_origin(299400., 4999700., 30., 30.))
+        self.assertEqual(pixel_offset(PROFILE, profile), (10, -20))
+        out = shift(arr, PROFILE, profile, nan)
+        self.assertTrue(isnan(out[:, :20]).all())
+        self.assertTrue(isnan(out[190:]).all())
+        self.assertTrue(array_equal(out[:190, 20:], arr[10:, :280]))
+
+        half = dict(PROFILE, transform=from_origin(300015., 5000000., 30., 30.))
+        self.assertIsNone(pixel_offset(PROFILE, half))
+        self.assertIsNone(shift(arr, PROFILE, half, nan))
+
+    def test_config(self):
+        self.assertIsNone(Roi.from_config(None))
+        path = os.path.join(self.root, 'district.geojson')
+        bbox = _bbox(PROFILE, (10, 40), (10, 40))
+        with open(path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'properties': {},
+                 'geometry': Roi.from_bbox(*bbox).geometries[0]}]}, f)
+        roi = Roi.from_config(path)
+        self.assertEqual(roi.tag, Roi.from_config(bbox).tag)
+        self.assertEqual(roi.window(PROFILE), Roi.from_config(bbox).window(PROFILE))
+
+        for bad in ([1., 2., 3.], [5., 0., 1., 1.], os.path.join(self.root, 'missing.json')):
+            with self.assertRaises(RoiError):
+                Roi.from_config(bad)
+        far = Roi.from_bbox(10., 10., 11., 11.)
+        with self.assertRaises(RoiError):
+            far.window(PROFILE)
+
+    def test_data_check(self):
+        image_dir = os.path.join(self.root, '2014', IMAGE_IDS[0])
+        os.makedirs(image_dir)
+        scene = dict(PROFILE)
+        with rasopen(variable_path(image_dir, IMAGE_IDS[0], 'tmax'), 'w', **scene) as dst:
+            dst.write(arange(200 * 300, dtype='float32').reshape(1, 200, 300))
+
+        window = Window(100, 50, 80, 40)
+        profile = window_profile(scene, window)
+        data = SSEBopData(IMAGE_IDS[0], image_dir, profile['transform'], profile,
+                          clip_geo=None, date=datetime(2014, 7, 12), tag='roi0')
+        self.assertTrue(data.request('tmax').path.endswith('_tmax_roi0.tif'))
+        self.assertTrue(data.request('fmask').path.endswith('_fmask.tif'))
+        tmax = data.data_check('tmax')
+        self.assertEqual(tmax.shape, (1, 40, 80))
+        self.assertEqual(float(tmax[0, 0, 0]), 50 * 300 + 100)
+
+    def _model(self, run, **kwargs):
+        image_id = IMAGE_IDS[0]
+        image_dir = os.path.join(self.root, run, '2014', image_id)
+        os.makedirs(image_dir, exist_ok=True)
+        scene = _Scene(image_id)
+        profile = dict(scene.rasterio_geometry, driver='GTiff', tiled=False)
+        profile.pop('blockxsize'), profile.pop('blockysize')
+        for var, value in {'tmax': 280., 'tmin': 265., 'pet': 6., 'dem': 1000.}.items():
+            _write(variable_path(image_dir, image_id, var), value, profile)
+        _write(variable_path(image_dir, image_id, 'fmask'), 0, profile, dtype='uint8')
+
+        model = SSEBopModel(image=scene, image_id=image_id, image_dir=image_dir,
+                            parent_dir=os.path.dirname(image_dir), satellite='LC8',
+                            image_date=datetime(2014, 7, 12), path=40, row=28,
+                            image_exists=True, **kwargs)
+        model.configure_run()
+        return model
+
+    @staticmethod
+    def _read(model, product):
+        with rasopen(model._output_filename(product)) as src:
+            return src.read(), src.profile
+
+    def test_run(self):
+        full = self._model('full')
+        full.run()
+        geometry = full.image.rasterio_geometry
+        bbox = _bbox(geometry, (200, 399), (300, 549))
+
+        for extent in ('scene', 'roi'):
+            model = self._model(extent, roi=Roi.from_config(bbox), c_factor_extent=extent)
+            model.run()
+            window = model.window
+            etrf, profile = self._read(model, 'ssebop_etrf')
+            self.assertEqual(etrf.shape, (1, window.height, window.width))
+            self.assertEqual(covering_window(geometry, profile), window)
+
+            full_etrf, _ = self._read(full, 'ssebop_etrf')
+            if extent == 'scene':
+                self.assertEqual(model.c_estimate.c, full.c_estimate.c)
+                testing.assert_array_equal(etrf, crop(full_etrf, window))
+            else:
+                self.assertLess(model.c_estimate.count, full.c_estimate.count)
+
+            # et_mskd is masked outside the bbox polygon, projected into the window
+            et_mskd, _ = self._read(model, 'ssebop_et_mskd')
+            outside = model.roi.outside(profile)
+            self.assertTrue(isnan(et_mskd[0][outside]).all())
+            self.assertFalse(isnan(et_mskd[0][~outside]).all())
+
+    def test_roi_then_scene(self):
+        geometry = _Scene(IMAGE_IDS[0]).rasterio_geometry
+        roi = self._model('shared', roi=Roi.from_config(_bbox(geometry, (200, 399), (300, 549))))
+        roi.run()
+
+        # the scene's products are not the ROI's, in the same directory
+        full = self._model('shared')
+        self.assertFalse(full.completed)
+        full.run()
+        self.assertNotEqual(full._output_filename('ssebop_et'), roi._output_filename('ssebop_et'))
+        etrf, _ = self._read(full, 'ssebop_etrf')
+        self.assertEqual(etrf.shape, (1, geometry['height'], geometry['width']))
+        roi_etrf, _ = self._read(roi, 'ssebop_etrf')
+        self.assertEqual(roi_etrf.shape, (1, roi.window.height, roi.window.width))
+
+        # both runs are done
+        for model in (roi, full):
+            model.check_products()
+            self.assertTrue(model.completed)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
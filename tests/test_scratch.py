@@ -0,0 +1,158 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+import tracemalloc
+from datetime import datetime
+from multiprocessing import Pool
+from tempfile import mkdtemp
+
+from numpy import arange, float32, uint8, memmap, array_equal, full, linspace, tile
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from ssebop.collector import variable_path
+from ssebop.scratch import ScratchStore
+from ssebop.ssebop import SSEBopModel
+
+IMAGE_ID = 'LC80400282014193LGN00'
+
+# rows and columns of the scene of test_peak_memory
+SIZE = 1200
+
+
+def _double_row(args):
+    store, row = args
+    lst = store.get('lst')
+    out = store.get('out', mode='r+')
+    out[row] = lst[row] * 2
+    out.flush()
+    return row
+
+
+class _LargeScene(object):
+    """ A SIZE x SIZE scene, NDVI rising west to east, in place of a sat_image Landsat8. """
+
+    corner_ul_lat_product = 45.9
+    corner_ll_lat_product = 45.7
+    date_acquired = datetime(2014, 7, 12)
+
+    def __init__(self):
+        self.rasterio_geometry = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1, 'nodata': None,
+                                  'height': SIZE, 'width': SIZE, 'crs': CRS.from_epsg(32612),
+                                  'transform': from_origin(300000., 5000000., 30., 30.)}
+
+    def ndvi(self):
+        return tile(linspace(0.1, 0.9, SIZE, dtype=float32), (SIZE, 1))
+
+    def land_surface_temp(self):
+        return 300. - 15. * self.ndvi()
+
+    def albedo(self):
+        return full((SIZE, SIZE), 0.2, dtype=float32)
+
+    def get_tile_geometry(self):
+        return None
+
+
+class ScratchStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.store = ScratchStore.for_scene('LC80380272014227LGN00', self.root)
+        self.lst = arange(40 * 30, dtype=float32).reshape(40, 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_put_get(self):
+        kept = self.store.put('lst', self.lst)
+        self.assertIsInstance(kept, memmap)
+        self.assertTrue(array_equal(kept, self.lst))
+        self.assertFalse(kept.flags.writeable)
+        self.assertIn('lst', self.store)
+        self.assertEqual(self.store.names(), ['lst'])
+        self.assertRaises(KeyError, self.store.get, 'ndvi')
+
+    def test_shared_with_pool(self):
+        self.store.put('lst', self.lst)
+        self.store.empty('out', self.lst.shape, self.lst.dtype)
+        pool = Pool(2)
+        try:
+            rows = pool.map(_double_row, [(self.store, r) for r in range(self.lst.shape[0])])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(len(rows), 40)
+        self.assertTrue(array_equal(self.store.get('out'), self.lst * 2))
+
+    def test_blockwise(self):
+        kept = self.store.put('lst', self.lst)
+        ndvi = self.lst.reshape(1, 40, 30) / 1200.
+        out = self.store.blockwise('out', lambda lst, ndvi: lst * ndvi + 2., (kept, ndvi), block_rows=7)
+        self.assertIsInstance(out, memmap)
+        self.assertEqual(out.shape, (1, 40, 30))
+        self.assertEqual(out.dtype, (self.lst * ndvi).dtype)
+        self.assertTrue(array_equal(out, self.lst * ndvi + 2.))
+
+    def _model(self, run, **kwargs):
+        image_dir = os.path.join(self.root, run, '2014', IMAGE_ID)
+        os.makedirs(image_dir)
+        scene = _LargeScene()
+        profile = scene.rasterio_geometry
+        for var, value in {'tmax': 280., 'tmin': 265., 'pet': 5., 'dem': 1000.}.items():
+            with rasopen(variable_path(image_dir, IMAGE_ID, var), 'w', **profile) as dst:
+                dst.write(full((1, SIZE, SIZE), value, dtype=float32))
+        with rasopen(variable_path(image_dir, IMAGE_ID, 'fmask'), 'w', **dict(profile, dtype='uint8')) as dst:
+            dst.write(full((1, SIZE, SIZE), 0, dtype=uint8))
+        model = SSEBopModel(image=scene, image_id=IMAGE_ID, image_dir=image_dir,
+                            parent_dir=os.path.dirname(image_dir), satellite='LC8',
+                            image_date=scene.date_acquired, path=40, row=28, image_exists=True,
+                            **kwargs)
+        model.configure_run()
+        return model
+
+    @staticmethod
+    def _peak(model):
+        tracemalloc.start()
+        try:
+            result = model.run()
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_peak_memory(self):
+        in_memory, peak = self._peak(self._model('memory'))
+        scratch, scratch_peak = self._peak(self._model('scratch', scratch_dir=self.root))
+        for product in SSEBopModel.products:
+            self.assertTrue(array_equal(scratch[product], in_memory[product], equal_nan=True))
+        # the surface and c-factor arrays, not a full-scene array per ET step
+        self.assertLess(scratch_peak, peak / 2.)
+
+    def test_cleanup(self):
+        with ScratchStore.for_scene('LC80380272014243LGN00', self.root) as store:
+            store.put('fmask', self.lst.astype('uint8'))
+            root = store.root
+            self.assertTrue(os.path.isdir(root))
+        self.assertFalse(os.path.exists(root))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
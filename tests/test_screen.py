@@ -0,0 +1,67 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import unittest
+
+from numpy import array, uint16
+
+from ssebop.screen import screen_scene, bqa_cloud
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'image_test')
+
+
+class ScreenTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lc8 = os.path.join(DATA, 'lc8_image')
+        self.le7 = os.path.join(DATA, 'le7_image')
+
+    def test_passes(self):
+        result = screen_scene(self.lc8, 'LC8')
+        self.assertTrue(result)
+        self.assertEqual(list(result.checks), ['cloud_cover', 'valid', 'cold_pixels'])
+        # the decimated estimate is close to the full resolution count
+        full = screen_scene(self.lc8, 'LC8', factor=1).checks['cold_pixels']
+        self.assertLess(abs(result.checks['cold_pixels'] - full), 0.1 * full)
+
+    def test_cloud_cover(self):
+        result = screen_scene(self.lc8, 'LC8', max_cloud_cover=5.)
+        self.assertFalse(result)
+        self.assertIn('cloud cover', result.reason)
+        self.assertEqual(list(result.checks), ['cloud_cover'])
+
+    def test_valid_fraction(self):
+        result = screen_scene(self.lc8, 'LC8', min_valid=1.01)
+        self.assertFalse(result)
+        self.assertIn('footprint', result.reason)
+
+    def test_no_cold_pixels(self):
+        # the LE7 test scene has no vegetation with ndvi > 0.7
+        result = screen_scene(self.le7, 'LE7')
+        self.assertFalse(result)
+        self.assertEqual(result.checks['cold_pixels'], 0)
+
+    def test_bqa_cloud(self):
+        c1 = array([0, 1, 16, 752], dtype=uint16)
+        self.assertEqual(bqa_cloud(c1).tolist(), [False, False, True, True])
+        pre = array([0, 1 << 14, 3 << 14], dtype=uint16)
+        self.assertEqual(bqa_cloud(pre, collection=False).tolist(), [False, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,209 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from unittest import mock
+
+from numpy import arange, float32, array_equal
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from click.testing import CliRunner
+
+from ssebop.dt_climatology import DtClimatology, DAYS, DT_CLIMATOLOGY_FILE
+from ssebop.storage import LocalStorage, S3Storage, storage_for
+from ssebop_app import cli
+from ssebop_app.config import Config
+from ssebop_app.journal import RunJournal, DONE, JOURNAL_FILE
+from ssebop_app.paths import paths
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+IMAGE_ID = 'LC80380272014227LGN00'
+PROFILE = {'driver': 'GTiff', 'count': 1, 'dtype': 'float32', 'height': 20, 'width': 30,
+           'crs': CRS.from_epsg(32612), 'transform': from_origin(300000., 5000000., 30., 30.)}
+
+
+def _write(storage, path, arr):
+    with storage.writer(path) as tmp:
+        with rasopen(tmp, 'w', **PROFILE) as dst:
+            dst.write(arr, 1)
+
+
+def _spec(root):
+    return {'path': 38, 'row': 27, 'root': root, 'use_existing_images': False,
+            'start_date': datetime(2014, 8, 1), 'end_date': datetime(2014, 9, 30),
+            'image_dir': '/'.join([root, '38', '27', '2014', IMAGE_ID])}
+
+
+class LocalStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.storage = storage_for(self.root)
+        self.arr = arange(600, dtype=float32).reshape(20, 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_layout(self):
+        self.assertIsInstance(self.storage, LocalStorage)
+        spec = _spec(self.root)
+        self.assertFalse(paths.configure_project_dirs(spec, storage=self.storage))
+        self.assertTrue(os.path.isdir(os.path.join(self.root, '38', '27', '2014')))
+
+        path = os.path.join(self.root, '38', '27', '2014', '{}_tmax.tif'.format(IMAGE_ID))
+        _write(self.storage, path, self.arr)
+        self.assertTrue(self.storage.exists(path))
+        with self.storage.open(path) as src:
+            self.assertTrue(array_equal(src.read(1), self.arr))
+
+
+@unittest.skipIf(mock_aws is None, 'boto3 and moto are needed for the S3 backend tests')
+class S3StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='ssebop')
+        self.cache = mkdtemp()
+        self.root = 's3://ssebop/archive'
+        self.storage = storage_for(self.root, cache_dir=self.cache)
+        self.image_dir = '/'.join([self.root, '38', '27', '2014', IMAGE_ID])
+        self.arr = arange(600, dtype=float32).reshape(20, 30)
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.cache)
+
+    def test_paths(self):
+        self.assertIsInstance(self.storage, S3Storage)
+        path = '{}/{}_et.tif'.format(self.image_dir, IMAGE_ID)
+        self.assertEqual(self.storage.split(path), ('ssebop', 'archive/38/27/2014/{}/{}_et.tif'.format(
+            IMAGE_ID, IMAGE_ID)))
+        self.assertTrue(self.storage.gdal_path(path).startswith('/vsis3/ssebop/archive/'))
+        env = S3Storage(endpoint_url='http://localhost:9000').gdal_env()
+        self.assertEqual((env['AWS_S3_ENDPOINT'], env['AWS_HTTPS']), ('localhost:9000', 'NO'))
+
+    def test_write_read(self):
+        path = '{}/{}_tmax.tif'.format(self.image_dir, IMAGE_ID)
+        self.assertFalse(self.storage.exists(path))
+        _write(self.storage, path, self.arr)
+        self.assertTrue(self.storage.exists(path))
+        self.assertTrue(self.storage.exists(self.image_dir))
+        self.assertEqual(self.storage.listdir(self.image_dir), ['{}_tmax.tif'.format(IMAGE_ID)])
+
+        # a second backend with an empty cache reads through to the store
+        cache = mkdtemp()
+        try:
+            other = S3Storage(cache_dir=cache)
+            with other.open(path) as src:
+                self.assertTrue(array_equal(src.read(1), self.arr))
+            self.assertTrue(os.path.isfile(other.cache_path(path)))
+        finally:
+            shutil.rmtree(cache)
+
+    def test_overwrite(self):
+        # without a cache_dir, the mirror in the temporary directory is refreshed too
+        storage = S3Storage()
+        path = '{}/{}_pet.tif'.format(self.image_dir, IMAGE_ID)
+        try:
+            _write(storage, path, self.arr)
+            with rasopen(storage.local_path(path)) as src:
+                self.assertTrue(array_equal(src.read(1), self.arr))
+            _write(storage, path, self.arr * 2)
+            with rasopen(storage.local_path(path)) as src:
+                self.assertTrue(array_equal(src.read(1), self.arr * 2))
+        finally:
+            shutil.rmtree(storage.cache_path(self.root))
+
+    def test_failed_write(self):
+        path = '{}/{}_et.tif'.format(self.image_dir, IMAGE_ID)
+        try:
+            with self.storage.writer(path) as tmp:
+                open(tmp, 'w').close()
+                raise MemoryError
+        except MemoryError:
+            pass
+        self.assertFalse(self.storage.exists(path))
+
+    def test_multipart(self):
+        storage = S3Storage(cache_dir=self.cache, multipart_threshold=5 * 1024 ** 2,
+                            multipart_chunksize=5 * 1024 ** 2)
+        path = '{}/big.bin'.format(self.image_dir)
+        with storage.writer(path) as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(os.urandom(11 * 1024 ** 2))
+        head = storage.client.head_object(Bucket='ssebop', Key=storage.split(path)[1])
+        self.assertEqual(head['ContentLength'], 11 * 1024 ** 2)
+        self.assertTrue(head['ETag'].strip('"').endswith('-3'))
+
+    def test_layout(self):
+        spec = _spec(self.root)
+        self.assertFalse(paths.configure_project_dirs(spec, storage=self.storage))
+
+        # a downloader writes the scene into the local mirror, which is then stored
+        local = self.storage.cache_path(self.image_dir)
+        os.makedirs(local)
+        for band in ('B4', 'B5', 'MTL'):
+            open(os.path.join(local, '{}_{}.TIF'.format(IMAGE_ID, band)), 'w').close()
+        self.storage.put_dir(self.image_dir)
+        self.assertTrue(paths.configure_project_dirs(spec, storage=self.storage))
+
+        shutil.rmtree(local)
+        self.assertEqual(len(os.listdir(self.storage.local_dir(self.image_dir))), 3)
+
+    def test_dt_climatology(self):
+        path_row_dir = '/'.join([self.root, '38', '27'])
+        clim = DtClimatology.for_path_row(path_row_dir, storage=self.storage)
+        self.assertFalse(clim.exists())
+        cube = arange(DAYS * 600, dtype=float32).reshape(DAYS, 20, 30)
+        clim.write(cube, PROFILE)
+        self.assertTrue(clim.exists())
+        self.assertIn(DT_CLIMATOLOGY_FILE, self.storage.listdir(path_row_dir))
+        self.assertTrue(array_equal(clim.get(200, target_profile=PROFILE)[0], cube[199]))
+
+    def test_cli_journal(self):
+        config = os.path.join(self.cache, 'config.yml')
+        with open(config, 'w') as f:
+            f.write('path: 38\nrow: 27\nroot: {}\ncache_dir: {}\nsatellite: LC8\n'
+                    'start_date: 20140801\nend_date: 20140930\n'.format(self.root, self.cache))
+
+        def run_scene(cfg, image, journal, group=None, profiler=None):
+            journal.mark(image, DONE)
+
+        with mock.patch.object(Config, 'get_image_list', return_value=[IMAGE_ID]), \
+                mock.patch.object(cli, 'run_scene', side_effect=run_scene):
+            result = CliRunner().invoke(cli.cli, ['run', config])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        # the journal is in the local mirror of the year directory
+        year_dir = self.storage.cache_path('/'.join([self.root, '38', '27', '2014']))
+        self.assertTrue(os.path.isfile(os.path.join(year_dir, JOURNAL_FILE)))
+        self.assertEqual(RunJournal.for_directory(year_dir).state(IMAGE_ID), DONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
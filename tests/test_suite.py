@@ -26,11 +26,61 @@ def suite():
     print('Testing.......................................')
 
     from tests.test_ssebop import SSEBopModelTestCaseLC8
+    from tests.test_dt_climatology import DtClimatologyTestCase
+    from tests.test_lazy import LazyBackendTestCase
+    from tests.test_broker import BrokerTestCase, RunSpecSerializeTestCase
+    from tests.test_journal import RunJournalTestCase
+    from tests.test_scratch import ScratchStoreTestCase
+    from tests.test_cli import CliStartupTestCase
+    from tests.test_planner import PlannerTestCase
+    from tests.test_composite import CompositeTestCase
+    from tests.test_mosaic import MosaicTestCase
+    from tests.test_screen import ScreenTestCase
+    from tests.test_c_factor import CFactorTestCase
+    from tests.test_storage import LocalStorageTestCase, S3StorageTestCase
+    from tests.test_file_index import FileIndexTestCase
+    from tests.test_threads import ThreadSafetyTestCase
+    from tests.test_cube import SeasonCubeTestCase
+    from tests.test_masks import MaskTestCase
+    from tests.test_kernels import KernelTestCase
+    from tests.test_roi import RoiTestCase
+    from tests.test_log import LogTestCase
+    from tests.test_warp_cache import WarpCacheTestCase
+    from tests.test_refet_grid import RefetGridTestCase
+    from tests.test_profiling import ProfilingTestCase
+    from tests.test_synthetic import SyntheticSceneTestCase
+    from tests.test_results import ResultsTestCase
 
     loader = unittest.TestLoader()
     test_suite = unittest.TestSuite()
 
-    tests = (SSEBopModelTestCaseLC8,)
+    tests = (SSEBopModelTestCaseLC8,
+             DtClimatologyTestCase,
+             LazyBackendTestCase,
+             BrokerTestCase,
+             RunSpecSerializeTestCase,
+             RunJournalTestCase,
+             ScratchStoreTestCase,
+             CliStartupTestCase,
+             PlannerTestCase,
+             CompositeTestCase,
+             MosaicTestCase,
+             ScreenTestCase,
+             CFactorTestCase,
+             LocalStorageTestCase,
+             S3StorageTestCase,
+             FileIndexTestCase,
+             ThreadSafetyTestCase,
+             SeasonCubeTestCase,
+             MaskTestCase,
+             KernelTestCase,
+             RoiTestCase,
+             LogTestCase,
+             WarpCacheTestCase,
+             RefetGridTestCase,
+             ProfilingTestCase,
+             SyntheticSceneTestCase,
+             ResultsTestCase)
 
     for t in tests:
         test_suite.addTest(loader.loadTestsFromTestCase(t))
@@ -0,0 +1,92 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from tempfile import mkdtemp
+
+from numpy import array_equal
+from rasterio import open as rasopen
+
+from benchmarks.synthetic import SyntheticScene, write_scenes, scene_ids, runspec, SATELLITE
+from benchmarks.stress import stress, format_results
+from ssebop.c_factor import c_factor_exact
+from ssebop.collector import variable_path
+from ssebop.kernels import surface_parameters
+from ssebop.masks import QAMask, mask_path
+from ssebop.mtl import parse_mtl
+
+SHAPE = (300, 400)
+
+
+def _read(path):
+    with rasopen(path) as src:
+        return src.read(1)
+
+
+class SyntheticSceneTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.scenes = write_scenes(self.root, 2, shape=SHAPE)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_scene(self):
+        image_id, image_dir = self.scenes[0]
+        self.assertEqual(image_dir, os.path.join(self.root, '40', '28', '2014', image_id))
+        meta = parse_mtl(image_dir)
+        self.assertEqual(meta['landsat_scene_id'], image_id)
+        self.assertEqual((meta['reflective_lines'], meta['reflective_samples']), SHAPE)
+        self.assertEqual(meta['date_acquired'], '2014-04-07')
+        self.assertEqual([i for i, _ in scene_ids(2)], [i for i, _ in self.scenes])
+        self.assertEqual(runspec(self.root, image_dir).image_id, image_id)
+
+        params = surface_parameters(image_dir, SATELLITE)
+        self.assertEqual(params.lst.shape, SHAPE)
+        tmax = _read(variable_path(image_dir, image_id, 'tmax'))
+        fmask = _read(mask_path(image_dir))
+        wet = (params.ndvi > 0.8) & (fmask == 0)
+        self.assertTrue(wet.any())
+        # irrigated fields a few degrees above the air
+        self.assertTrue(0. < (params.lst[wet] - tmax[wet]).mean() < 8.)
+        self.assertIsNotNone(c_factor_exact(params.lst, params.ndvi, tmax, QAMask(fmask).clear))
+
+    def test_seed(self):
+        image_id, image_dir = self.scenes[0]
+        other = SyntheticScene(image_id, scene_ids(1)[0][1], shape=SHAPE, seed=0)
+        copy = other.write(os.path.join(self.root, 'copy'))
+        for name in ('B10', 'B5'):
+            self.assertTrue(array_equal(
+                _read(os.path.join(image_dir, '{}_{}.TIF'.format(image_id, name))),
+                _read(os.path.join(copy, '{}_{}.TIF'.format(image_id, name)))))
+        # the second scene is drawn from the next seed
+        self.assertFalse(array_equal(_read(mask_path(image_dir)), _read(mask_path(self.scenes[1][1]))))
+
+    def test_stress(self):
+        results = stress([(100, 120)], 2, stage='inputs', root=os.path.join(self.root, 'stress'))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['scenes'], 2)
+        self.assertTrue(results[0]['peak_rss_mb'] > 0)
+        self.assertIn('100x120', format_results(results))
+        self.assertRaises(ValueError, stress, [(100, 120)], 1, stage='etf')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,235 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import time
+import shutil
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Event
+from unittest import mock
+from datetime import datetime
+from tempfile import mkdtemp
+
+from numpy import full, float32, uint8, errstate, testing
+from rasterio import open as rasopen
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from ssebop.atomic import atomic_output
+from ssebop.collector import SSEBopData, variable_path
+from ssebop.cube import SeasonCube
+from ssebop.ssebop import SSEBopModel
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'image_test', 'lc8_image')
+BAND = os.path.join(DATA, 'LC804014193_B{}.TIF')
+
+IMAGE_IDS = ['LC80400282014{}LGN00'.format(doy) for doy in (193, 209, 225, 241)]
+
+
+class _Scene(object):
+    """ The LC8 test scene with a synthetic surface temperature, in place of a sat_image Landsat8. """
+
+    corner_ul_lat_product = 45.9
+    corner_ll_lat_product = 45.7
+
+    def __init__(self, image_id):
+        with rasopen(BAND.format(4)) as red, rasopen(BAND.format(5)) as nir:
+            self.rasterio_geometry = red.profile.copy()
+            # TOA reflectance, the scaling of every LC8 MTL
+            self.red, self.nir = [b.read(1).astype(float32) * 2e-5 - 0.1 for b in (red, nir)]
+        self.date_acquired = datetime.strptime(image_id[9:16], '%Y%j')
+
+    def ndvi(self):
+        with errstate(divide='ignore', invalid='ignore'):
+            return (self.nir - self.red) / (self.nir + self.red)
+
+    def land_surface_temp(self):
+        return 300. - 15. * self.ndvi()
+
+    def albedo(self):
+        return full(self.red.shape, 0.2, dtype=float32)
+
+    def get_tile_geometry(self):
+        return None
+
+
+def _write(path, value, profile, dtype=float32):
+    meta = dict(profile, dtype=dtype, count=1)
+    with rasopen(path, 'w', **meta) as dst:
+        dst.write(full((1, profile['height'], profile['width']), value, dtype=dtype))
+
+
+def _fetcher(values, calls):
+    """ In place of SSEBopData's downloads: writes request's variable as values gives it,
+    slowly, so concurrent fetches of a file overlap. """
+    def fetch(data, request):
+        calls.append(request.path)
+        time.sleep(0.05)
+        arr = full(data.shape, values[request.variable], dtype=float32)
+        meta = dict(data.profile, driver='GTiff', count=1, dtype='float32')
+        with data.storage.writer(request.path) as tmp:
+            with rasopen(tmp, 'w', **meta) as dst:
+                dst.write(arr)
+        return arr
+    return fetch
+
+
+class ThreadSafetyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.profile = _Scene(IMAGE_IDS[0]).rasterio_geometry
+        self.profile.update({'driver': 'GTiff', 'tiled': False})
+        self.profile.pop('blockysize')
+        self.profile.pop('blockxsize')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _scene_inputs(self, run, i, image_id):
+        image_dir = os.path.join(self.root, run, '2014', image_id)
+        os.makedirs(image_dir)
+        # each scene has its own tmax, so outputs mixed up between scenes differ
+        inputs = {'tmax': 280. + i, 'tmin': 265. + i, 'pet': 5. + i, 'dem': 1000.}
+        for var, value in inputs.items():
+            _write(variable_path(image_dir, image_id, var), value, self.profile)
+        _write(variable_path(image_dir, image_id, 'fmask'), 0, self.profile, dtype=uint8)
+        return image_dir
+
+    def _model(self, run, i, image_id):
+        image_dir = self._scene_inputs(run, i, image_id)
+        model = SSEBopModel(image=_Scene(image_id), image_id=image_id, image_dir=image_dir,
+                            parent_dir=os.path.dirname(image_dir), satellite='LC8',
+                            image_date=datetime.strptime(image_id[9:16], '%Y%j'),
+                            path=40, row=28, image_exists=True)
+        model.configure_run()
+        return model
+
+    @staticmethod
+    def _read(model, product):
+        with rasopen(model._output_filename(product)) as src:
+            return src.read()
+
+    def test_data_check(self):
+        image_dir = self._scene_inputs('data', 0, IMAGE_IDS[0])
+        data = SSEBopData(IMAGE_IDS[0], image_dir, self.profile['transform'], self.profile,
+                          clip_geo=None, date=datetime(2014, 7, 12))
+        variables = ['tmax', 'tmin', 'pet', 'dem'] * 8
+
+        with ThreadPoolExecutor(8) as pool:
+            arrs = list(pool.map(lambda v: data.data_check(v, temp_units='K'), variables))
+
+        expected = {'tmax': 280., 'tmin': 265., 'pet': 5., 'dem': 1000.}
+        for var, arr in zip(variables, arrs):
+            self.assertEqual(float(arr[0, 0, 0]), expected[var])
+        self.assertEqual(data.request('pet').file_name, '{}_pet.tif'.format(IMAGE_IDS[0]))
+
+    def test_scenes_in_threads(self):
+        serial = [self._model('serial', i, image_id) for i, image_id in enumerate(IMAGE_IDS)]
+        for model in serial:
+            model.run()
+
+        threaded = [self._model('threads', i, image_id) for i, image_id in enumerate(IMAGE_IDS)]
+        geometries = [dict(m.image.rasterio_geometry) for m in threaded]
+        with ThreadPoolExecutor(len(threaded)) as pool:
+            list(pool.map(lambda m: m.run(), threaded))
+
+        for one, other, geometry in zip(serial, threaded, geometries):
+            self.assertEqual(one.c_estimate.c, other.c_estimate.c)
+            for product in SSEBopModel.products:
+                testing.assert_array_equal(self._read(one, product), self._read(other, product))
+            # products are written from a copy of the image geometry
+            self.assertEqual(other.image.rasterio_geometry, geometry)
+        self.assertEqual(len(set(m.c_estimate.c for m in threaded)), len(threaded))
+
+    def test_atomic_output(self):
+        path = os.path.join(self.root, 'dem.tif')
+        written, failed = Barrier(4), Event()
+
+        def write(i):
+            try:
+                with atomic_output(path) as tmp:
+                    with open(tmp, 'w') as f:
+                        f.write(str(i))
+                    # every thread has written its temporary file before any fails or lands
+                    written.wait()
+                    if i == 0:
+                        raise ValueError
+                    # the others land theirs after the failed write is cleaned up
+                    failed.wait()
+            except ValueError:
+                failed.set()
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(write, range(4)))
+        with open(path) as f:
+            self.assertIn(f.read(), ['1', '2', '3'])
+        self.assertEqual(os.listdir(self.root), ['dem.tif'])
+
+    def test_concurrent_fetch(self):
+        models = []
+        for image_id in IMAGE_IDS:
+            image_dir = os.path.join(self.root, 'fetch', '2014', image_id)
+            os.makedirs(image_dir)
+            _write(variable_path(image_dir, image_id, 'fmask'), 0, self.profile, dtype=uint8)
+            model = SSEBopModel(image=_Scene(image_id), image_id=image_id, image_dir=image_dir,
+                                parent_dir=os.path.dirname(image_dir), satellite='LC8',
+                                image_date=datetime.strptime(image_id[9:16], '%Y%j'),
+                                path=40, row=28, image_exists=True)
+            model.configure_run()
+            models.append(model)
+
+        calls = []
+        fetch = _fetcher({'tmax': 280., 'tmin': 265., 'pet': 5., 'dem': 1000.}, calls)
+        with mock.patch.object(SSEBopData, 'fetch_dem', fetch), \
+                mock.patch.object(SSEBopData, 'fetch_temp', fetch), \
+                mock.patch.object(SSEBopData, 'fetch_gridmet', fetch):
+            with ThreadPoolExecutor(len(models)) as pool:
+                list(pool.map(lambda m: m.run(), models))
+
+        dem = variable_path(models[0].image_dir, IMAGE_IDS[0], 'dem')
+        # the year directory's DEM is fetched by one scene and read by the others
+        self.assertEqual(calls.count(dem), 1)
+        self.assertEqual(len(calls), 1 + 3 * len(models))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(dem))), sorted(IMAGE_IDS + ['dem.tif']))
+        for model in models:
+            self.assertEqual(model.c_estimate.c, models[0].c_estimate.c)
+            self.assertTrue(all(os.path.isfile(model._output_filename(p)) for p in SSEBopModel.products))
+
+    @unittest.skipIf(netCDF4 is None, 'netCDF4 is not installed')
+    def test_season_cube(self):
+        models = [self._model('cube', i, image_id) for i, image_id in enumerate(IMAGE_IDS)]
+        for model in models:
+            model.cube = True
+        with ThreadPoolExecutor(len(models)) as pool:
+            list(pool.map(lambda m: m.run(), models))
+
+        cube = SeasonCube.for_year_dir(models[0].parent_dir)
+        self.assertEqual([s[0] for s in cube.scenes()], IMAGE_IDS)
+        _, pet_etrf = cube.pixel_series('et', 300, 300)
+        _, etrf = cube.pixel_series('etrf', 300, 300)
+        # pet is 5 + i in scene i
+        self.assertEqual([round(float(v), 4) for v in pet_etrf / etrf],
+                         [5., 6., 7., 8.])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
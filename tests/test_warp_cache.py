@@ -0,0 +1,178 @@
+# ===============================================================================
+# Copyright 2018 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import os
+import shutil
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+
+from numpy import arange, array, float32, floor, indices, zeros, testing, stack
+from rasterio import open as rasopen
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.warp import reproject, transform, Resampling
+
+from ssebop.collector import SSEBopData, variable_path
+from ssebop.warp_cache import PlanMemory, WarpCache, WarpPlan, path_row_cache, WARP_CACHE_DIR
+
+SCENE = {'crs': CRS.from_epsg(32612), 'transform': from_origin(300015., 5000015., 30., 30.),
+         'height': 300, 'width': 400}
+
+# a coarser grid around the scene, as a met or DEM input
+SOURCE = {'crs': CRS.from_epsg(32612), 'transform': from_origin(298000., 5002000., 90., 90.),
+          'height': 160, 'width': 180}
+
+GEOGRAPHIC = {'crs': CRS.from_epsg(4326), 'transform': from_origin(-113.56, 45.14, 0.001, 0.001),
+              'height': 110, 'width': 190}
+
+
+def _reproject(arr, source, target, fill=-1.):
+    out = zeros((target['height'], target['width']), dtype=float32) + fill
+    reproject(arr, out, src_transform=source['transform'], src_crs=source['crs'],
+              dst_transform=target['transform'], dst_crs=target['crs'],
+              resampling=Resampling.nearest)
+    return out
+
+
+class WarpCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _source(self, grid):
+        return arange(grid['height'] * grid['width'], dtype=float32).reshape(grid['height'],
+                                                                             grid['width'])
+
+    def test_same_crs(self):
+        arr = self._source(SOURCE)
+        plan = WarpPlan.compute(SOURCE, SCENE)
+        testing.assert_array_equal(plan.apply(arr, fill=-1.), _reproject(arr, SOURCE, SCENE))
+
+    def test_other_crs(self):
+        arr = self._source(GEOGRAPHIC)
+        warped = WarpPlan.compute(GEOGRAPHIC, SCENE).apply(arr, fill=0.)
+        expected = _reproject(arr, GEOGRAPHIC, SCENE, fill=0.)
+        self.assertFalse((expected == 0.).any())
+        # GDAL's approximate transformer allows 0.125 pixel errors, picking the neighbour
+        # source pixel near edges
+        self.assertLess((warped != expected).mean(), 0.03)
+
+        rows, cols = indices((SCENE['height'], SCENE['width']))
+        t = SCENE['transform']
+        xs, ys = transform(SCENE['crs'], GEOGRAPHIC['crs'], (t.c + (cols + .5) * t.a).ravel(),
+                           (t.f + (rows + .5) * t.e).ravel())
+        src_col, src_row = ~GEOGRAPHIC['transform'] * (array(xs), array(ys))
+        exact = arr[floor(src_row).astype(int), floor(src_col).astype(int)].reshape(rows.shape)
+        # interpolated between exactly transformed nodes
+        self.assertLess((warped != exact).mean(), 0.001)
+
+    def test_bands_and_fill(self):
+        arr = self._source(SOURCE)
+        plan = WarpPlan.compute(SOURCE, dict(SCENE, transform=from_origin(310000., 5000000., 30., 30.)))
+        both = plan.apply(stack([arr, arr * 2]), fill=-9.)
+        self.assertEqual(both.shape, (2, 300, 400))
+        testing.assert_array_equal(both[1], plan.apply(arr * 2, fill=-9.))
+        self.assertTrue((both[:, :, -1] == -9.).all())
+
+    def test_cache(self):
+        directory = os.path.join(self.root, WARP_CACHE_DIR)
+        cache = WarpCache(directory)
+        first = cache.plan(SOURCE, SCENE)
+        self.assertIs(cache.plan(dict(SOURCE), dict(SCENE)), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+        other = WarpCache(directory)
+        loaded = other.plan(SOURCE, SCENE)
+        self.assertEqual(other.misses, 0)
+        testing.assert_array_equal(loaded.index, first.index)
+
+    def test_memory(self):
+        plan = WarpPlan.compute(SOURCE, SCENE)
+        # a plan is its index, and the target pixels without a source pixel if there are any
+        self.assertEqual(plan.nbytes, 300 * 400 * 4)
+        east = WarpPlan.compute(SOURCE, dict(SCENE, transform=from_origin(310000., 5000000., 30., 30.)))
+        self.assertEqual(east.nbytes, 300 * 400 * 5)
+
+        # room for one plan
+        memory = PlanMemory(max_bytes=plan.nbytes)
+        small = WarpCache(memory=memory)
+        small.plan(SOURCE, SCENE)
+        small.plan(GEOGRAPHIC, SCENE)
+        small.plan(SOURCE, SCENE)
+        self.assertEqual(small.misses, 3)
+        self.assertEqual((len(memory), memory.nbytes), (1, plan.nbytes))
+
+        # shared by every cache, whatever its directory
+        other = WarpCache(os.path.join(self.root, WARP_CACHE_DIR), memory=memory)
+        self.assertIs(other.plan(SOURCE, SCENE), small.plan(SOURCE, SCENE))
+        self.assertEqual(other.misses, 0)
+
+        tiny = PlanMemory(max_bytes=plan.nbytes - 1)
+        tiny.put('key', plan)
+        self.assertEqual((len(tiny), tiny.nbytes), (0, 0))
+
+    def test_directory_bytes(self):
+        directory = os.path.join(self.root, WARP_CACHE_DIR)
+        cache = WarpCache(directory, memory=PlanMemory())
+        cache.plan(SOURCE, SCENE)
+        first = os.path.join(directory, os.listdir(directory)[0])
+        # saved compressed
+        self.assertLess(os.path.getsize(first), 300 * 400 * 4 / 4)
+
+        other = os.path.join(self.root, 'other')
+        WarpCache(other, memory=PlanMemory()).plan(GEOGRAPHIC, SCENE)
+        second = os.path.getsize(os.path.join(other, os.listdir(other)[0]))
+
+        # room for one plan file, the least recently used is removed
+        budget = max(os.path.getsize(first), second)
+        cache = WarpCache(directory, memory=PlanMemory(), max_bytes=budget)
+        os.utime(first, (0, 0))
+        cache.plan(GEOGRAPHIC, SCENE)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertFalse(os.path.exists(first))
+
+    def test_check_shape(self):
+        image_id = 'LC80400282014193LGN00'
+        image_dir = os.path.join(self.root, '040028', '2014', image_id)
+        os.makedirs(image_dir)
+        arr = self._source(SOURCE)
+        for var in ('tmax', 'tmin'):
+            meta = dict(SOURCE, driver='GTiff', count=1, dtype='float32', nodata=-1.)
+            with rasopen(variable_path(image_dir, image_id, var), 'w', **meta) as dst:
+                dst.write(arr[None])
+
+        profile = dict(SCENE, driver='GTiff', count=1, dtype='float32')
+        data = SSEBopData(image_id, image_dir, SCENE['transform'], profile, clip_geo=None,
+                          date=datetime(2014, 7, 12))
+        self.assertEqual(data.warps.directory,
+                         path_row_cache(os.path.join(self.root, '040028')).directory)
+        data.warps.clear()
+        tmax, tmin = data.data_check('tmax'), data.data_check('tmin')
+        self.assertEqual(tmax.shape, (1, 300, 400))
+        testing.assert_array_equal(tmax[0], _reproject(arr, SOURCE, SCENE))
+        testing.assert_array_equal(tmin, tmax)
+        # one transform for both variables
+        self.assertEqual(data.warps.misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================